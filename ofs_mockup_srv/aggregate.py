@@ -0,0 +1,57 @@
+"""
+Category totals for range aggregates.
+
+Totals are kept per category (``invoiceType:Normal``, ``transactionType:Refund``,
+``paymentType:Card``, ...) as (count, amount) with amounts in fixed-point units
+(see money.py), so sums are exact. The journal keeps running totals (see
+columns.py), so the totals for a date range are the difference of two prefixes
+found by binary search.
+"""
+
+from ofs_mockup_srv.money import SCALE
+from ofs_mockup_srv.records import Invoice
+
+ALL = "all"
+
+
+def categories(invoice: Invoice) -> dict[str, int]:
+    """Category -> amount in units contributed by one issued invoice (records.Invoice)."""
+    total = invoice.total
+    if total is None:
+        raise ValueError("only issued invoices have category totals")
+    out = {
+        ALL: total,
+        "invoiceType:" + invoice.invoice_type: total,
+        "transactionType:" + invoice.transaction_type: total,
+    }
+    for payment in invoice.payments:
+        key = "paymentType:" + payment.payment_type
+        out[key] = out.get(key, 0) + payment.amount
+    return out
+
+
+def merge(a: dict, b: dict, sign: int = 1) -> dict:
+    """``a + sign * b`` for prefix dicts."""
+    out = dict(a)
+    for key, (count, amount) in b.items():
+        c, m = out.get(key, (0, 0))
+        out[key] = (c + sign * count, m + sign * amount)
+    return out
+
+
+def report(totals: dict) -> dict:
+    """JSON-ready summary of category totals."""
+    count, amount = totals.get(ALL, (0, 0))
+    out = {
+        "count": count,
+        "totalAmount": amount / SCALE,
+        "invoiceTypes": {},
+        "transactionTypes": {},
+        "paymentTypes": {},
+    }
+    for key, (count, amount) in sorted(totals.items()):
+        if key == ALL or not count:
+            continue
+        dimension, _, value = key.partition(":")
+        out[dimension + "s"][value] = {"count": count, "totalAmount": amount / SCALE}
+    return out
@@ -0,0 +1,156 @@
+"""
+API key registry with per-key throttling.
+
+Keys are stored by SHA-256 digest, so lookup is a dict access whatever the
+number of keys, and the matched digest is confirmed with a constant-time
+comparison. Each key can carry a token bucket that emulates OFS request
+throttling. Verified ``Authorization`` headers are cached per client
+connection, so keep-alive clients skip hashing on every request.
+"""
+
+import hashlib
+import json
+import time
+from collections.abc import Callable
+
+from ofs_mockup_srv.cache import TTLCache
+
+
+def digest(token: str) -> bytes:
+    return hashlib.sha256(token.encode("utf-8")).digest()
+
+
+def bearer_token(header: str) -> str:
+    return header.replace("Bearer ", "").strip()
+
+
+class TokenBucket:
+    """Allows ``rate`` requests per second with bursts of up to ``burst``."""
+
+    __slots__ = ("rate", "burst", "tokens", "updated", "_clock")
+
+    def __init__(self, rate: float, burst: float | None = None, clock: Callable[[], float] = time.monotonic):
+        if rate <= 0:
+            raise ValueError(f"rate must be > 0, got {rate}")
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else max(rate, 1))
+        self.tokens = self.burst
+        self._clock = clock
+        self.updated = clock()
+
+    def take(self) -> bool:
+        now = self._clock()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def retry_after(self) -> float:
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+
+class ApiKey:
+    __slots__ = ("name", "digest", "bucket", "revoked", "requests", "throttled")
+
+    def __init__(self, name: str, key_digest: bytes, bucket: TokenBucket | None = None):
+        self.name = name
+        self.digest = key_digest
+        self.bucket = bucket
+        self.revoked = False
+        self.requests = 0
+        self.throttled = 0
+
+    def allow(self) -> bool:
+        self.requests += 1
+        if self.bucket is None or self.bucket.take():
+            return True
+        self.throttled += 1
+        return False
+
+    def describe(self) -> dict:
+        return {
+            "name": self.name,
+            "digest": self.digest.hex()[:12],
+            "rate": self.bucket.rate if self.bucket else None,
+            "burst": self.bucket.burst if self.bucket else None,
+            "requests": self.requests,
+            "throttled": self.throttled,
+        }
+
+
+class ApiKeyRegistry:
+    def __init__(self, session_ttl: float = 60.0, max_sessions: int = 10_000):
+        self._keys: dict[bytes, ApiKey] = {}
+        # (client address, Authorization header) -> ApiKey
+        self._sessions = TTLCache(maxsize=max_sessions, ttl=session_ttl)
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def add(self, key: str, rate: float | None = None, burst: float | None = None, name: str | None = None) -> ApiKey:
+        key_digest = digest(key)
+        old = self._keys.get(key_digest)
+        if old is not None:
+            old.revoked = True
+        entry = ApiKey(
+            name or key_digest.hex()[:12],
+            key_digest,
+            TokenBucket(rate, burst) if rate else None,
+        )
+        self._keys[key_digest] = entry
+        return entry
+
+    def remove(self, key: str) -> bool:
+        entry = self._keys.pop(digest(key), None)
+        if entry is None:
+            return False
+        # Cached sessions see the flag; no need to scan the session cache
+        entry.revoked = True
+        return True
+
+    def verify(self, token: str) -> ApiKey | None:
+        # Keys are looked up by the digest of the token, never compared as
+        # plain text, so lookup timing reveals nothing about a valid key
+        return self._keys.get(digest(token))
+
+    def authenticate(self, header: str, connection: object = None) -> ApiKey | None:
+        """Resolve an ``Authorization`` header, reusing the result for the same connection."""
+        session = (connection, header)
+        entry: ApiKey | None = self._sessions.get(session)
+        if entry is not None and not entry.revoked:
+            return entry
+        entry = self.verify(bearer_token(header))
+        if entry is not None:
+            self._sessions.set(session, entry)
+        return entry
+
+    def describe(self) -> list[dict]:
+        return [entry.describe() for entry in self._keys.values()]
+
+
+def parse_rate_limit(value: str | None) -> tuple[float | None, float | None]:
+    """Parse ``"rate[:burst]"`` (requests per second) into numbers."""
+    if not value:
+        return None, None
+    rate, _, burst = value.partition(":")
+    return float(rate), (float(burst) if burst else None)
+
+
+def load_registry(default_key: str, keys_file: str | None = None, rate_limit: str | None = None) -> ApiKeyRegistry:
+    """Registry with the default key plus any keys from a JSON file.
+
+    The file holds a list of ``{"key": ..., "rate": ..., "burst": ..., "name": ...}``
+    objects (or plain key strings).
+    """
+    registry = ApiKeyRegistry()
+    rate, burst = parse_rate_limit(rate_limit)
+    registry.add(default_key, rate, burst, name="default")
+    if keys_file:
+        with open(keys_file, "r", encoding="utf-8") as f:
+            for spec in json.load(f):
+                if isinstance(spec, str):
+                    spec = {"key": spec}
+                registry.add(spec["key"], spec.get("rate"), spec.get("burst"), spec.get("name"))
+    return registry
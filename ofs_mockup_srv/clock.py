@@ -0,0 +1,79 @@
+"""
+The device clock.
+
+Every timestamp the server hands out (sdcDateTime of invoices and status,
+scenario time windows) is read from one ``Clock``. It follows the wall clock
+until it is set: from then on it runs from the set time at ``rate`` real
+seconds per second (``rate=0`` stops it), and ``advance`` jumps it forward, so
+day rollovers or a year of receipts take seconds instead of a year.
+"""
+
+import datetime
+import time
+from collections.abc import Callable
+
+
+class Clock:
+    """Wall clock, or a virtual clock once ``set``, ``advance`` or a rate is applied."""
+
+    __slots__ = ("_wall", "_monotonic", "_base", "_started", "rate")
+
+    def __init__(
+        self, wall: Callable[[], float] = time.time, monotonic: Callable[[], float] = time.monotonic
+    ):
+        self._wall = wall
+        self._monotonic = monotonic
+        # Virtual epoch seconds at monotonic time ``_started``; None follows the wall clock
+        self._base: float | None = None
+        self._started = 0.0
+        self.rate = 1.0
+
+    @property
+    def virtual(self) -> bool:
+        return self._base is not None
+
+    def time(self) -> float:
+        """Epoch seconds."""
+        if self._base is None:
+            return self._wall()
+        return self._base + (self._monotonic() - self._started) * self.rate
+
+    def now(self) -> datetime.datetime:
+        """Local time, naive (like ``datetime.datetime.now()``)."""
+        return datetime.datetime.fromtimestamp(self.time())
+
+    def set(self, when: datetime.datetime | float, rate: float | None = None) -> None:
+        """Run from ``when`` (naive datetimes are local time, floats epoch seconds)."""
+        if rate is not None:
+            if rate < 0:
+                raise ValueError(f"rate must be >= 0, got {rate}")
+            self.rate = float(rate)
+        self._base = when.timestamp() if isinstance(when, datetime.datetime) else float(when)
+        self._started = self._monotonic()
+
+    def advance(self, seconds: float) -> None:
+        self.set(self.time() + seconds)
+
+    def set_rate(self, rate: float) -> None:
+        self.set(self.time(), rate)
+
+    def reset(self) -> None:
+        """Follow the wall clock again."""
+        self._base = None
+        self.rate = 1.0
+
+    def describe(self) -> dict:
+        return {
+            "now": self.now().isoformat(timespec="milliseconds"),
+            "virtual": self.virtual,
+            "rate": self.rate,
+            "offset": round(self.time() - self._wall(), 3),
+        }
+
+
+def parse_time(value: str) -> datetime.datetime:
+    """ISO date or date-time; a bare date is its midnight."""
+    try:
+        return datetime.datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"time must be an ISO date or date-time, got {value!r}")
@@ -0,0 +1,346 @@
+"""
+Columnar index of the journal's search fields.
+
+Each issued invoice costs a fixed number of bytes across typed arrays:
+
+- ``timestamps``: int64 wall-clock microseconds of ``sdcDateTime``
+- ``amounts``, ``paid``: int64 fixed-point ``totalAmount`` and payment sum
+- ``numbers``: int64 encoded invoice number (prefix id, digit count, counter)
+- ``invoice_types``, ``transaction_types``: uint8 codes
+- ``payments``: uint16 bitmask of payment types
+
+That is 36 bytes per invoice (44 with the journal's file offset). Category
+totals for range aggregates are only recorded once per block of ``BLOCK``
+records, and the records inside a partial block are summed from the columns.
+Filters scan the arrays; full documents are only decoded for the rows that
+match. GTIN, cashier and buyerId have inverted indexes (4 bytes per posting),
+so lookups by them only visit the matching positions.
+"""
+
+import datetime
+from array import array
+from bisect import bisect_left
+from collections.abc import Callable, Iterable, Iterator
+from itertools import islice
+from typing import TYPE_CHECKING, Literal, overload
+
+from ofs_mockup_srv.aggregate import ALL, categories, merge
+from ofs_mockup_srv.records import Invoice
+
+if TYPE_CHECKING:
+    from ofs_mockup_srv.store import InvoiceStore, Segment
+
+BLOCK = 64
+# Request fields with inverted indexes (GTIN per item)
+INDEXED_FIELDS = ("gtin", "cashier", "buyerId")
+
+
+class Codes:
+    """Interned small-int codes for enum-like strings, shared by all journals."""
+
+    def __init__(self, names: Iterable[str] = ()) -> None:
+        self.names: list[str] = []
+        self.codes: dict[str, int] = {}
+        for name in names:
+            self.code(name)
+
+    def code(self, name: str) -> int:
+        code = self.codes.get(name)
+        if code is None:
+            code = self.codes[name] = len(self.names)
+            self.names.append(name)
+        return code
+
+
+INVOICE_TYPES = Codes(("Normal", "Proforma", "Copy", "Training", "Advance"))
+TRANSACTION_TYPES = Codes(("Sale", "Refund"))
+PAYMENT_TYPES = Codes(("Other", "Cash", "Card", "Check", "WireTransfer", "Voucher", "MobileMoney"))
+
+# Payment types past the 15th share the last bit (their totals come from the document)
+_OVERFLOW_BIT = 15
+
+
+def payment_bit(payment_type: str) -> int:
+    return 1 << min(PAYMENT_TYPES.code(payment_type), _OVERFLOW_BIT)
+
+
+_PREFIXES = Codes()
+_OTHER_NUMBERS = Codes()
+_OTHER = 1 << 62
+
+
+@overload
+def encode_number(number: str, add: Literal[True] = True) -> int: ...
+
+
+@overload
+def encode_number(number: str, add: bool) -> int | None: ...
+
+
+def encode_number(number: str, add: bool = True) -> int | None:
+    """Invoice number as an int that sorts like its counter.
+
+    ``PREFIX-000123`` becomes ``prefix id << 48 | digit count << 40 | 123``;
+    anything else is interned. With ``add=False`` unknown numbers give None.
+    """
+    prefix, sep, digits = number.rpartition("-")
+    if sep and digits.isascii() and digits.isdigit() and len(digits) <= 12:
+        prefix += sep
+        pid = _PREFIXES.code(prefix) if add else _PREFIXES.codes.get(prefix)
+        if pid is not None and pid < 1 << 14:
+            return pid << 48 | len(digits) << 40 | int(digits)
+    idx = _OTHER_NUMBERS.code(number) if add else _OTHER_NUMBERS.codes.get(number)
+    return None if idx is None else _OTHER | idx
+
+
+def decode_number(code: int) -> str:
+    if code & _OTHER:
+        return _OTHER_NUMBERS.names[code & (_OTHER - 1)]
+    width = (code >> 40) & 0xFF
+    return _PREFIXES.names[code >> 48] + str(code & ((1 << 40) - 1)).zfill(width)
+
+
+_EPOCH = datetime.date(1970, 1, 1).toordinal()
+
+
+def wall_time(sdc_date_time: str) -> int:
+    """Microseconds of an ISO date/datetime on its own wall clock (offset ignored).
+
+    Orders the same way as comparing the ``YYYY-MM-DDTHH:MM:SS`` text.
+    """
+    s = sdc_date_time
+    days = datetime.date(int(s[0:4]), int(s[5:7]), int(s[8:10])).toordinal() - _EPOCH
+    seconds = days * 86400
+    micros = 0
+    if len(s) >= 19:
+        seconds += int(s[11:13]) * 3600 + int(s[14:16]) * 60 + int(s[17:19])
+        if len(s) > 20 and s[19] == ".":
+            end = 20
+            while end < len(s) and end < 26 and s[end].isdigit():
+                end += 1
+            micros = int(s[20:end].ljust(6, "0"))
+    return seconds * 1_000_000 + micros
+
+
+class InvoiceColumns:
+    def __init__(self) -> None:
+        self.timestamps: array[int] = array("q")
+        self.amounts: array[int] = array("q")
+        self.paid: array[int] = array("q")
+        self.numbers: array[int] = array("q")
+        self.invoice_types: array[int] = array("B")
+        self.transaction_types: array[int] = array("B")
+        self.payments: array[int] = array("H")
+        # Timestamps non-decreasing: date ranges can be found by binary search
+        self.ordered = True
+        # Numbers strictly increasing: lookups by binary search, else a lazy dict
+        self.numbers_sorted = True
+        self._number_index: dict[int, int] | None = None
+        # Category totals: running, and at every BLOCK boundary
+        self._running: dict[str, list[int]] = {}
+        self._blocks: dict[str, tuple[array, array]] = {}
+        # Inverted indexes: field -> value -> ascending positions
+        self.postings: dict[str, dict[str, array]] = {field: {} for field in INDEXED_FIELDS}
+
+    def __len__(self) -> int:
+        return len(self.timestamps)
+
+    @classmethod
+    def build(cls, records: "InvoiceStore | Segment") -> "InvoiceColumns":
+        columns = cls()
+        for pos in range(len(records)):
+            columns.append(Invoice.from_doc(records[pos]))
+        return columns
+
+    def append(self, invoice: Invoice) -> None:
+        """Index an issued invoice."""
+        if invoice.number is None or invoice.sdc_date_time is None or invoice.total is None:
+            raise ValueError("only issued invoices are indexed")
+        pos = len(self)
+        ts = wall_time(invoice.sdc_date_time)
+        code = encode_number(invoice.number)
+        if pos and ts < self.timestamps[-1]:
+            self.ordered = False
+        if pos and code <= self.numbers[-1]:
+            self.numbers_sorted = False
+        if self._number_index is not None:
+            self._number_index[code] = pos
+        mask = 0
+        paid = 0
+        for payment in invoice.payments:
+            mask |= payment_bit(payment.payment_type)
+            paid += payment.amount
+
+        self.timestamps.append(ts)
+        self.amounts.append(invoice.total)
+        self.paid.append(paid)
+        self.numbers.append(code)
+        self.invoice_types.append(INVOICE_TYPES.code(invoice.invoice_type))
+        self.transaction_types.append(TRANSACTION_TYPES.code(invoice.transaction_type))
+        self.payments.append(mask)
+
+        gtins = {item.gtin for item in invoice.items if item.gtin}
+        for field, values in (
+            ("gtin", gtins),
+            ("cashier", (invoice.cashier,)),
+            ("buyerId", (invoice.buyer_id,)),
+        ):
+            index = self.postings[field]
+            for value in values:
+                if value:
+                    positions = index.get(value)
+                    if positions is None:
+                        positions = index[value] = array("I")
+                    positions.append(pos)
+
+        for key, amount in categories(invoice).items():
+            totals = self._running.get(key)
+            if totals is None:
+                totals = self._running[key] = [0, 0]
+            totals[0] += 1
+            totals[1] += amount
+        if len(self) % BLOCK == 0:
+            blocks = len(self) // BLOCK
+            for key, (count, amount) in self._running.items():
+                column = self._blocks.get(key)
+                if column is None:
+                    zeros = bytes(8 * (blocks - 1))
+                    column = self._blocks[key] = (array("q", zeros), array("q", zeros))
+                column[0].append(count)
+                column[1].append(amount)
+
+    def find(self, invoice_number: str) -> int | None:
+        code = encode_number(invoice_number, add=False)
+        if code is None:
+            return None
+        if self.numbers_sorted:
+            pos = bisect_left(self.numbers, code)
+            return pos if pos < len(self) and self.numbers[pos] == code else None
+        if self._number_index is None:
+            self._number_index = {c: pos for pos, c in enumerate(self.numbers)}
+        return self._number_index.get(code)
+
+    def seek(self, ts: int, strict: bool = False) -> int:
+        """First position at (or, if ``strict``, after) ``ts``; needs ``ordered``."""
+        lo, hi = 0, len(self)
+        timestamps = self.timestamps
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if timestamps[mid] < ts or (strict and timestamps[mid] == ts):
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def prefix(self, pos: int, doc_at: Callable[[int], dict]) -> dict[str, tuple[int, int]]:
+        """Category -> (count, amount units) over the first ``pos`` records.
+
+        ``doc_at(i)`` is only called for records paid with several payment types.
+        """
+        block = pos // BLOCK
+        totals: dict[str, tuple[int, int]] = {}
+        if block:
+            totals = {
+                key: (counts[block - 1], amounts[block - 1])
+                for key, (counts, amounts) in self._blocks.items()
+            }
+        return merge(totals, self.totals(range(block * BLOCK, pos), doc_at))
+
+    def totals(self, positions: Iterable[int], doc_at: Callable[[int], dict]) -> dict[str, tuple[int, int]]:
+        """Category totals of the records at ``positions``, summed from the columns."""
+        partial: dict[str, list[int]] = {}
+
+        def add(key: str, amount: int) -> None:
+            entry = partial.get(key)
+            if entry is None:
+                partial[key] = [1, amount]
+            else:
+                entry[0] += 1
+                entry[1] += amount
+
+        for i in positions:
+            amount = self.amounts[i]
+            add(ALL, amount)
+            add("invoiceType:" + INVOICE_TYPES.names[self.invoice_types[i]], amount)
+            add("transactionType:" + TRANSACTION_TYPES.names[self.transaction_types[i]], amount)
+            mask = self.payments[i]
+            if mask & (mask - 1) or mask >> _OVERFLOW_BIT:
+                for key, value in categories(Invoice.from_doc(doc_at(i))).items():
+                    if key.startswith("paymentType:"):
+                        add(key, value)
+            elif mask:
+                add("paymentType:" + PAYMENT_TYPES.names[mask.bit_length() - 1], self.paid[i])
+        return {key: (count, amount) for key, (count, amount) in partial.items()}
+
+    def lookup(self, keys: dict[str, str]) -> array:
+        """Positions having every ``field: value`` in ``keys`` (ascending).
+
+        Walks the shortest posting list and probes the others by binary
+        search, so the cost follows the number of matches, not the journal.
+        """
+        lists = []
+        for field, value in keys.items():
+            positions = self.postings[field].get(value)
+            if positions is None:
+                return array("I")
+            lists.append(positions)
+        lists.sort(key=len)
+        shortest, others = lists[0], lists[1:]
+        if not others:
+            return shortest
+        out = array("I")
+        for pos in shortest:
+            for positions in others:
+                i = bisect_left(positions, pos)
+                if i == len(positions) or positions[i] != pos:
+                    break
+            else:
+                out.append(pos)
+        return out
+
+    def matches(
+        self,
+        start: int,
+        first_ts: int,
+        end_ts: int,
+        amount_from: int | None = None,
+        amount_to: int | None = None,
+        invoice_types: set[int] | None = None,
+        transaction_types: set[int] | None = None,
+        payment_mask: int = 0,
+        keys: dict[str, str] | None = None,
+    ) -> Iterator[int]:
+        """Yield positions from ``start`` with ``first_ts <= timestamp < end_ts`` matching the filters.
+
+        Empty/None filters match everything. With ``keys`` (see ``lookup``) only
+        the indexed positions are visited.
+        """
+        timestamps = self.timestamps
+        amounts = self.amounts
+        if self.ordered:
+            start = max(start, bisect_left(timestamps, first_ts))
+        positions: Iterable[int]
+        if keys:
+            candidates = self.lookup(keys)
+            positions = islice(candidates, bisect_left(candidates, start), None)
+        else:
+            positions = range(start, len(self))
+        for i in positions:
+            ts = timestamps[i]
+            if ts >= end_ts:
+                if self.ordered:
+                    return
+                continue
+            if ts < first_ts:
+                continue
+            if amount_from is not None and amounts[i] < amount_from:
+                continue
+            if amount_to is not None and amounts[i] > amount_to:
+                continue
+            if invoice_types is not None and self.invoice_types[i] not in invoice_types:
+                continue
+            if transaction_types is not None and self.transaction_types[i] not in transaction_types:
+                continue
+            if payment_mask and not self.payments[i] & payment_mask:
+                continue
+            yield i
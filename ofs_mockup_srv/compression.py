@@ -0,0 +1,205 @@
+"""
+Response compression with content negotiation.
+
+``CompressionMiddleware`` compresses dynamic JSON/text responses above a size
+threshold with gzip or deflate (stdlib codecs), following the client's
+``Accept-Encoding``. Payloads that are served repeatedly (status body, stored
+invoices) are wrapped in ``Payload`` objects that keep each encoding once it
+has been computed, so they are compressed once rather than per request.
+Compression time and byte counts are recorded in the metrics.
+"""
+
+import gzip
+import hashlib
+import time
+import zlib
+
+from starlette.responses import Response
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from ofs_mockup_srv.metrics import Metrics
+
+ENCODINGS = ("gzip", "deflate")
+COMPRESSIBLE_TYPES = ("application/json", "text/")
+DEFAULT_MINIMUM_SIZE = 1024
+DEFAULT_LEVEL = 6
+
+
+def negotiate(accept_encoding: str | None) -> str | None:
+    """Pick the supported encoding the client prefers (gzip wins ties).
+
+    ``q=0`` refuses an encoding; ``*`` stands for the encodings not listed.
+    """
+    if not accept_encoding:
+        return None
+    weights: dict[str, float] = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        name = name.strip().lower()
+        if name != "*" and name not in ENCODINGS:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        weights[name] = q
+    star = weights.get("*", 0.0)
+    best, best_q = None, 0.0
+    for name in ENCODINGS:
+        q = weights.get(name, star)
+        if q > best_q:
+            best, best_q = name, q
+    return best
+
+
+def compress(data: bytes, encoding: str, level: int = DEFAULT_LEVEL, metrics: Metrics | None = None) -> bytes:
+    started = time.perf_counter()
+    if encoding == "gzip":
+        out = gzip.compress(data, compresslevel=level, mtime=0)
+    else:
+        out = zlib.compress(data, level)
+    if metrics is not None:
+        metrics.observe(f"compression.{encoding}", time.perf_counter() - started)
+        metrics.incr("compression.bytes_in", len(data))
+        metrics.incr("compression.bytes_out", len(out))
+    return out
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(
+        tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(",")
+    )
+
+
+class Payload:
+    """Serialized response body that caches its compressed variants."""
+
+    __slots__ = ("body", "media_type", "digest", "_encoded")
+
+    def __init__(self, body: bytes, media_type: str = "application/json"):
+        self.body = body
+        self.media_type = media_type
+        self.digest = hashlib.blake2b(body, digest_size=12).hexdigest()
+        self._encoded: dict[str, bytes] = {}
+
+    def etag(self, encoding: str | None = None) -> str:
+        """Strong ETag of the ``encoding`` variant (each variant has its own)."""
+        if encoding is None:
+            return '"%s"' % self.digest
+        return '"%s-%s"' % (self.digest, encoding)
+
+    def encoded(self, encoding: str, level: int = DEFAULT_LEVEL, metrics: Metrics | None = None) -> bytes:
+        data = self._encoded.get(encoding)
+        if data is None:
+            data = compress(self.body, encoding, level, metrics)
+            self._encoded[encoding] = data
+        elif metrics is not None:
+            metrics.incr("compression.precompressed_hits")
+        return data
+
+    def response(
+        self,
+        accept_encoding: str | None,
+        minimum_size: int | None = DEFAULT_MINIMUM_SIZE,
+        metrics: Metrics | None = None,
+        headers: dict | None = None,
+        status_code: int = 200,
+        if_none_match: str | None = None,
+    ) -> Response:
+        """Response for this payload, compressed if the client accepts it.
+
+        ``minimum_size=None`` disables compression. A matching ``If-None-Match``
+        gets an empty 304.
+        """
+        headers = dict(headers or {})
+        encoding = None
+        if minimum_size is not None and len(self.body) >= minimum_size:
+            encoding = negotiate(accept_encoding)
+            headers["Vary"] = "Accept-Encoding"
+        headers["ETag"] = self.etag(encoding)
+        if etag_matches(if_none_match, headers["ETag"]):
+            if metrics is not None:
+                metrics.incr("payloads.not_modified")
+            return Response(status_code=304, headers=headers)
+        body = self.body
+        if encoding:
+            body = self.encoded(encoding, metrics=metrics)
+            headers["Content-Encoding"] = encoding
+        return Response(body, status_code=status_code, media_type=self.media_type, headers=headers)
+
+
+class CompressionMiddleware:
+    """ASGI middleware compressing buffered JSON/text responses."""
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        minimum_size: int = DEFAULT_MINIMUM_SIZE,
+        level: int = DEFAULT_LEVEL,
+        metrics: Metrics | None = None,
+    ):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.level = level
+        self.metrics = metrics
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        accept = None
+        for key, value in scope["headers"]:
+            if key == b"accept-encoding":
+                accept = value.decode("latin-1")
+                break
+        encoding = negotiate(accept)
+        if encoding is None:
+            return await self.app(scope, receive, send)
+
+        start: Message = {}
+        chunks: list[bytes] = []
+        passthrough = False
+
+        async def send_compressed(message: Message) -> None:
+            nonlocal start, passthrough
+            if message["type"] == "http.response.start":
+                headers = {k.lower(): v for k, v in message.get("headers", [])}
+                ctype = headers.get(b"content-type", b"").decode("latin-1")
+                if (
+                    b"content-encoding" in headers
+                    or b"content-range" in headers
+                    or message["status"] in (204, 206, 304)
+                    or not ctype.startswith(COMPRESSIBLE_TYPES)
+                    or ctype.startswith("text/event-stream")
+                ):
+                    passthrough = True
+                    await send(message)
+                else:
+                    start = message
+                return
+            if passthrough or message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            chunks.append(message.get("body", b""))
+            if message.get("more_body", False):
+                return
+            body = b"".join(chunks)
+            raw_headers = [
+                (k, v) for k, v in start.get("headers", []) if k.lower() != b"content-length"
+            ]
+            if len(body) >= self.minimum_size:
+                body = compress(body, encoding, self.level, self.metrics)
+                raw_headers.append((b"content-encoding", encoding.encode("latin-1")))
+                raw_headers.append((b"vary", b"Accept-Encoding"))
+            raw_headers.append((b"content-length", str(len(body)).encode("latin-1")))
+            await send({**start, "headers": raw_headers})
+            await send({"type": "http.response.body", "body": body, "more_body": False})
+
+        await self.app(scope, receive, send_compressed)
@@ -0,0 +1,121 @@
+"""
+Live device events for test observers (served as Server-Sent Events on /mock/events).
+
+Events are published from request handlers on the event loop. Each event is
+serialized to its SSE frame once, whatever the number of subscribers, and the
+frame is appended to every subscriber's bounded queue. A full queue drops its
+oldest frame, so a slow consumer loses events (and is told how many) instead
+of slowing down the invoice path. With no subscribers, publishing is a no-op.
+"""
+
+import asyncio
+import json
+from collections import deque
+from collections.abc import AsyncIterator, Iterable
+from typing import Any
+
+from ofs_mockup_srv.metrics import Metrics
+
+DEFAULT_QUEUE_SIZE = 1000
+DEFAULT_HEARTBEAT = 15.0
+
+INVOICE_ISSUED = "invoice.issued"
+PIN_ATTEMPT = "pin.attempt"
+DEVICE_LOCKED = "device.locked"
+DEVICE_UNLOCKED = "device.unlocked"
+DEVICE_RESET = "device.reset"
+EVENT_TYPES = (INVOICE_ISSUED, PIN_ATTEMPT, DEVICE_LOCKED, DEVICE_UNLOCKED, DEVICE_RESET)
+
+
+def frame(event_id: int, event_type: str, data: Any) -> bytes:
+    payload = json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+    return f"id: {event_id}\nevent: {event_type}\ndata: {payload}\n\n".encode("utf-8")
+
+
+class Subscriber:
+    """One consumer: a bounded frame queue that drops its oldest entries."""
+
+    __slots__ = ("frames", "types", "dropped", "_wake")
+
+    def __init__(self, queue_size: int, types: frozenset | None = None):
+        self.frames: deque[bytes] = deque(maxlen=queue_size)
+        self.types = types
+        self.dropped = 0  # since the last delivery
+        self._wake = asyncio.Event()
+
+    def push(self, data: bytes) -> bool:
+        """Queue a frame; True if the oldest one was dropped to make room."""
+        full = len(self.frames) == self.frames.maxlen
+        if full:
+            self.dropped += 1
+        self.frames.append(data)
+        self._wake.set()
+        return full
+
+    async def frames_ready(self, timeout: float | None) -> bool:
+        """Wait until frames are queued; False on timeout."""
+        while not self.frames:
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout)
+            except asyncio.TimeoutError:
+                return False
+        return True
+
+
+class EventBus:
+    def __init__(self, queue_size: int = DEFAULT_QUEUE_SIZE, metrics: Metrics | None = None):
+        if queue_size < 1:
+            raise ValueError(f"queue_size must be >= 1, got {queue_size}")
+        self.queue_size = queue_size
+        self.metrics = metrics
+        self._subscribers: set[Subscriber] = set()
+        self._last_id = 0
+
+    def __len__(self) -> int:
+        return len(self._subscribers)
+
+    def publish(self, event_type: str, data: dict) -> None:
+        if not self._subscribers:
+            return
+        self._last_id += 1
+        encoded = frame(self._last_id, event_type, data)
+        dropped = 0
+        for subscriber in self._subscribers:
+            if subscriber.types is None or event_type in subscriber.types:
+                dropped += subscriber.push(encoded)
+        if self.metrics is not None:
+            self.metrics.incr("events.published")
+            if dropped:
+                self.metrics.incr("events.dropped", dropped)
+
+    def subscribe(self, types: Iterable[str] | None = None) -> Subscriber:
+        subscriber = Subscriber(self.queue_size, frozenset(types) if types else None)
+        self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber) -> None:
+        self._subscribers.discard(subscriber)
+
+    async def stream(
+        self, types: Iterable[str] | None = None, heartbeat: float = DEFAULT_HEARTBEAT
+    ) -> AsyncIterator[bytes]:
+        """SSE byte stream of the events published from now on (optionally only ``types``).
+
+        The subscription starts with the stream and ends when the client goes away.
+        """
+        subscriber = self.subscribe(types)
+        try:
+            yield b"retry: 1000\n\n"
+            while True:
+                if not await subscriber.frames_ready(heartbeat):
+                    yield b": keep-alive\n\n"
+                    continue
+                if subscriber.dropped:
+                    dropped, subscriber.dropped = subscriber.dropped, 0
+                    yield f"event: dropped\ndata: {dropped}\n\n".encode("ascii")
+                frames = subscriber.frames
+                chunk = b"".join(frames.popleft() for _ in range(len(frames)))
+                yield chunk
+        finally:
+            self.unsubscribe(subscriber)
@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+"""
+Deterministic synthetic invoice history.
+
+Generates plausible issued invoices (Normal/Advance/Copy, Sale/Refund, mixed
+payment types, realistic item counts and tax labels) straight into an
+InvoiceStore or a snapshot file, without going through HTTP. The same seed
+always produces the same dataset, so benchmark runs are comparable.
+
+Examples:
+  ofs-mockup-gen --count 1000000 --seed 42 --out history.snap
+  ofs-mockup-srv --restore history.snap
+  ofs-mockup-srv --generate 100000 --seed 42
+"""
+
+import argparse
+import datetime
+import itertools
+import random
+import time
+from collections.abc import Callable, Iterable, Iterator
+from typing import Any, TypeVar
+
+from ofs_mockup_srv.store import INVOICE_PREFIX, InvoiceStore, encode_doc
+from ofs_mockup_srv.tax import default_tax_rates
+
+T = TypeVar("T")
+
+DEFAULT_START = "2024-01-01"
+TZ = datetime.timezone(datetime.timedelta(hours=1))
+
+# label -> tax rate in percent
+TAX_LABELS = {"E": 17, "K": 0, "A": 0, "G": 0}
+LABEL_WEIGHTS = (("E", 70), ("K", 15), ("A", 10), ("G", 5))
+TAX_CATEGORY_NAMES = {"E": "ECAL", "K": "NULA", "A": "NIJE U PDV", "G": "BEZ PDV"}
+
+INVOICE_TYPES = (("Normal", 85), ("Advance", 7), ("Copy", 8))
+TRANSACTION_TYPES = (("Sale", 92), ("Refund", 8))
+PAYMENT_TYPES = (("Cash", 50), ("Card", 35), ("WireTransfer", 10), ("Other", 5))
+
+CASHIERS = ("Radnik 1", "Radnik 2", "Amra", "Emir", "Jasmina", "Kenan", "Lejla", "Tarik")
+PRODUCTS = (
+    "Kafa", "Čaj", "Hljeb", "Mlijeko", "Jogurt", "Sir", "Šećer", "Brašno",
+    "Ulje", "Sok", "Voda", "Čokolada", "Keks", "Deterdžent", "Sapun", "Papir",
+)
+VARIANTS = ("", "0,5l", "1l", "1kg", "500g", "200g", "bio", "light", "XL", "pak. 6")
+
+_RESPONSE_TEMPLATE = {
+    "address": "Ulica 7. Muslimanske brigade 77",
+    "businessName": "Sigma-com doo Zenica",
+    "district": "Zenica",
+    "encryptedInternalData": None,
+    "invoiceCounterExtension": "ZE",
+    "invoiceImageHtml": None,
+    "journal": None,
+    "locationName": "Sigma-com doo Zenica poslovnica Sarajevo",
+    "messages": "Uspješno",
+    "mrc": "01-0001-WPYB002248200772",
+    "requestedBy": "RX4F7Y5L",
+    "signature": None,
+    "signedBy": "RX4F7Y5L",
+    "taxGroupRevision": 2,
+    "tin": "4402692070009",
+    "verificationQRCode": None,
+    "verificationUrl": None,
+}
+
+
+def _weighted(rng: random.Random, choices: Iterable[tuple[T, int]]) -> Callable[[], T]:
+    # One slot per unit of weight: a pick is a single random() and an index
+    table = tuple(itertools.chain.from_iterable([c] * w for c, w in choices))
+    size = len(table)
+    draw = rng.random
+    return lambda: table[int(draw() * size)]
+
+
+def _catalog(rng: random.Random, size: int = 500) -> list[tuple[str, str, float, str]]:
+    label = _weighted(rng, LABEL_WEIGHTS)
+    items = []
+    for i in range(size):
+        name = f"{rng.choice(PRODUCTS)} {rng.choice(VARIANTS)}".strip()
+        gtin = "387%010d" % rng.randrange(10**10)
+        price = round(rng.lognormvariate(1.5, 1.0), 2) or 0.5
+        items.append((name, gtin, price, label()))
+    return items
+
+
+def generate_invoices(
+    store: InvoiceStore,
+    count: int,
+    seed: int = 0,
+    start: datetime.datetime | None = None,
+    days: float = 365.0,
+    template: dict | None = None,
+) -> Iterator[dict]:
+    """Yield ``count`` issued-invoice documents in time order.
+
+    Invoice numbers and counters continue from ``store``'s counters, which are
+    advanced as documents are produced; the documents themselves are not
+    appended, so callers can stream them elsewhere.
+    """
+    rng = random.Random(seed)
+    draw = rng.random
+    catalog = _catalog(rng)
+    catalog_size = len(catalog)
+    invoice_type = _weighted(rng, INVOICE_TYPES)
+    transaction_type = _weighted(rng, TRANSACTION_TYPES)
+    payment_type = _weighted(rng, PAYMENT_TYPES)
+    response_template = template or _RESPONSE_TEMPLATE
+
+    start = start or datetime.datetime.fromisoformat(DEFAULT_START).replace(tzinfo=TZ)
+    mean_gap = days * 86400.0 / max(count, 1)
+    t = start.timestamp()
+    recent: list[tuple[str, str]] = []  # (number, sdcDateTime) of recent Normal sales, for Copy/Refund references
+
+    for _ in range(count):
+        t += rng.expovariate(1.0 / mean_gap) if mean_gap > 0 else 0.0
+        sdc = datetime.datetime.fromtimestamp(t, TZ).isoformat(timespec="milliseconds")
+        inv_type = invoice_type()
+        tx_type = transaction_type()
+
+        items = []
+        total = 0.0
+        tax_by_label: dict[str, float] = {}
+        for _ in range(min(40, int(rng.expovariate(0.4)) + 1)):
+            name, gtin, price, label = catalog[int(draw() * catalog_size)]
+            quantity = round(rng.uniform(0.1, 3.0), 3) if draw() < 0.1 else float(int(draw() * 5) + 1)
+            discount = None
+            amount = round(price * quantity, 2)
+            if draw() < 0.05:
+                discount = float(rng.choice((5, 10, 20)))
+                amount = round(amount * (100 - discount) / 100, 2)
+            total += amount
+            tax_by_label[label] = tax_by_label.get(label, 0.0) + amount
+            items.append(
+                {
+                    "name": name,
+                    "gtin": gtin,
+                    "labels": [label],
+                    "totalAmount": amount,
+                    "unitPrice": price,
+                    "quantity": quantity,
+                    "discount": discount,
+                    "discountAmount": None,
+                }
+            )
+        total = round(total, 2)
+
+        if draw() < 0.85:
+            payment = [{"amount": total, "paymentType": payment_type()}]
+        else:
+            first = round(total * rng.uniform(0.1, 0.9), 2)
+            payment = [
+                {"amount": first, "paymentType": payment_type()},
+                {"amount": round(total - first, 2), "paymentType": payment_type()},
+            ]
+
+        referent_number = referent_dt = None
+        if (inv_type == "Copy" or tx_type == "Refund") and recent:
+            referent_number, referent_dt = rng.choice(recent)
+
+        total_counter, type_counter = store.next_counters(inv_type, tx_type)
+        number = INVOICE_PREFIX + str(total_counter).zfill(3)
+        if inv_type == "Normal" and tx_type == "Sale":
+            recent.append((number, sdc))
+            if len(recent) > 1000:
+                del recent[: len(recent) - 1000]
+
+        yield {
+            "invoiceRequest": {
+                "referentDocumentNumber": referent_number,
+                "referentDocumentDT": referent_dt,
+                "invoiceType": inv_type,
+                "transactionType": tx_type,
+                "payment": payment,
+                "items": items,
+                "cashier": CASHIERS[int(draw() * len(CASHIERS))],
+                "buyerId": ("VP:4%012d" % rng.randrange(10**12)) if draw() < 0.05 else None,
+            },
+            "invoiceResponse": {
+                **response_template,
+                "invoiceCounter": "%d/%dZE" % (type_counter, total_counter),
+                "invoiceNumber": number,
+                "sdcDateTime": sdc,
+                "taxItems": [
+                    {
+                        "amount": round(amount * TAX_LABELS[label] / (100 + TAX_LABELS[label]), 4),
+                        "categoryName": TAX_CATEGORY_NAMES[label],
+                        "categoryType": 0,
+                        "label": label,
+                        "rate": TAX_LABELS[label],
+                    }
+                    for label, amount in tax_by_label.items()
+                ],
+                "totalAmount": total,
+                "totalCounter": total_counter,
+                "transactionTypeCounter": type_counter,
+            },
+        }
+
+
+def populate(store: InvoiceStore, count: int, seed: int = 0, **kwargs: Any) -> int:
+    """Append ``count`` generated invoices to ``store`` in bulk."""
+    append = store.append
+    for doc in generate_invoices(store, count, seed, **kwargs):
+        append(doc)
+    return count
+
+
+def main() -> None:
+    """Write a generated invoice history to a snapshot file."""
+    parser = argparse.ArgumentParser(
+        description="Generate a deterministic synthetic invoice history snapshot",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  ofs-mockup-gen --count 1000000 --seed 42 --out history.snap
+  ofs-mockup-gen --count 50000 --start 2025-01-01 --days 31 --out january.snap
+        """,
+    )
+    parser.add_argument("--count", type=int, required=True, help="Number of invoices")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed (default: 0)")
+    parser.add_argument("--out", required=True, help="Snapshot file to write")
+    parser.add_argument(
+        "--start",
+        default=DEFAULT_START,
+        help=f"Date of the first invoice (default: {DEFAULT_START})",
+    )
+    parser.add_argument(
+        "--days", type=float, default=365.0, help="Time span of the history in days"
+    )
+    args = parser.parse_args()
+
+    from ofs_mockup_srv.snapshot import write_snapshot
+
+    started = time.perf_counter()
+    store = InvoiceStore()
+    start = datetime.datetime.fromisoformat(args.start).replace(tzinfo=TZ)
+    records = (
+        (doc["invoiceResponse"]["invoiceNumber"], encode_doc(doc))
+        for doc in generate_invoices(store, args.count, args.seed, start=start, days=args.days)
+    )
+    # type_counters is the store's live dict; the header is serialized only after
+    # every record has been generated, so it holds the final counts
+    state = {
+        "current_api_attention": 200,
+        "pin_fail_count": 0,
+        "total_counter": args.count,
+        "type_counters": store.type_counters,
+        "tax_rates": default_tax_rates(),
+    }
+    count = write_snapshot(args.out, state, records)
+    elapsed = time.perf_counter() - started
+    print(f"✅ Wrote {count} invoices to {args.out} in {elapsed:.1f}s", flush=True)
+
+
+if __name__ == "__main__":
+    main()
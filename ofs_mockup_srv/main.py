@@ -1,22 +1,65 @@
 import argparse
+import asyncio
 import base64
 import datetime
+import functools
+import hashlib
 import json
+import math
 import os
 import time
+from collections.abc import Callable, Hashable
 from enum import Enum
 from random import randint
+from typing import Any
 
 import uvicorn
 from fastapi import Depends, FastAPI, HTTPException, Request, status
 from fastapi.responses import PlainTextResponse
-from pydantic import BaseModel
-from fastapi.responses import JSONResponse
+from pydantic import BaseModel, Field
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
+
+from ofs_mockup_srv.aggregate import report
+from ofs_mockup_srv.auth import load_registry
+from ofs_mockup_srv.cache import SingleFlight, TTLCache
+from ofs_mockup_srv.clock import Clock, parse_time
+from ofs_mockup_srv.columns import INDEXED_FIELDS
+from ofs_mockup_srv.compression import DEFAULT_MINIMUM_SIZE, CompressionMiddleware, Payload
+from ofs_mockup_srv.events import (
+    DEFAULT_QUEUE_SIZE,
+    DEVICE_LOCKED,
+    DEVICE_RESET,
+    DEVICE_UNLOCKED,
+    EVENT_TYPES,
+    INVOICE_ISSUED,
+    PIN_ATTEMPT,
+    EventBus,
+)
+from ofs_mockup_srv.generator import populate
+from ofs_mockup_srv.metrics import Metrics
+from ofs_mockup_srv.money import format_amount, to_amount, to_units
+from ofs_mockup_srv.persist import DEFAULT_BATCH_SIZE, DEFAULT_INTERVAL, DURABILITY_MODES, SQLiteJournal
+from ofs_mockup_srv.profiling import DEFAULT_KEEP, DEFAULT_LIMIT, Profiles, ProfilingMiddleware
+from ofs_mockup_srv.qr import gif_base64
+from ofs_mockup_srv.records import Invoice
+from ofs_mockup_srv.scenarios import Scenario, ScenarioError, load_scenario
+from ofs_mockup_srv.serving import add_profile_arguments, exit_on_sigterm, uvicorn_options
+from ofs_mockup_srv.signing import DEFAULT_COST, DEFAULT_KEY, DEFAULT_MAX_BATCH, Signer
+from ofs_mockup_srv.state import DEFAULT_BASELINE, Baseline, retire
+from ofs_mockup_srv.snapshot import SnapshotError, read_snapshot, write_snapshot
+from ofs_mockup_srv.store import INVOICE_PREFIX, InvoiceStore, Segment, decode_cursor, encode_cursor
+from ofs_mockup_srv.tax import CIRILICA_E, SEND_CIRILICA, TaxRates, default_tax_rates
+from ofs_mockup_srv.timing import Phases, ServerTimingMiddleware, request_phases
+from ofs_mockup_srv.validation import check_invoice
+from ofs_mockup_srv.verification import (
+    DEFAULT_QR_CACHE_SIZE,
+    DEFAULT_QR_WORKERS,
+    QR_WORKER_ENV,
+    QRCodes,
+    verification_url,
+)
 
 API_KEY = "dev_api_key_ofs_12345678901234567890"
-SEND_CIRILICA = True
-CIRILICA_E = "Е"
-CIRILICA_K = "К"
 
 # Default PIN - can be overridden via app.state.pin
 PIN = "4321"
@@ -27,6 +70,11 @@ DEFAULT_AVAILABLE = True
 BUSINESS_NAME = "Sigma-com doo Zenica"
 BUSINESS_ADDRESS = "Ulica 7. Muslimanske brigade 77"
 DISTRICT = "Zenica"
+DEVICE_SERIAL_NUMBER = "01-0001-WPYB002248200772"
+# Secure element (SDC) that requests and signs the invoices
+SDC_UID = "RX4F7Y5L"
+# verificationQRCode when QR generation is off (OFS_MOCKUP_QR=false)
+VERIFICATION_QR_PLACEHOLDER = "R0lGODlhhAGEAfFAKE"
 
 
 app = FastAPI()
@@ -77,6 +125,9 @@ async def debug_request_response_middleware(request: Request, call_next):
     DEBUG_MAX_BYTES = 100_000  # cap printed body size (~100 KB)
 
     debug_on = hasattr(app.state, "debug_enabled") and app.state.debug_enabled
+    if not debug_on:
+        # Nothing to log: skip buffering and rebuilding the request
+        return await call_next(request)
 
     # Capture request body and rebuild a fresh Request so downstream can read it
     body_bytes = b""
@@ -85,38 +136,37 @@ async def debug_request_response_middleware(request: Request, call_next):
     except Exception:
         body_bytes = b""
 
-    if debug_on:
-        try:
-            print(f"🔵 Request: {request.method} {request.url.path}", flush=True)
-            # Headers of interest
-            auth = request.headers.get("authorization")
-            if auth:
-                token = auth.replace("Bearer ", "")
-                token = (token[:20] + "...") if len(token) > 20 else token
-                print(f"   Auth: Bearer {token}", flush=True)
-            if request.query_params:
-                print(f"   Query: {dict(request.query_params)}", flush=True)
-            # Body (for JSON/text)
-            ctype = request.headers.get("content-type", "")
-            if body_bytes and ("application/json" in ctype or "text/plain" in ctype):
-                to_show = body_bytes[:DEBUG_MAX_BYTES]
-                try:
-                    if "application/json" in ctype:
-                        import json as _json
-
-                        parsed = _json.loads(to_show.decode("utf-8", errors="replace"))
-                        pretty = _json.dumps(parsed, ensure_ascii=False, indent=2)
-                        print(f"   Body JSON: {pretty}", flush=True)
-                    else:
-                        print(
-                            f"   Body Text: {to_show.decode('utf-8', errors='replace')}",
-                            flush=True,
-                        )
-                except Exception:
-                    # Fallback raw if parsing fails
-                    print(f"   Body Raw: {to_show!r}", flush=True)
-        except Exception:
-            pass
+    try:
+        print(f"🔵 Request: {request.method} {request.url.path}", flush=True)
+        # Headers of interest
+        auth = request.headers.get("authorization")
+        if auth:
+            token = auth.replace("Bearer ", "")
+            token = (token[:20] + "...") if len(token) > 20 else token
+            print(f"   Auth: Bearer {token}", flush=True)
+        if request.query_params:
+            print(f"   Query: {dict(request.query_params)}", flush=True)
+        # Body (for JSON/text)
+        ctype = request.headers.get("content-type", "")
+        if body_bytes and ("application/json" in ctype or "text/plain" in ctype):
+            to_show = body_bytes[:DEBUG_MAX_BYTES]
+            try:
+                if "application/json" in ctype:
+                    import json as _json
+
+                    parsed = _json.loads(to_show.decode("utf-8", errors="replace"))
+                    pretty = _json.dumps(parsed, ensure_ascii=False, indent=2)
+                    print(f"   Body JSON: {pretty}", flush=True)
+                else:
+                    print(
+                        f"   Body Text: {to_show.decode('utf-8', errors='replace')}",
+                        flush=True,
+                    )
+            except Exception:
+                # Fallback raw if parsing fails
+                print(f"   Body Raw: {to_show!r}", flush=True)
+    except Exception:
+        pass
 
     # Recreate a request with the captured body for downstream
     async def receive():
@@ -129,9 +179,6 @@ async def debug_request_response_middleware(request: Request, call_next):
     # Call downstream and capture response body if small/JSON/text
     response = await call_next(downstream_request)
 
-    if not debug_on:
-        return response
-
     try:
         # Only buffer and log small JSON/text responses
         resp_ctype = (response.headers.get("content-type") or "").lower()
@@ -189,15 +236,126 @@ async def debug_request_response_middleware(request: Request, call_next):
         return response
 
 
-# Initialize from environment variables (set by start_server.py) or defaults
-app.state.pin_fail_count = 0
-app.state.current_api_attention = (
-    200 if os.getenv("OFS_MOCKUP_AVAILABLE") == "true" else 404
-)
+# Initialize from environment variables (set by start_server.py) or defaults.
+# Device state (availability, PIN counter, journal, ...) is set up by reset_state().
 app.state.debug_enabled = os.getenv("OFS_MOCKUP_DEBUG") == "true"
 app.state.pin = os.getenv("OFS_MOCKUP_PIN", PIN)
 app.state.api_key = os.getenv("OFS_MOCKUP_API_KEY", API_KEY)
-app.state.invoice_error = os.getenv("OFS_MOCKUP_INVOICE_ERROR")
+# Accepted API keys (default key plus an optional JSON key file) with optional
+# per-key "rate[:burst]" throttling
+app.state.api_keys = load_registry(
+    app.state.api_key,
+    os.getenv("OFS_MOCKUP_API_KEYS_FILE"),
+    os.getenv("OFS_MOCKUP_RATE_LIMIT"),
+)
+# Idempotent invoice submission: Idempotency-Key header (or, optionally, a hash of
+# invoiceRequest) -> serialized original response
+app.state.idempotency_cache = TTLCache(
+    maxsize=int(os.getenv("OFS_MOCKUP_IDEMPOTENCY_SIZE", "10000")),
+    ttl=float(os.getenv("OFS_MOCKUP_IDEMPOTENCY_TTL", "300")),
+)
+app.state.idempotency_hash_body = os.getenv("OFS_MOCKUP_IDEMPOTENCY_HASH") == "true"
+# Submissions still being issued, by idempotency key (concurrent retries join them)
+app.state.idempotent_calls = SingleFlight()
+app.state.metrics = Metrics()
+# Device clock for every timestamp handed out; OFS_MOCKUP_CLOCK starts it at a
+# fixed time, OFS_MOCKUP_CLOCK_RATE runs it faster (see /mock/clock)
+app.state.clock = Clock()
+if os.getenv("OFS_MOCKUP_CLOCK") or os.getenv("OFS_MOCKUP_CLOCK_RATE"):
+    app.state.clock.set(
+        parse_time(os.environ["OFS_MOCKUP_CLOCK"]) if os.getenv("OFS_MOCKUP_CLOCK") else app.state.clock.time(),
+        float(os.getenv("OFS_MOCKUP_CLOCK_RATE", "1")),
+    )
+# Live invoice/PIN/lock events for /mock/events subscribers (bounded per subscriber)
+app.state.events = EventBus(
+    queue_size=int(os.getenv("OFS_MOCKUP_EVENT_QUEUE", str(DEFAULT_QUEUE_SIZE))),
+    metrics=app.state.metrics,
+)
+# Emulated secure element: invoices are signed with the device key in batches,
+# off the event loop; OFS_MOCKUP_SIGNING_COST (PBKDF2 iterations, about 2 us
+# each) emulates slower signing hardware
+app.state.signer = Signer(
+    key=os.getenv("OFS_MOCKUP_SIGNING_KEY", "").encode("utf-8") or DEFAULT_KEY,
+    cost=int(os.getenv("OFS_MOCKUP_SIGNING_COST", str(DEFAULT_COST))),
+    max_batch=int(os.getenv("OFS_MOCKUP_SIGNING_BATCH", str(DEFAULT_MAX_BATCH))),
+    metrics=app.state.metrics,
+)
+# Per-invoice verification QR codes, encoded in worker processes and cached by
+# invoice number; OFS_MOCKUP_QR=false keeps the fixed placeholder (load tests)
+app.state.qr_codes = (
+    None
+    if os.getenv("OFS_MOCKUP_QR") == "false"
+    else QRCodes(
+        workers=int(os.getenv("OFS_MOCKUP_QR_WORKERS", str(DEFAULT_QR_WORKERS))),
+        maxsize=int(os.getenv("OFS_MOCKUP_QR_CACHE_SIZE", str(DEFAULT_QR_CACHE_SIZE))),
+        metrics=app.state.metrics,
+    )
+)
+# gzip/deflate responses of at least this many bytes (None: compression off)
+app.state.compression_min_size = (
+    None
+    if os.getenv("OFS_MOCKUP_COMPRESSION") == "false"
+    else int(os.getenv("OFS_MOCKUP_COMPRESSION_MIN_SIZE", str(DEFAULT_MINIMUM_SIZE)))
+)
+if app.state.compression_min_size is not None:
+    # Added last so it wraps the debug middleware, which then logs plain bodies
+    app.add_middleware(
+        CompressionMiddleware,
+        minimum_size=app.state.compression_min_size,
+        metrics=app.state.metrics,
+    )
+# Server-Timing phases (parse, logic, render, serialize, delay) of the API
+# handlers; outside compression, so compressing counts as serialization
+app.add_middleware(ServerTimingMiddleware, metrics=app.state.metrics)
+# Per-request cProfile stats for /mock/profile; outermost, so a profile covers
+# the whole request. Costs one attribute check per request while disarmed
+app.state.profiles = Profiles(
+    keep=int(os.getenv("OFS_MOCKUP_PROFILE_KEEP", str(DEFAULT_KEEP))),
+    header=os.getenv("OFS_MOCKUP_PROFILE") == "header",
+    metrics=app.state.metrics,
+)
+app.add_middleware(ProfilingMiddleware, profiles=app.state.profiles)
+# Serialized bodies served repeatedly (status, stored invoices), kept with their
+# compressed variants; rebuilt whenever the journal is replaced
+PAYLOAD_CACHE_SIZE = int(os.getenv("OFS_MOCKUP_PAYLOAD_CACHE_SIZE", "1024"))
+app.state.inflight = SingleFlight()
+
+
+async def cached_payload(req: Request, key: Hashable, build: Callable[[], bytes]) -> Response:
+    """Serve ``build()`` (bytes) from the payload cache.
+
+    Misses are built off the event loop, and concurrent misses for the same
+    key share one build. Responses carry an ETag (304 on If-None-Match) and
+    are precompressed when the client accepts it.
+    """
+    payloads = app.state.payloads
+    payload: Payload | None = payloads.get(key)
+    if payload is None:
+        # Keyed by cache identity so a build racing a reset cannot leak into the new cache
+        flight = (id(payloads), key)
+        app.state.metrics.incr(
+            "payloads.coalesced" if flight in app.state.inflight else "payloads.miss"
+        )
+
+        async def build_payload() -> Payload:
+            payload = Payload(await asyncio.to_thread(build))
+            payloads.set(key, payload)
+            return payload
+
+        payload = await app.state.inflight.do(flight, build_payload)
+    else:
+        app.state.metrics.incr("payloads.hit")
+    return payload.response(
+        req.headers.get("accept-encoding"),
+        app.state.compression_min_size,
+        app.state.metrics,
+        if_none_match=req.headers.get("if-none-match"),
+    )
+
+
+def json_bytes(data: Any) -> bytes:
+    """Same encoding as FastAPI's JSONResponse."""
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
 
 
 @app.get("/")
@@ -207,15 +365,26 @@ def root():
 
 def check_api_key(req: Request):
 
-    token = req.headers["Authorization"].replace("Bearer ", "").strip()
-    
-    # Use dynamic API key from app state if available, otherwise fallback to constant
-    api_key = getattr(app.state, 'api_key', API_KEY)
+    auth = req.headers.get("authorization")
+    if not auth:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Unauthorized API-KEY missing",
+        )
 
-    if token != api_key:
+    # Keys are looked up by digest; results are cached per client connection
+    key = app.state.api_keys.authenticate(auth, req.scope.get("client"))
+    if key is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Unauthorized API-KEY %s" % (token),
+            detail="Unauthorized API-KEY %s" % (auth.replace("Bearer ", "").strip()),
+        )
+
+    if not key.allow():
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many requests",
+            headers={"Retry-After": str(math.ceil(key.bucket.retry_after()))},
         )
 
     return True
@@ -229,6 +398,11 @@ async def get_attention(req: Request):
         debug_log_response(401, "Unauthorized")
         raise HTTPException(status_code=401, detail="Unauthorized")
 
+    for rule in app.state.scenario.fire("attention"):
+        if rule.action == "unavailable":
+            debug_log_response(404, "Service not available (scenario)")
+            raise HTTPException(status_code=404, detail="Service not available")
+
     if app.state.current_api_attention == 200:
         debug_log_response(200, "Service available")
         return  # HTTP 200 with no body
@@ -246,9 +420,20 @@ async def post_pin(req: Request):
         debug_log_response(401, "Unauthorized")
         return False
 
+    for rule in app.state.scenario.fire("pin"):
+        if rule.action == "lock":
+            debug_log_response(200, "1300 (device locked, scenario)")
+            publish_pin_attempt("1300")
+            return "1300"
+        if rule.action == "fail":
+            debug_log_response(200, "2400 (PIN rejected, scenario)")
+            publish_pin_attempt("2400")
+            return "2400"
+
     # If device is in error state (after 3 PIN failures), only report error
     if app.state.pin_fail_count >= 3:
         debug_log_response(200, "1300 (device locked)")
+        publish_pin_attempt("1300")
         return "1300"
 
     response = "2400"
@@ -260,6 +445,7 @@ async def post_pin(req: Request):
         # Successful PIN entry resets counter
         app.state.pin_fail_count = 0
         app.state.current_api_attention = 200  # Set service as available
+        persist_state()
         debug_log_response(200, f"{response} (PIN correct, service available)")
     else:
         # Wrong 4-digit PIN attempt
@@ -267,6 +453,7 @@ async def post_pin(req: Request):
         app.state.current_api_attention = (
             404  # Set service as unavailable on PIN failure
         )
+        persist_state()
         if app.state.pin_fail_count >= 3:
             response = "1300"
             debug_log_response(200, f"{response} (device locked after 3 failures)")
@@ -276,25 +463,19 @@ async def post_pin(req: Request):
                 200, f"{response} (wrong PIN, attempt {app.state.pin_fail_count})"
             )
 
+    publish_pin_attempt(response)
     return response
 
 
-class TaxRate(BaseModel):
-    label: str
-    rate: int
-
-
-class TaxCategory(BaseModel):
-    categoryType: int
-    name: str
-    orderId: int
-    taxRates: list[TaxRate] = []
-
-
-class TaxRates(BaseModel):
-    groupId: str
-    taxCategories: list[TaxCategory] = []
-    validFrom: str
+def publish_pin_attempt(response: str) -> None:
+    app.state.events.publish(
+        PIN_ATTEMPT,
+        {
+            "response": response,
+            "pin_fail_count": app.state.pin_fail_count,
+            "current_api_attention": app.state.current_api_attention,
+        },
+    )
 
 
 class Status(BaseModel):
@@ -316,79 +497,41 @@ class Status(BaseModel):
 @app.get("/api/status")
 async def get_status(req: Request):
 
+    phases = request_phases(req, "status")
     if not check_api_key(req):
         return False
+    phases.mark("parse")
 
-    taxRate0 = TaxRate(rate=0, label="G")
-    taxRateA = TaxRate(rate=0, label="A")
-    taxRateE = TaxRate(rate=10, label="E")
-    taxRateD = TaxRate(rate=20, label="D")
-
-    if SEND_CIRILICA:
-        taxCategory1 = TaxCategory(
-            categoryType=0, name="Без ПДВ", orderId=4, taxRates=[taxRate0]
-        )
-    else:
-        taxCategory1 = TaxCategory(
-            categoryType=0, name="Bez PDV Ž-kat", orderId=4, taxRates=[taxRate0]
-        )
+    last_invoice_number = app.state.store.last_invoice_number()
+    # sdcDateTime to the second, so polling clients still share cached bodies
+    second = int(app.state.clock.time())
+    phases.mark("logic")
 
-    taxCategory2 = TaxCategory(
-        categoryType=0, name="Nije u PDV", orderId=1, taxRates=[taxRateA]
-    )
+    def build() -> bytes:
+        response = status_response(last_invoice_number, second)
+        phases.mark("render")
+        return response.model_dump_json().encode("utf-8")
 
-    if SEND_CIRILICA:
-        taxCategory3 = TaxCategory(
-            categoryType=6, name="Г-A-Ђ-Љ П-ПДВ", orderId=3, taxRates=[taxRateE]
-        )
-    else:
-        taxCategory3 = TaxCategory(
-            categoryType=6, name="P-PDV", orderId=3, taxRates=[taxRateE]
-        )
+    return await cached_payload(req, ("status", last_invoice_number, second), build)
 
-    taxCategory4 = TaxCategory(
-        categoryType=6, name="D-PDV", orderId=3, taxRates=[taxRateD]
-    )
-
-    allTaxRates = [
-        TaxRates(
-            groupId="1",
-            taxCategories=[taxCategory1],
-            validFrom="2021-11-01T02:00:00.000+01:00",
-        ),
-        TaxRates(
-            groupId="6",
-            taxCategories=[taxCategory2, taxCategory3, taxCategory4],
-            validFrom="",
-        ),
-    ]
-
-    currentTaxRates = [
-        TaxRates(
-            groupId="6",
-            taxCategories=[taxCategory1, taxCategory3],
-            validFrom="2024-05-01T02:00:00.000+01:00",
-        )
-    ]
 
-    response = Status(
-        allTaxRates=allTaxRates,
-        currentTaxRates=currentTaxRates,
-        deviceSerialNumber="01-0001-WPYB002248200772",
+def status_response(last_invoice_number: str | None, second: int) -> Status:
+    return Status(
+        allTaxRates=app.state.tax_rates["allTaxRates"],
+        currentTaxRates=app.state.tax_rates["currentTaxRates"],
+        deviceSerialNumber=DEVICE_SERIAL_NUMBER,
         gsc=["9999", "0210"],  # Always ready for status endpoint
         hardwareVersion="1.0",
-        lastInvoiceNumber="RX4F7Y5L-RX4F7Y5L-132",
+        lastInvoiceNumber=last_invoice_number or "RX4F7Y5L-RX4F7Y5L-132",
         make="OFS",
         model="OFS P5 EFU LPFR",
         mssc=[],
         protocolVersion="2.0",
-        sdcDateTime="2024-09-15T23:03:24.390+01:00",
+        sdcDateTime=datetime.datetime.fromtimestamp(second).astimezone().isoformat(timespec="milliseconds"),
         softwareVersion="2.0",
         supportedLanguages=["bs-BA", "bs-Cyrl-BA", "sr-BA", "en-US"],
     )
 
-    return response
-
 
 @app.api_route("/mock/lock", methods=["GET", "POST"])
 async def mock_lock(req: Request):
@@ -399,6 +542,8 @@ async def mock_lock(req: Request):
     app.state.current_api_attention = 404
     # No GSC state needed - only current_api_attention matters
     app.state.pin_fail_count = 0
+    persist_state()
+    app.state.events.publish(DEVICE_LOCKED, {"current_api_attention": 404, "reason": "mock"})
     response = {"current_api_attention": app.state.current_api_attention}
     debug_log_response(200, response)
     return response
@@ -412,6 +557,8 @@ async def mock_unlock(req: Request):
     debug_log_request(req)
     app.state.current_api_attention = 200
     # No GSC state needed - only current_api_attention matters
+    persist_state()
+    app.state.events.publish(DEVICE_UNLOCKED, {"current_api_attention": 200, "reason": "mock"})
     response = {"current_api_attention": app.state.current_api_attention}
     debug_log_response(200, response)
     return response
@@ -428,6 +575,544 @@ async def mock_get_current_api_attention(req: Request):
     return response
 
 
+async def _mock_params(req: Request) -> dict:
+    """Optional JSON object body merged over the query parameters."""
+    params = dict(req.query_params)
+    body = await req.body()
+    if body:
+        try:
+            params.update(json.loads(body))
+        except (ValueError, TypeError):
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="body must be a JSON object")
+    return params
+
+
+@app.get("/mock/api-keys")
+async def mock_list_api_keys(req: Request) -> dict:
+    """List registered API keys (digest prefixes only) with request counters.
+    No API key required for mock endpoints.
+    """
+    debug_log_request(req)
+    response: dict = app.state.api_keys.describe()
+    debug_log_response(200, response)
+    return response
+
+
+@app.post("/mock/api-keys")
+async def mock_add_api_key(req: Request) -> dict:
+    """Register an API key: {"key": ..., "rate": per second, "burst": ..., "name": ...}.
+    No API key required for mock endpoints.
+    """
+    debug_log_request(req)
+    spec = await _mock_params(req)
+    if not spec.get("key"):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="key is required")
+    try:
+        entry = app.state.api_keys.add(
+            spec["key"], spec.get("rate"), spec.get("burst"), spec.get("name")
+        )
+    except (TypeError, ValueError) as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    response: dict = entry.describe()
+    debug_log_response(200, response)
+    return response
+
+
+@app.delete("/mock/api-keys")
+async def mock_remove_api_key(req: Request) -> dict:
+    """Revoke an API key: {"key": ...}.
+    No API key required for mock endpoints.
+    """
+    debug_log_request(req)
+    key = (await _mock_params(req)).get("key")
+    if not key or not app.state.api_keys.remove(key):
+        raise HTTPException(status_code=404, detail="Unknown API key")
+    response = {"removed": True}
+    debug_log_response(200, response)
+    return response
+
+
+@app.get("/mock/scenario")
+async def mock_get_scenario(req: Request) -> dict:
+    """Return the active scenario rules and event counters.
+    No API key required for mock endpoints.
+    """
+    debug_log_request(req)
+    response: dict = app.state.scenario.describe()
+    debug_log_response(200, response)
+    return response
+
+
+@app.post("/mock/scenario")
+async def mock_set_scenario(req: Request) -> dict:
+    """Compile and install a new scenario; event counters start from zero.
+    No API key required for mock endpoints.
+    """
+    debug_log_request(req)
+    try:
+        spec = await req.json()
+        if isinstance(spec, list):
+            spec = {"rules": spec}
+        scenario = Scenario(spec, app.state.clock.time)
+    except (ValueError, ScenarioError) as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    app.state.scenario = scenario
+    response = scenario.describe()
+    debug_log_response(200, response)
+    return response
+
+
+@app.delete("/mock/scenario")
+async def mock_clear_scenario(req: Request) -> dict:
+    """Remove all scenario rules.
+    No API key required for mock endpoints.
+    """
+    debug_log_request(req)
+    app.state.scenario = Scenario(clock=app.state.clock.time)
+    response: dict = app.state.scenario.describe()
+    debug_log_response(200, response)
+    return response
+
+
+@app.get("/mock/clock")
+async def mock_get_clock(req: Request) -> dict:
+    """Return the device clock (time, rate, offset from the wall clock).
+    No API key required for mock endpoints.
+    """
+    debug_log_request(req)
+    response: dict = app.state.clock.describe()
+    debug_log_response(200, response)
+    return response
+
+
+@app.post("/mock/clock")
+async def mock_set_clock(req: Request) -> dict:
+    """Set and/or fast-forward the device clock: {"time": ISO, "advance": seconds, "rate": ...}.
+    No API key required for mock endpoints.
+    """
+    debug_log_request(req)
+    params = await _mock_params(req)
+    clock = app.state.clock
+    try:
+        rate = None if params.get("rate") is None else float(params["rate"])
+        if params.get("time"):
+            clock.set(parse_time(params["time"]), rate)
+        elif rate is not None:
+            clock.set_rate(rate)
+        if params.get("advance") is not None:
+            clock.advance(float(params["advance"]))
+    except (TypeError, ValueError) as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    response: dict = clock.describe()
+    debug_log_response(200, response)
+    return response
+
+
+@app.delete("/mock/clock")
+async def mock_reset_clock(req: Request) -> dict:
+    """Let the device clock follow the wall clock again.
+    No API key required for mock endpoints.
+    """
+    debug_log_request(req)
+    app.state.clock.reset()
+    response: dict = app.state.clock.describe()
+    debug_log_response(200, response)
+    return response
+
+
+@app.get("/mock/profile")
+async def mock_get_profile(req: Request) -> dict:
+    """Profiling switches and the stored request profiles.
+    No API key required for mock endpoints.
+    """
+    debug_log_request(req)
+    response: dict = app.state.profiles.describe()
+    debug_log_response(200, response)
+    return response
+
+
+@app.post("/mock/profile")
+async def mock_arm_profile(req: Request) -> dict:
+    """Profile the next requests: {"path": "/api/", "count": 1, "header": bool}.
+    ``"header": true`` profiles every request sent with an X-Profile header.
+    No API key required for mock endpoints.
+    """
+    debug_log_request(req)
+    params = await _mock_params(req)
+    profiles = app.state.profiles
+    try:
+        if "header" in params:
+            profiles.set_header(params["header"] in (True, "true", "1"))
+        if "count" in params or "path" in params or "header" not in params:
+            path = params.get("path") or "/api/"
+            if not isinstance(path, str):
+                raise ValueError(f"path must be a string, got {path!r}")
+            profiles.arm(path, int(params.get("count", 1)))
+    except (TypeError, ValueError) as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    response: dict = profiles.describe()
+    debug_log_response(200, response)
+    return response
+
+
+@app.delete("/mock/profile")
+async def mock_clear_profile(req: Request) -> dict:
+    """Stop profiling and drop the stored profiles.
+    No API key required for mock endpoints.
+    """
+    debug_log_request(req)
+    app.state.profiles.clear()
+    response: dict = app.state.profiles.describe()
+    debug_log_response(200, response)
+    return response
+
+
+@app.get("/mock/profile/{request_id}")
+async def mock_get_request_profile(
+    req: Request, request_id: str, sort: str = "cumulative", limit: int = DEFAULT_LIMIT, format: str = "text"
+) -> Response:
+    """pstats report of a profiled request (``?format=pstats``: binary stats file).
+    No API key required for mock endpoints.
+    """
+    debug_log_request(req)
+    entry = app.state.profiles.get(request_id)
+    if entry is None:
+        raise HTTPException(status_code=404, detail=f"No profile for request {request_id}")
+    if format == "pstats":
+        debug_log_response(200, "pstats file")
+        return Response(
+            entry.dump(),
+            media_type="application/octet-stream",
+            headers={"Content-Disposition": f'attachment; filename="{request_id}.prof"'},
+        )
+    try:
+        report = entry.report(sort, limit)
+    except KeyError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Unknown sort key {sort}")
+    debug_log_response(200, report)
+    return PlainTextResponse(report)
+
+
+@app.get("/mock/metrics")
+async def mock_get_metrics(req: Request) -> dict:
+    """Server counters and timers (compression, payload cache, ...).
+    No API key required for mock endpoints.
+    """
+    debug_log_request(req)
+    response: dict = app.state.metrics.snapshot()
+    debug_log_response(200, response)
+    return response
+
+
+@app.delete("/mock/metrics")
+async def mock_clear_metrics(req: Request) -> dict:
+    """Zero all counters and timers.
+    No API key required for mock endpoints.
+    """
+    debug_log_request(req)
+    app.state.metrics.clear()
+    response: dict = app.state.metrics.snapshot()
+    debug_log_response(200, response)
+    return response
+
+
+@app.get("/mock/events")
+async def mock_events(req: Request, types: str | None = None) -> StreamingResponse:
+    """Stream invoice, PIN and lock/unlock events as Server-Sent Events.
+    ``?types=invoice.issued,pin.attempt`` limits the stream to those types.
+    No API key required for mock endpoints.
+    """
+    debug_log_request(req)
+    wanted = [t for t in types.split(",") if t] if types else None
+    unknown = sorted(set(wanted or ()) - set(EVENT_TYPES))
+    if unknown:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unknown event types: {', '.join(unknown)}",
+        )
+    debug_log_response(200, "event stream")
+    return StreamingResponse(
+        app.state.events.stream(wanted),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def device_state() -> dict:
+    """Scalar device state saved alongside the journal in snapshots."""
+    return {
+        "current_api_attention": app.state.current_api_attention,
+        "pin_fail_count": app.state.pin_fail_count,
+        "total_counter": app.state.store.total_counter,
+        "type_counters": dict(app.state.store.type_counters),
+        "ordered": app.state.store.ordered,
+        "tax_rates": app.state.tax_rates,
+    }
+
+
+def persist_state() -> None:
+    """Queue the device state for the SQLite journal, if one is attached."""
+    if app.state.journal is not None:
+        app.state.journal.save_state(device_state())
+
+
+def install_device_state(state: dict, base: Segment) -> InvoiceStore:
+    """Install saved device state over ``base`` (snapshot or database segment)."""
+    store = InvoiceStore(
+        total_counter=state["total_counter"],
+        type_counters=state["type_counters"],
+        base=base,
+        ordered=state.get("ordered", True),
+    )
+    app.state.current_api_attention = state["current_api_attention"]
+    app.state.pin_fail_count = state["pin_fail_count"]
+    app.state.tax_rates = state["tax_rates"]
+    app.state.store = store
+    app.state.payloads = TTLCache(maxsize=PAYLOAD_CACHE_SIZE, ttl=None)
+    return store
+
+
+def restore_device_state(path: str) -> InvoiceStore:
+    """Install the device state and journal from a snapshot file."""
+    segment = read_snapshot(path)
+    store = install_device_state(segment.state, segment)
+    if app.state.journal is not None:
+        app.state.journal.replace(store.records(len(store)), device_state())
+    return store
+
+
+def open_journal(path: str) -> SQLiteJournal:
+    """SQLite journal at ``path`` configured from the environment."""
+    return SQLiteJournal(
+        path,
+        durability=os.getenv("OFS_MOCKUP_DB_DURABILITY", "batched"),
+        batch_size=int(os.getenv("OFS_MOCKUP_DB_BATCH", str(DEFAULT_BATCH_SIZE))),
+        interval=float(os.getenv("OFS_MOCKUP_DB_INTERVAL_MS", str(DEFAULT_INTERVAL * 1000))) / 1000,
+        metrics=app.state.metrics,
+    )
+
+
+def attach_journal(journal: SQLiteJournal | None) -> None:
+    """Mirror the journal and device state to ``journal`` (None: memory only).
+
+    State saved in the database by a previous run is loaded; an empty database
+    is filled with the current journal.
+    """
+    app.state.journal = journal
+    if journal is None:
+        return
+    state = journal.state()
+    if state is not None:
+        install_device_state(state, journal.segment())
+    else:
+        store = app.state.store
+        journal.replace(store.records(len(store)), device_state())
+
+
+def init_state() -> None:
+    """Build the startup device state from the environment."""
+    app.state.pin_fail_count = 0
+    app.state.current_api_attention = (
+        200 if os.getenv("OFS_MOCKUP_AVAILABLE") == "true" else 404
+    )
+    # Fault scenarios: a JSON rules file and/or the legacy "message:code" invoice error
+    app.state.scenario = load_scenario(
+        os.getenv("OFS_MOCKUP_SCENARIO"), os.getenv("OFS_MOCKUP_INVOICE_ERROR"), app.state.clock.time
+    )
+    # Tax configuration is device state (included in snapshots)
+    app.state.tax_rates = default_tax_rates()
+    # Journal of issued invoices and device counters (fresh devices start at a random counter)
+    app.state.store = InvoiceStore(total_counter=randint(0, 998))
+    app.state.payloads = TTLCache(maxsize=PAYLOAD_CACHE_SIZE, ttl=None)
+
+    # Optional SQLite persistence; a database holding a previous run's state
+    # takes precedence over a snapshot or synthetic history
+    journal = None
+    if os.getenv("OFS_MOCKUP_DB"):
+        journal = open_journal(os.environ["OFS_MOCKUP_DB"])
+    if journal is None or journal.state() is None:
+        if os.getenv("OFS_MOCKUP_RESTORE"):
+            restore_device_state(os.environ["OFS_MOCKUP_RESTORE"])
+        if os.getenv("OFS_MOCKUP_GENERATE"):
+            # Synthetic history is appended after any restored journal
+            populate(
+                app.state.store,
+                int(os.environ["OFS_MOCKUP_GENERATE"]),
+                seed=int(os.getenv("OFS_MOCKUP_SEED", "0")),
+            )
+    attach_journal(journal)
+
+
+def capture_baseline(name: str) -> Baseline:
+    """Record the current device state as a named baseline for reset_state()."""
+    # The current journal is frozen and shared; writing continues on a new layer
+    store = app.state.store.layer()
+    baseline = Baseline(
+        name,
+        app.state.current_api_attention,
+        app.state.pin_fail_count,
+        app.state.scenario.spec,
+        app.state.tax_rates,
+        store.base,
+    )
+    app.state.store = store
+    app.state.baselines[name] = baseline
+    return baseline
+
+
+def reset_state(baseline: str = DEFAULT_BASELINE) -> None:
+    """Bring the device back to a baseline without restarting the server.
+
+    Only pointers are swapped: the baseline journal is shared read-only under a
+    new empty layer, so the cost is the same for an empty device and one
+    holding millions of invoices.
+
+    The one exception is the ``--db`` journal: it is truncated back to the
+    baseline when the baseline's invoices prefix the current ones, but
+    resetting to a baseline captured on another branch (e.g. one captured
+    later than the state being discarded) rewrites the whole journal, O(n) in
+    the baseline's invoices.
+    """
+    base = app.state.baselines[baseline]
+    retired = (app.state.store, app.state.idempotency_cache, app.state.payloads)
+    # The database keeps the baseline's records when they prefix the current journal
+    truncate = app.state.store.extends(base.journal)
+
+    app.state.generation += 1
+    app.state.current_api_attention = base.current_api_attention
+    app.state.pin_fail_count = base.pin_fail_count
+    app.state.scenario = Scenario(base.scenario_spec, app.state.clock.time)
+    app.state.tax_rates = base.tax_rates
+    app.state.store = InvoiceStore(
+        base.journal.total_counter, base.journal.type_counters, base=base.journal
+    )
+    app.state.idempotency_cache = TTLCache(
+        maxsize=retired[1].maxsize, ttl=retired[1].ttl
+    )
+    app.state.payloads = TTLCache(maxsize=PAYLOAD_CACHE_SIZE, ttl=None)
+    retire(*retired)
+    journal = app.state.journal
+    if journal is not None:
+        if truncate:
+            journal.truncate(len(base.journal), device_state())
+        else:
+            journal.replace(base.journal.records(), device_state())
+
+
+app.state.generation = 0
+app.state.baselines = {}
+app.state.journal = None
+# QR worker processes import this module too (see qrworker.py) but serve nothing
+if not os.getenv(QR_WORKER_ENV):
+    init_state()
+    capture_baseline(DEFAULT_BASELINE)
+
+
+def serves_in_process(options: dict) -> bool:
+    """Whether ``uvicorn.run(**options)`` serves the app imported in this process."""
+    return not options["reload"] and options["workers"] == 1
+
+
+def rebuild_startup_state() -> None:
+    """Build the startup state (and the clean baseline) again from the environment.
+
+    Entry points that export their command line options after importing this
+    module call this when uvicorn serves the imported app; workers started by
+    the reloader or the prod profile import it afresh instead.
+    """
+    if app.state.journal is not None:
+        app.state.journal.close()
+    init_state()
+    capture_baseline(DEFAULT_BASELINE)
+
+
+@app.post("/mock/reset")
+async def mock_reset(req: Request) -> dict:
+    """Reset the device to a baseline ({"baseline": "clean"} by default) in constant time.
+    No API key required for mock endpoints.
+    """
+    debug_log_request(req)
+    params = await _mock_params(req)
+    device = params.get("device")
+    if device and device != DEVICE_SERIAL_NUMBER:
+        raise HTTPException(status_code=404, detail=f"Unknown device {device}")
+    name = params.get("baseline", DEFAULT_BASELINE)
+    if name not in app.state.baselines:
+        raise HTTPException(status_code=404, detail=f"Unknown baseline {name}")
+    reset_state(name)
+    response = {
+        "baseline": name,
+        "device": DEVICE_SERIAL_NUMBER,
+        "generation": app.state.generation,
+        "current_api_attention": app.state.current_api_attention,
+    }
+    app.state.events.publish(DEVICE_RESET, response)
+    debug_log_response(200, response)
+    return response
+
+
+@app.get("/mock/baseline")
+async def mock_list_baselines(req: Request) -> list:
+    """List the named baselines available to /mock/reset.
+    No API key required for mock endpoints.
+    """
+    debug_log_request(req)
+    response = [b.describe() for b in app.state.baselines.values()]
+    debug_log_response(200, response)
+    return response
+
+
+@app.post("/mock/baseline")
+async def mock_capture_baseline(req: Request) -> dict:
+    """Save the current device state as a named baseline ({"name": ...}).
+    No API key required for mock endpoints.
+    """
+    debug_log_request(req)
+    name = (await _mock_params(req)).get("name")
+    if not name:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="name is required")
+    response = capture_baseline(name).describe()
+    debug_log_response(200, response)
+    return response
+
+
+@app.post("/mock/snapshot")
+async def mock_snapshot(req: Request) -> dict:
+    """Write the device state and invoice journal to {"path": ...}.
+    No API key required for mock endpoints.
+    """
+    debug_log_request(req)
+    path = (await req.json()).get("path")
+    if not path:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="path is required")
+    store = app.state.store
+    # Records appended while writing are not part of this snapshot
+    count = await asyncio.to_thread(
+        write_snapshot, path, device_state(), store.records(len(store))
+    )
+    response = {"path": path, "invoices": count}
+    debug_log_response(200, response)
+    return response
+
+
+@app.post("/mock/restore")
+async def mock_restore(req: Request) -> dict:
+    """Replace the device state and journal with a snapshot from {"path": ...}.
+    No API key required for mock endpoints.
+    """
+    debug_log_request(req)
+    path = (await req.json()).get("path")
+    if not path:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="path is required")
+    try:
+        store = restore_device_state(path)
+    except (OSError, SnapshotError) as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    response = {"path": path, "invoices": len(store), **device_state()}
+    debug_log_response(200, response)
+    return response
+
+
 class PaymentLine(BaseModel):
     amount: float
     paymentType: str
@@ -515,30 +1200,123 @@ class InvoiceResponse(BaseModel):
     verificationUrl: str
 
 
+SAMPLE_INVOICE_PDF = os.path.join(os.path.dirname(__file__), "..", "input", "test_invoice.pdf")
+SAMPLE_RECEIPT_PNG = os.path.join(os.path.dirname(__file__), "..", "input", "test_receipt.png")
+
+
+@functools.lru_cache(maxsize=1)
+def sample_invoice_pdf_base64() -> str:
+    """The sample invoice PDF, read and base64-encoded once per process."""
+    with open(SAMPLE_INVOICE_PDF, "rb") as f:
+        return base64.b64encode(f.read()).decode("utf-8")
+
+
+def invoice_fingerprint(invoice_data: InvoiceData) -> str:
+    """Digest of the canonical invoiceRequest, to tell retries from key reuse."""
+    canonical = invoice_data.invoiceRequest.model_dump_json().encode("utf-8")
+    return hashlib.sha256(canonical).hexdigest()
+
+
+def invoice_idempotency_key(req: Request, fingerprint: str) -> str | None:
+    """Key identifying retries of the same submission, or None if not tracked."""
+    key = req.headers.get("idempotency-key")
+    if key and key.strip():
+        return "key:" + key.strip()
+    if app.state.idempotency_hash_body:
+        return "sha256:" + fingerprint
+    return None
+
+
+def check_idempotent_retry(original: str, fingerprint: str) -> None:
+    """A reused idempotency key must come with the same invoiceRequest."""
+    if original != fingerprint:
+        raise HTTPException(
+            status_code=422,
+            detail="Idempotency-Key was already used for a different invoiceRequest",
+        )
+
+
+def idempotent_replay(cached: tuple[str, bytes], fingerprint: str) -> Response:
+    """The original response to a retry."""
+    original, body = cached
+    check_idempotent_retry(original, fingerprint)
+    return Response(content=body, media_type="application/json", headers={"Idempotent-Replayed": "true"})
+
+
 @app.post("/api/invoices")
 async def invoice(req: Request, invoice_data: InvoiceData):
 
     # https://github.com/fastapi/fastapi/discussions/9601
 
-    # Check if invoice error simulation is configured
-    if hasattr(app.state, 'invoice_error') and app.state.invoice_error:
-        try:
-            error_parts = app.state.invoice_error.split(':', 1)
-            if len(error_parts) == 2:
-                error_message = error_parts[0]
-                error_code = int(error_parts[1])
-                error_response = ErrorResponse(
-                    details=None,
-                    message=error_message,
-                    statusCode=error_code
-                )
-                return JSONResponse(
-                    status_code=200,  # Return HTTP 200 but with error in response body
-                    content=error_response.model_dump()
-                )
-        except (ValueError, IndexError):
-            # If parsing fails, ignore the error simulation and proceed normally
-            pass
+    phases = request_phases(req, "invoice")
+    check_api_key(req)
+
+    fingerprint = invoice_fingerprint(invoice_data)
+    idempotency_key = invoice_idempotency_key(req, fingerprint)
+    if idempotency_key is None:
+        return await issue_invoice(req, invoice_data, phases)
+
+    # Retried submissions get the original response back without issuing again
+    cached = app.state.idempotency_cache.get(idempotency_key)
+    if cached is not None:
+        return idempotent_replay(cached, fingerprint)
+
+    # A retry sent while the original is still being issued waits for it
+    # instead of fiscalizing the invoice a second time
+    joined = idempotency_key in app.state.idempotent_calls
+
+    async def issue() -> tuple[str, InvoiceResponse | Response]:
+        return fingerprint, await issue_invoice(req, invoice_data, phases, idempotency_key, fingerprint)
+
+    original, response = await app.state.idempotent_calls.do(idempotency_key, issue)
+    check_idempotent_retry(original, fingerprint)
+    if not joined:
+        return response
+    cached = app.state.idempotency_cache.get(idempotency_key)
+    if cached is not None:
+        return idempotent_replay(cached, fingerprint)
+    # The original was rejected (nothing cached): the retry gets the same answer
+    return response
+
+
+async def issue_invoice(
+    req: Request,
+    invoice_data: InvoiceData,
+    phases: Phases,
+    idempotency_key: str | None = None,
+    fingerprint: str | None = None,
+) -> InvoiceResponse | Response:
+    """Fiscalize an invoice; the response is kept under ``idempotency_key`` if given."""
+    # Apply fault scenario rules (legacy OFS_MOCKUP_INVOICE_ERROR is one of them)
+    for rule in app.state.scenario.fire("invoice"):
+        if rule.action == "error":
+            return JSONResponse(
+                status_code=200,  # Return HTTP 200 but with error in response body
+                content=rule.error,
+            )
+        if rule.action == "lock":
+            app.state.current_api_attention = 404
+            persist_state()
+            app.state.events.publish(DEVICE_LOCKED, {"current_api_attention": 404, "reason": "scenario"})
+        elif rule.action == "delay":
+            phases.mark("parse")
+            await asyncio.sleep(rule.delay)
+            phases.mark("delay")
+
+    # Internal record of the request (money in units); the API models stay at the edges
+    invoice = Invoice.from_request(invoice_data.invoiceRequest)
+
+    # Reject invalid requests before any logging, rendering or numbering
+    check = check_invoice(invoice)
+    if not check:
+        print(f"Invoice rejected: {check.message}")
+        if check.bad_request:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=check.message)
+        return JSONResponse(
+            status_code=200,  # Return HTTP 200 but with error in response body
+            content=ErrorResponse(details=None, message=check.message, statusCode=-1).model_dump(),
+        )
+    phases.mark("parse")
 
     type = invoice_data.invoiceRequest.invoiceType
     cashier = invoice_data.invoiceRequest.cashier
@@ -614,42 +1392,17 @@ async def invoice(req: Request, invoice_data: InvoiceData):
             print(f"- {line}")
         print()  # Add extra newline after footer
     
-    # Validate GTIN for all items
-    for item in invoice_data.invoiceRequest.items:
-        if not item.gtin or item.gtin.strip() == "":
-            error_response = ErrorResponse(
-                details=None,
-                message=f"gtin za artikal {item.name} nije popunjen",
-                statusCode=-1
-            )
-            return JSONResponse(
-                status_code=200,  # Return HTTP 200 but with error in response body
-                content=error_response.model_dump()
-            )
-
-    for payment in invoice_data.invoiceRequest.payment:
-        print("paymentType:", payment.paymentType, " ; paymentAmount:", payment.amount)
+    for payment in invoice.payments:
+        print("paymentType:", payment.payment_type, " ; paymentAmount:", to_amount(payment.amount))
 
     if type == "Copy":
-        if (not referentDocumentNumber) or (not referentDocumentDT):
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Copy ne sadrzi referentDocumentNumber and DT",
-            )
-        else:
-            print(
-                "referentni fiskalni dokument:",
-                referentDocumentNumber,
-                referentDocumentDT,
-            )
+        print(
+            "referentni fiskalni dokument:",
+            referentDocumentNumber,
+            referentDocumentDT,
+        )
 
     if transactionType == "Refund":
-        if (not referentDocumentNumber) or (not referentDocumentDT):
-            return {
-                "details": None,
-                "message": "Refund ne sadrzi referentDocumentNumber and referentDocumentDT",
-                "statusCode": -1
-            }
         print(
             "refund referentni fiskalni dokument broj:",
             referentDocumentNumber,
@@ -659,29 +1412,27 @@ async def invoice(req: Request, invoice_data: InvoiceData):
             referentDocumentDT,
         )
 
-    totalValue = 0
+    # Money is handled in integer units (see money.py) until the JSON response
+    totalValue = check.total
     cStavke = ""
 
-    for item in invoice_data.invoiceRequest.items:
-        totalValue += item.totalAmount
-        nDiscount = item.discount or 0.0
-        nDiscountAmount = item.discountAmount or 0.00
+    for item in invoice.items:
         label = item.labels[0]
         print(f"gtin: {item.gtin}")
         
         # Build discount part conditionally
-        discount_part = f"discount: {nDiscount:.2f}"
-        if item.discountAmount is not None:
-            discount_part += f" discountAmount: {nDiscountAmount:.2f}"
+        discount_part = f"discount: {format_amount(to_units(item.discount or 0))}"
+        if item.discount_amount is not None:
+            discount_part += f" discountAmount: {format_amount(item.discount_amount)}"
         
         cStavka = (
-            "%s quantity: %.2f unitPrice: %.2f %s  totalAmount: %.2f label: %s gtin: %s\r\n"
+            "%s quantity: %.2f unitPrice: %s %s  totalAmount: %s label: %s gtin: %s\r\n"
             % (
                 item.name,
                 item.quantity,
-                item.unitPrice,
+                format_amount(item.unit_price),
                 discount_part,
-                item.totalAmount,
+                format_amount(item.total),
                 label,
                 item.gtin,
             )
@@ -690,122 +1441,186 @@ async def invoice(req: Request, invoice_data: InvoiceData):
         print(cStavka)
     # print(cStavke)
 
-    print("totalValue:", totalValue)
-    
-    # Validate totalValue matches payment amount
-    payment_total = sum(payment.amount for payment in invoice_data.invoiceRequest.payment)
-    print("paymentTotal:", payment_total)
-    
-    if abs(totalValue - payment_total) > 0.01:  # Allow small rounding differences
-        print(f"WARNING: totalValue ({totalValue:.2f}) != paymentTotal ({payment_total:.2f})")
-        return {
-            "details": None,
-            "message": f"Total amount mismatch: calculated {totalValue:.2f} but payment is {payment_total:.2f}",
-            "statusCode": -1
-        }
+    print("totalValue:", format_amount(totalValue))
+    print("paymentTotal:", format_amount(check.payment_total))
 
     # payments_length = len(invoice_data.invoiceRequest.payment)
 
-    cInvoiceNumber = str(randint(1, 999)).zfill(3)
+    totalCounter, transactionTypeCounter = app.state.store.next_counters(
+        type, transactionType
+    )
+    cInvoiceNumber = str(totalCounter).zfill(3)
+    cInvoiceCounter = "%d/%dZE" % (transactionTypeCounter, totalCounter)
 
-    cFullInvoiceNumber = "AX4F7Y5L-BX4F7Y5L-" + cInvoiceNumber
+    cFullInvoiceNumber = INVOICE_PREFIX + cInvoiceNumber
 
-    cDTNow = datetime.datetime.now().isoformat()
+    dtNow = app.state.clock.now()
+    cDTNow = dtNow.isoformat()
     # >>> '2024-08-01T14:38:32.499588'
 
-    if check_api_key(req):
-
-        cRacun = None
-        if type == "Normal":
-            cRacun = "FISKALNI RAČUN"
-        else:
-            cRacun = "KOPIJA FISKALNOG RAČUNA"
+    cRacun = None
+    if type == "Normal":
+        cRacun = "FISKALNI RAČUN"
+    else:
+        cRacun = "KOPIJA FISKALNOG RAČUNA"
+    
+    phases.mark("logic")
+    # Handle receipt image generation for print=false case
+    invoice_image_pdf_base64 = None
+    invoice_image_png_base64 = None
+    
+    if (print_receipt is False and render_receipt_image is True and 
+        receipt_layout and receipt_image_format):
         
-        # Handle receipt image generation for print=false case
-        invoice_image_pdf_base64 = None
-        invoice_image_png_base64 = None
+        if receipt_image_format == "Pdf" and receipt_layout == "Invoice":
+            # Load test invoice PDF and encode as base64
+            try:
+                invoice_image_pdf_base64 = sample_invoice_pdf_base64()
+                print(f"Generated PDF base64 image, length: {len(invoice_image_pdf_base64)}")
+            except Exception as e:
+                print(f"Error loading test invoice PDF: {e}")
+                # Fallback to dummy base64
+                invoice_image_pdf_base64 = "JVBERi0xLjcKJcOkw7zDtsOfCjIgMCBvYmoKPDwvTGVuZ3RoIDMgMCBSL0ZpbHRlci9GbGF0ZURlY29kZT4+CnN0cmVhbQp4nL1T"
         
-        if (print_receipt is False and render_receipt_image is True and 
-            receipt_layout and receipt_image_format):
-            
-            if receipt_image_format == "Pdf" and receipt_layout == "Invoice":
-                # Load test invoice PDF and encode as base64
-                try:
-                    pdf_path = os.path.join(os.path.dirname(__file__), "..", "input", "test_invoice.pdf")
-                    with open(pdf_path, "rb") as f:
-                        pdf_data = f.read()
-                        invoice_image_pdf_base64 = base64.b64encode(pdf_data).decode('utf-8')
-                        print(f"Generated PDF base64 image, length: {len(invoice_image_pdf_base64)}")
-                except Exception as e:
-                    print(f"Error loading test invoice PDF: {e}")
-                    # Fallback to dummy base64
-                    invoice_image_pdf_base64 = "JVBERi0xLjcKJcOkw7zDtsOfCjIgMCBvYmoKPDwvTGVuZ3RoIDMgMCBSL0ZpbHRlci9GbGF0ZURlY29kZT4+CnN0cmVhbQp4nL1T"
-            
-            elif receipt_image_format == "Png":
-                # Generate dummy PNG base64 for slip format
-                invoice_image_png_base64 = "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNkYPhfDwAChwGA60e6kgAAAABJRU5ErkJggg=="
-                print(f"Generated PNG base64 image for receipt format")
-
-        response = InvoiceResponse(
-            address=BUSINESS_ADDRESS,
-            businessName=BUSINESS_NAME,
-            district="ZEDO",
-            encryptedInternalData="Vvwq4nVn/wIQFAKE",
-            invoiceCounter="100/" + cInvoiceNumber + "ZE",
-            invoiceCounterExtension="ZE",
-            invoiceImageHtml=None,
-            invoiceImagePdfBase64=invoice_image_pdf_base64,
-            invoiceImagePngBase64=invoice_image_png_base64,
-            invoiceNumber=cFullInvoiceNumber,
-            journal="=========== "
-            + cRacun
-            + " ===========\r\n             4402692070009            \r\n       Sigma-com doo Zenica      \r\n      7. Muslimanske Brigade 77      \r\n              Zenica              \r\nKasir:                        Radnik 1\r\nESIR BROJ:                      13/2.0\r\n----------- PROMET PRODAJA -----------\r\nАrtikli                               \r\n======================================\r\nNaziv  Cijena        Kol.         Ukupno\r\n "
-            + cStavke
-            + "--------------------------------------\r\n"
-            + "Ukupan iznos:                   "
-            + "%.2f" % (totalValue)
-            + "\r\nGotovina:                     "
-            + "%.2f" % (totalValue)
-            + "\r\n======================================\r\nOznaka    Naziv    Stopa    Porez\r\nF          ECAL      11%          9,91\r\n--------------------------------------\r\nUkupan iznos poreza:              9,91\r\n======================================\r\n"
-            + "PFR brijeme:      12.03.2024. 07:47:09\r\nOFS br. rač:      "
-            + cFullInvoiceNumber
-            + "\r\nBrojač računa:               100/138ZE\r\n======================================"
-            + "\r\n======== KRAJ "
-            + cRacun
-            + "=======\r\n",
-            locationName="Sigma-com doo Zenica poslovnica Sarajevo",
-            messages="Uspješno",
-            mrc="01-0001-WPYB002248200772",
-            requestedBy="RX4F7Y5L",
-            sdcDateTime=cDTNow,  # "2024-09-15T07:47:09.548+01:00",
-            signature="Mw+IB0vgnaMjYrwA7m7zhtRseRIZFAKE",
-            signedBy="RX4F7Y5L",
-            taxGroupRevision=2,
-            taxItems=[
-                TaxItems(
-                    amount=9.9099,
-                    categoryName="ECAL",
-                    categoryType=0,
-                    label="F",
-                    rate=11,
-                )
-            ],
-            tin="4402692070009",
-            totalAmount=totalValue,
-            totalCounter=138,
-            transactionTypeCounter=100,
-            verificationQRCode="R0lGODlhhAGEAfFAKE",
-            verificationUrl="https://suf.poreskaupravars.org/v/?vl=A0IzWTJXWjlHQjNZMldaOUcDAAAAAgAAAPQBAAAAAAAAAAABkik/ZhYAAAC7LQd7m8XLi7qLHX0zmm914sRCQ5Zq+DYlBlUnQqsqVBLIXE/whezsjORg7KWxe6dCZQrjc9WiH7NeBD3J5kInjeVwBQa8ITcVZhiT9AuEJguVBHBAqYmakkaM8qX9hRNP/ah1//HLRfGkKTT3VHQucjQyT7yRj4KSwySm4c3sY7mK2PPhX9j3Sq3n3IRWstgOyzxJlGa9JkOfyFEBxW37osv/YvMVDOhDYX3fFUJ/DDChdcIOTlA7eFdXcEyAQmDMd5L5rM4VHn9GVtLb5BRWORRgHhXjnWgmEurKJ8Gtm8a8l+dM9/tv1z7R2C4WDduovRYSzvHv4v+xzhfpHDuYhP2chHsNH8oEdEHPxIYccxS/d7Lry0zZ0K72vXFskrpibcSxahYBpHceQRmG6oHDjQOT4YhjSj/dl0WK2Q/flbk9g6oia/+V0WUlv150MovDSNCuLnkfUOO+FdfPkYp7y9DnsLJIG/RTmMo3qOFJUDCtOmCEowMd6L8TwEhdY+H9FT390C/DMhXZAYYOaThOMIA1xqoPCrFaVLkSPpOAD7/eKsifk+I8oLtjcW8P0Pw2FU3gDOJhLTTVpBvYrtgyTODk18KFTP/VT2Lnbr2cNYYlK+kKjCRSkRVmucYohpEUlDHBshtmApOpqi54mgyYQPZXUwSFZjpNU8wMhMpj6kUeoL1/lkYz1k4xF7omPUQ=",
+        elif receipt_image_format == "Png":
+            # Generate dummy PNG base64 for slip format
+            invoice_image_png_base64 = "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNkYPhfDwAChwGA60e6kgAAAABJRU5ErkJggg=="
+            print(f"Generated PNG base64 image for receipt format")
+    phases.mark("render")
+
+    # Signed in arrival order, so invoices are still recorded in counter order
+    invoice.number, invoice.sdc_date_time, invoice.total = cFullInvoiceNumber, cDTNow, totalValue
+    signature, encrypted_internal_data = await app.state.signer.sign(
+        invoice, SDC_UID, totalCounter, transactionTypeCounter
+    )
+    verification = verification_url(
+        requested_by=SDC_UID,
+        signed_by=SDC_UID,
+        total_counter=totalCounter,
+        transaction_type_counter=transactionTypeCounter,
+        total=totalValue,
+        sdc_date_time=cDTNow,
+        invoice_type=type,
+        transaction_type=transactionType,
+        buyer_id=buyerId,
+        encrypted_internal_data=encrypted_internal_data,
+        signature=signature,
+    )
+    # The QR code is encoded in the worker pool while the invoice is recorded
+    qr_codes = app.state.qr_codes
+    verification_qr = (
+        None
+        if qr_codes is None
+        else asyncio.ensure_future(qr_codes.get(cFullInvoiceNumber, verification))
+    )
+    phases.mark("logic")
+
+    response = InvoiceResponse(
+        address=BUSINESS_ADDRESS,
+        businessName=BUSINESS_NAME,
+        district="ZEDO",
+        encryptedInternalData=encrypted_internal_data,
+        invoiceCounter=cInvoiceCounter,
+        invoiceCounterExtension="ZE",
+        invoiceImageHtml=None,
+        invoiceImagePdfBase64=invoice_image_pdf_base64,
+        invoiceImagePngBase64=invoice_image_png_base64,
+        invoiceNumber=cFullInvoiceNumber,
+        journal="=========== "
+        + cRacun
+        + " ===========\r\n             4402692070009            \r\n       Sigma-com doo Zenica      \r\n      7. Muslimanske Brigade 77      \r\n              Zenica              \r\nKasir:                        Radnik 1\r\nESIR BROJ:                      13/2.0\r\n----------- PROMET PRODAJA -----------\r\nАrtikli                               \r\n======================================\r\nNaziv  Cijena        Kol.         Ukupno\r\n "
+        + cStavke
+        + "--------------------------------------\r\n"
+        + "Ukupan iznos:                   "
+        + format_amount(totalValue)
+        + "\r\nGotovina:                     "
+        + format_amount(totalValue)
+        + "\r\n======================================\r\nOznaka    Naziv    Stopa    Porez\r\nF          ECAL      11%          9,91\r\n--------------------------------------\r\nUkupan iznos poreza:              9,91\r\n======================================\r\n"
+        + "PFR brijeme:      "
+        + dtNow.strftime("%d.%m.%Y. %H:%M:%S")
+        + "\r\nOFS br. rač:      "
+        + cFullInvoiceNumber
+        + "\r\nBrojač računa:               "
+        + cInvoiceCounter
+        + "\r\n======================================"
+        + "\r\n======== KRAJ "
+        + cRacun
+        + "=======\r\n",
+        locationName="Sigma-com doo Zenica poslovnica Sarajevo",
+        messages="Uspješno",
+        mrc="01-0001-WPYB002248200772",
+        requestedBy=SDC_UID,
+        sdcDateTime=cDTNow,  # "2024-09-15T07:47:09.548+01:00",
+        signature=signature,
+        signedBy=SDC_UID,
+        taxGroupRevision=2,
+        taxItems=[
+            TaxItems(
+                amount=9.9099,
+                categoryName="ECAL",
+                categoryType=0,
+                label="F",
+                rate=11,
+            )
+        ],
+        tin="4402692070009",
+        totalAmount=to_amount(totalValue),
+        totalCounter=totalCounter,
+        transactionTypeCounter=transactionTypeCounter,
+        verificationQRCode=VERIFICATION_QR_PLACEHOLDER,
+        verificationUrl=verification,
+    )
+    phases.mark("render")
+
+    # Journal keeps the request and response without the rendered images (the
+    # QR code is rebuilt from verificationUrl on reprints)
+    store = app.state.store
+    pos = store.append(
+        {
+            "invoiceRequest": invoice.request_dict(),
+            "invoiceResponse": response.model_dump(
+                exclude={"invoiceImagePdfBase64", "invoiceImagePngBase64", "verificationQRCode"}
+            ),
+        },
+        invoice,
+    )
+    journal = app.state.journal
+    if journal is not None:
+        # Only queued here; the writer thread commits in batches
+        committed = journal.append(pos, cFullInvoiceNumber, store.raw(pos), device_state())
+        if committed is not None:
+            await asyncio.wrap_future(committed)
+    phases.mark("logic")
+    if verification_qr is not None:
+        response.verificationQRCode = await verification_qr
+        phases.mark("render")
+    if app.state.events:
+        app.state.events.publish(
+            INVOICE_ISSUED,
+            {
+                "invoiceNumber": cFullInvoiceNumber,
+                "invoiceCounter": cInvoiceCounter,
+                "invoiceType": type,
+                "transactionType": transactionType,
+                "totalAmount": to_amount(totalValue),
+                "sdcDateTime": cDTNow,
+            },
         )
+    phases.mark("logic")
 
-        return response
-    else:
-        return None
+    if idempotency_key is not None:
+        # Serialize once so the original and every replay are byte-identical
+        body = response.model_dump_json().encode("utf-8")
+        app.state.idempotency_cache.set(idempotency_key, (fingerprint, body))
+        return Response(content=body, media_type="application/json")
+
+    return response
 
 
 class InvoiceTypes(str, Enum):
     normal = "Normal"
     advance = "Advance"
+    copy = "Copy"
 
 
 class TransactionTypes(str, Enum):
@@ -828,10 +1643,19 @@ class InvoiceSearch(BaseModel):
     invoiceTypes: list[InvoiceTypes]
     transactionTypes: list[TransactionTypes]
     paymentTypes: list[PaymentTypes]
+    # Optional paging: at most pageSize rows, continuing after the Next-Cursor
+    # header value of the previous page
+    pageSize: int | None = Field(default=None, ge=1)
+    cursor: str | None = None
+    # Indexed lookups: only invoices with this GTIN / cashier / buyerId
+    gtin: str | None = None
+    cashier: str | None = None
+    buyerId: str | None = None
 
 
 @app.post("/api/invoices/search")
 async def invoices_search(req: Request, invoiceSearchData: InvoiceSearch):
+    phases = request_phases(req, "search")
 
     print("================= invoice search ==============================")
     print("search from:", invoiceSearchData.fromDate, " to: ", invoiceSearchData.toDate)
@@ -852,34 +1676,174 @@ RX4F7Y5L-RX4F7Y5L-144,Advance,Sale,2024-03-12T07:53:26.177+01:00,400.0000
 RX4F7Y5L-RX4F7Y5L-145,Advance,Refund,2024-03-12T07:55:07.582+01:00,500.0000
 """
 
-    if check_api_key(req):
+    check_api_key(req)
+
+    store = app.state.store
+    if not len(store):
+        # A fresh device without a journal reports the sample history above
         return lista_racuna
 
-    return lista_racuna
+    start = 0
+    if invoiceSearchData.cursor:
+        try:
+            start = store.resume(decode_cursor(invoiceSearchData.cursor))
+        except ValueError as e:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+        if start is None:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST, detail="Cursor no longer valid"
+            )
+    phases.mark("parse")
+
+    # Rows are formatted as the scan decodes them: both count as logic
+    rows: list[str] = []
+    headers = {}
+    last: dict | None = None  # last row on the page, the cursor when another match follows
+    for doc in store.search(
+        invoiceSearchData.fromDate,
+        invoiceSearchData.toDate,
+        invoiceSearchData.amountFrom,
+        invoiceSearchData.amountTo,
+        [t.value for t in invoiceSearchData.invoiceTypes],
+        [t.value for t in invoiceSearchData.transactionTypes],
+        [t.value for t in invoiceSearchData.paymentTypes],
+        start=start,
+        keys={
+            field: getattr(invoiceSearchData, field)
+            for field in INDEXED_FIELDS
+            if getattr(invoiceSearchData, field)
+        },
+    ):
+        if last is not None and len(rows) == invoiceSearchData.pageSize:
+            # One more match exists: the page is full and the last row is the cursor
+            headers["Next-Cursor"] = encode_cursor(last)
+            break
+        last = doc
+        request, response = doc["invoiceRequest"], doc["invoiceResponse"]
+        rows.append(
+            "%s,%s,%s,%s,%.4f\n"
+            % (
+                response["invoiceNumber"],
+                request["invoiceType"],
+                request["transactionType"],
+                response["sdcDateTime"],
+                response["totalAmount"],
+            )
+        )
+    phases.mark("logic")
+    body = "".join(rows)
+    phases.mark("render")
+    return JSONResponse(body, headers=headers)
+
+
+class InvoiceAggregate(BaseModel):
+    fromDate: datetime.date
+    toDate: datetime.date
+
+
+@app.post("/api/invoices/aggregate")
+async def invoices_aggregate(req: Request, aggregateData: InvoiceAggregate) -> dict:
+    """Count and total per invoiceType, transactionType and paymentType for a date range.
+
+    Answered from running totals kept as invoices are issued (see aggregate.py).
+    """
+    check_api_key(req)
+    debug_log_request(req)
+    totals = app.state.store.aggregate(aggregateData.fromDate, aggregateData.toDate)
+    response = {
+        "fromDate": aggregateData.fromDate.isoformat(),
+        "toDate": aggregateData.toDate.isoformat(),
+        **report(totals),
+    }
+    debug_log_response(200, response)
+    return response
+
+
+def stored_invoice(invoiceNumber: str, imageFormat: str | None, receiptLayout: str | None) -> dict:
+    """GET /api/invoices/{invoiceNumber} body for an invoice issued by this device."""
+    issued = app.state.store.get(invoiceNumber)
+    response = issued["invoiceResponse"]
+    return {
+        "autoGenerated": False,
+        "invoiceRequest": issued["invoiceRequest"],
+        "invoiceResponse": {
+            **response,
+            "invoiceImagePdfBase64": None,
+            "invoiceImagePngBase64": None,
+            "verificationQRCode": stored_verification_qr(invoiceNumber, response.get("verificationUrl")),
+        },
+        "issueCopy": False,
+        "print": True,
+        "receiptImageBase64": None,
+        "receiptImageFormat": imageFormat,
+        "receiptLayout": receiptLayout,
+        "renderReceiptImage": False,
+        "skipEftPos": False,
+        "skipEftPosPrint": False,
+    }
+
+
+def stored_verification_qr(invoiceNumber: str, url: str | None) -> str | None:
+    if not url:
+        return None  # generated history carries no verification data
+    qr_codes = app.state.qr_codes
+    if qr_codes is None:
+        return VERIFICATION_QR_PLACEHOLDER
+    # Normally encoded by get_invoice beforehand; evicted meanwhile, encode here
+    return qr_codes.cached(invoiceNumber, url) or gif_base64(url)
+
+
+async def encode_stored_verification_qr(invoiceNumber: str) -> None:
+    """Have the QR code of a stored invoice in the cache (encoded in the worker pool)."""
+    qr_codes = app.state.qr_codes
+    if qr_codes is None:
+        return
+    url = app.state.store.get(invoiceNumber)["invoiceResponse"].get("verificationUrl")
+    if url:
+        await qr_codes.get(invoiceNumber, url)
 
 
 @app.get("/api/invoices/{invoiceNumber}")
 async def get_invoice(
+    req: Request,
     invoiceNumber: str,
     imageFormat: str | None = None,
     includeHeaderAndFooter: bool | None = None,
     receiptLayout: str | None = None,
 ):
-    print("Invoice number:", invoiceNumber)
-    print(
-        "PARAMS:  imageFormat:",
-        imageFormat,
-        " includeHeaderAndFooter:",
-        includeHeaderAndFooter,
-        " receiptLayout:",
-        receiptLayout,
-    )
-
-    lPDV17 = True if invoiceNumber[0:1] != "0" else False
+    phases = request_phases(req, "get_invoice")
+    debug_log_request(req)
+    phases.mark("parse")
 
     if invoiceNumber.strip() == "ERROR":
         return {"error": 1}
 
+    if app.state.store.find(invoiceNumber) is not None:
+        key: tuple = ("invoice", invoiceNumber, imageFormat, includeHeaderAndFooter, receiptLayout)
+        phases.mark("logic")
+        if key not in app.state.payloads:
+            await encode_stored_verification_qr(invoiceNumber)
+            phases.mark("render")
+        render = functools.partial(stored_invoice, invoiceNumber, imageFormat, receiptLayout)
+    else:
+        # Not issued here: canned example document (cached under its own key, so
+        # issuing the number later is not shadowed)
+        key = ("sample", invoiceNumber)
+        render = functools.partial(sample_invoice, invoiceNumber)
+        phases.mark("logic")
+
+    def build() -> bytes:
+        body = render()
+        phases.mark("render")
+        return json_bytes(body)
+
+    return await cached_payload(req, key, build)
+
+
+def sample_invoice(invoiceNumber: str) -> dict:
+    """Canned GET /api/invoices/{invoiceNumber} body for numbers not in the journal."""
+    lPDV17 = True if invoiceNumber[0:1] != "0" else False
+
     return {
         "autoGenerated": False,
         "invoiceRequest": {
@@ -966,6 +1930,40 @@ async def get_invoice(
     }
 
 
+# Raw receipt images: imageFormat -> (content type, file)
+RECEIPT_IMAGES = {
+    "pdf": ("application/pdf", SAMPLE_INVOICE_PDF),
+    "png": ("image/png", SAMPLE_RECEIPT_PNG),
+}
+
+
+@functools.lru_cache(maxsize=len(RECEIPT_IMAGES))
+def receipt_image_stat(path: str) -> os.stat_result:
+    return os.stat(path)
+
+
+@app.api_route("/api/invoices/{invoiceNumber}/{imageFormat}", methods=["GET", "HEAD"])
+async def get_invoice_image(req: Request, invoiceNumber: str, imageFormat: str) -> FileResponse:
+    """Receipt image as raw bytes (``pdf`` or ``png``) instead of base64 in JSON.
+
+    The file is streamed from disk with Content-Length and Range support.
+    """
+    check_api_key(req)
+    image = RECEIPT_IMAGES.get(imageFormat.lower())
+    if image is None:
+        raise HTTPException(status_code=404, detail=f"Unknown image format {imageFormat}")
+    if invoiceNumber.strip() == "ERROR":
+        raise HTTPException(status_code=404, detail=f"Unknown invoice {invoiceNumber}")
+    media_type, path = image
+    return FileResponse(
+        path,
+        media_type=media_type,
+        filename=f"{invoiceNumber}.{imageFormat.lower()}",
+        content_disposition_type="inline",
+        stat_result=receipt_image_stat(path),
+    )
+
+
 def main():
     """Main entry point for the OFS mockup server."""
     parser = argparse.ArgumentParser(description="OFS Mockup Server")
@@ -985,20 +1983,99 @@ def main():
         default=API_KEY,
         help=f"Set custom API key for authentication (default: {API_KEY})",
     )
+    parser.add_argument(
+        "--api-keys",
+        help="JSON file with additional API keys ([{\"key\": ..., \"rate\": ..., \"burst\": ...}])",
+    )
+    parser.add_argument(
+        "--rate-limit",
+        help="Throttle the default API key to 'rate[:burst]' requests per second",
+    )
+    parser.add_argument(
+        "--scenario",
+        help="Load fault scenario rules from a JSON file",
+    )
+    parser.add_argument(
+        "--restore",
+        help="Start from a device state snapshot written by /mock/snapshot",
+    )
+    parser.add_argument(
+        "--generate",
+        type=int,
+        help="Fill the journal with N synthetic invoices at startup (see ofs-mockup-gen)",
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=0,
+        help="Random seed for --generate (default: 0)",
+    )
+    parser.add_argument(
+        "--db",
+        help="Persist the journal and device state to this SQLite file (reloaded on restart)",
+    )
+    parser.add_argument(
+        "--durability",
+        choices=DURABILITY_MODES,
+        default="batched",
+        help="SQLite commit policy: per invoice, in batches (default) or without fsync",
+    )
+    parser.add_argument(
+        "--idempotency-hash",
+        action="store_true",
+        help="Treat identical invoiceRequest bodies as retries even without an Idempotency-Key header",
+    )
+    add_profile_arguments(parser)
     args, _ = parser.parse_known_args()
 
-    # Initialize app state from CLI args
+    exit_on_sigterm()
+
+    if args.idempotency_hash:
+        os.environ["OFS_MOCKUP_IDEMPOTENCY_HASH"] = "true"
+        app.state.idempotency_hash_body = True
+    if args.scenario:
+        # Export for the reloader's worker process, which re-reads the environment
+        os.environ["OFS_MOCKUP_SCENARIO"] = args.scenario
+        app.state.scenario = load_scenario(
+            args.scenario, os.getenv("OFS_MOCKUP_INVOICE_ERROR"), app.state.clock.time
+        )
+
+    # Initialize app state from CLI args; worker processes (reloader or prod
+    # workers) import the app afresh and read the same values from the environment
+    os.environ["OFS_MOCKUP_AVAILABLE"] = "true" if args.available else "false"
+    os.environ["OFS_MOCKUP_PIN"] = args.pin
+    os.environ["OFS_MOCKUP_API_KEY"] = args.api_key
+    if args.api_keys:
+        os.environ["OFS_MOCKUP_API_KEYS_FILE"] = args.api_keys
+    if args.rate_limit:
+        os.environ["OFS_MOCKUP_RATE_LIMIT"] = args.rate_limit
     app.state.current_api_attention = 200 if args.available else 404
     app.state.pin = args.pin
     app.state.api_key = args.api_key
+    app.state.api_keys = load_registry(args.api_key, args.api_keys, args.rate_limit)
+
+    # A snapshot overrides the initial availability with the saved device state
+    if args.restore:
+        os.environ["OFS_MOCKUP_RESTORE"] = args.restore
+    if args.generate:
+        os.environ["OFS_MOCKUP_GENERATE"] = str(args.generate)
+        os.environ["OFS_MOCKUP_SEED"] = str(args.seed)
+    if args.db:
+        os.environ["OFS_MOCKUP_DB"] = args.db
+        os.environ["OFS_MOCKUP_DB_DURABILITY"] = args.durability
+
+    options = uvicorn_options(args)
+    # The state built on import predates the options exported above; workers
+    # started by the reloader or the prod profile build theirs on import
+    if __name__ == "ofs_mockup_srv.main" and serves_in_process(options):
+        rebuild_startup_state()
 
     uvicorn.run(
         "ofs_mockup_srv.main:app",
         host="0.0.0.0",
         port=args.port,
-        reload=True,
         access_log=False,
-        workers=1,
+        **options,
     )
 
 
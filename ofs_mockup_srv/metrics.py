@@ -0,0 +1,54 @@
+"""
+In-process counters and timers exposed on /mock/metrics.
+"""
+
+import time
+from collections import defaultdict
+from collections.abc import Iterator
+from contextlib import contextmanager
+
+
+class Metrics:
+    def __init__(self) -> None:
+        self.counters: defaultdict[str, int] = defaultdict(int)
+        # name -> [count, total seconds, max seconds]
+        self.timers: dict[str, list] = {}
+
+    def incr(self, name: str, n: int = 1) -> None:
+        self.counters[name] += n
+
+    def observe(self, name: str, seconds: float) -> None:
+        timer = self.timers.get(name)
+        if timer is None:
+            self.timers[name] = [1, seconds, seconds]
+        else:
+            timer[0] += 1
+            timer[1] += seconds
+            if seconds > timer[2]:
+                timer[2] = seconds
+
+    @contextmanager
+    def timer(self, name: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started)
+
+    def clear(self) -> None:
+        self.counters.clear()
+        self.timers.clear()
+
+    def snapshot(self) -> dict:
+        return {
+            "counters": dict(self.counters),
+            "timers": {
+                name: {
+                    "count": count,
+                    "total_ms": round(total * 1000, 3),
+                    "avg_ms": round(total * 1000 / count, 3),
+                    "max_ms": round(peak * 1000, 3),
+                }
+                for name, (count, total, peak) in self.timers.items()
+            },
+        }
@@ -0,0 +1,53 @@
+"""
+Money as integer fixed-point units.
+
+Amounts are converted from the JSON floats once, at the request boundary, to
+units of four decimals (enough for unit prices and tax amounts). Sums,
+comparisons and receipt text then work on ints, so totals are exact whatever
+the number of items, and floats only reappear in JSON responses. Quantities
+are kept in thousandths and discount percentages in hundredths of a percent.
+"""
+
+SCALE = 10_000  # fixed-point amounts, 4 decimals
+QUANTITY_SCALE = 1000
+PERCENT_SCALE = 100 * 100
+
+
+def to_units(amount: float) -> int:
+    return round(amount * SCALE)
+
+
+def to_amount(units: int) -> float:
+    """JSON value of an amount in units."""
+    return units / SCALE
+
+
+def div_round(a: int, b: int) -> int:
+    """``a / b`` rounded half away from zero (``b > 0``)."""
+    q, r = divmod(abs(a), b)
+    if 2 * r >= b:
+        q += 1
+    return q if a >= 0 else -q
+
+
+def line_units(quantity: float, unit_price: int, discount: float | None, discount_amount: int | None) -> int:
+    """Expected item totalAmount in units; the money discount wins over the percentage.
+
+    ``unit_price`` and ``discount_amount`` are in units, ``discount`` in percent.
+    """
+    gross = div_round(round(quantity * QUANTITY_SCALE) * unit_price, QUANTITY_SCALE)
+    if discount_amount:
+        return gross - discount_amount
+    if discount:
+        return div_round(gross * (PERCENT_SCALE - round(discount * 100)), PERCENT_SCALE)
+    return gross
+
+
+def format_amount(units: int, decimals: int = 2) -> str:
+    """Receipt text of an amount, e.g. ``format_amount(123450) == "12.35"``."""
+    q = div_round(units, 10 ** (4 - decimals))
+    sign = "-" if q < 0 else ""
+    whole, fraction = divmod(abs(q), 10**decimals)
+    if not decimals:
+        return f"{sign}{whole}"
+    return f"{sign}{whole}.{fraction:0{decimals}d}"
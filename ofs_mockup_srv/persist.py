@@ -0,0 +1,270 @@
+"""
+Optional SQLite persistence of the journal and device state.
+
+The database runs in WAL mode and is written by a single background thread.
+Request handlers only put rows on an in-memory queue; the writer drains it
+and commits in batches of up to ``batch_size`` rows or ``interval`` seconds,
+whichever comes first. Durability modes:
+
+- ``invoice``: each invoice request waits for the (group) commit holding its
+  row, with ``synchronous=FULL``
+- ``batched``: requests do not wait; a crash loses at most the last window
+- ``none``: as ``batched`` without fsync (``synchronous=OFF``)
+
+Rows belong to an epoch: restoring a snapshot (or resetting to a baseline that
+is not a prefix of the current journal) writes a new epoch, so the read-only
+segment the server started from keeps reading its own rows.
+"""
+
+import atexit
+import json
+import queue
+import sqlite3
+import threading
+import time
+from collections.abc import Iterable
+from concurrent.futures import Future
+from typing import Any
+
+from ofs_mockup_srv.metrics import Metrics
+
+DURABILITY_MODES = ("invoice", "batched", "none")
+DEFAULT_BATCH_SIZE = 1000
+DEFAULT_INTERVAL = 0.05
+
+_SYNCHRONOUS = {"invoice": "FULL", "batched": "NORMAL", "none": "OFF"}
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS invoices (
+    epoch INTEGER NOT NULL,
+    pos INTEGER NOT NULL,
+    number TEXT NOT NULL,
+    doc BLOB NOT NULL,
+    PRIMARY KEY (epoch, pos)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS invoices_number ON invoices (epoch, number);
+CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+"""
+_STOP = ("stop",)
+
+
+def connect(path: str, durability: str = "batched") -> sqlite3.Connection:
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(f"PRAGMA synchronous={_SYNCHRONOUS[durability]}")
+    return conn
+
+
+class SQLiteSegment:
+    """Read-only journal segment backed by one epoch of the database."""
+
+    def __init__(self, path: str, epoch: int, count: int):
+        self.path = path
+        self.epoch = epoch
+        self._count = count
+        self._conn = connect(path)
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return self._count
+
+    def raw(self, pos: int) -> bytes:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT doc FROM invoices WHERE epoch = ? AND pos = ?", (self.epoch, pos)
+            ).fetchone()
+        doc: bytes = row[0]
+        return doc
+
+    def __getitem__(self, pos: int) -> dict:
+        if pos < 0:
+            pos += self._count
+        if not 0 <= pos < self._count:
+            raise IndexError(pos)
+        doc: dict = json.loads(self.raw(pos))
+        return doc
+
+    def find(self, invoice_number: str) -> int | None:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT pos FROM invoices WHERE epoch = ? AND number = ? AND pos < ?",
+                (self.epoch, invoice_number, self._count),
+            ).fetchone()
+        return None if row is None else row[0]
+
+
+class SQLiteJournal:
+    """Write-behind mirror of the journal and device state in a SQLite file."""
+
+    def __init__(
+        self,
+        path: str,
+        durability: str = "batched",
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        interval: float = DEFAULT_INTERVAL,
+        metrics: Metrics | None = None,
+    ):
+        if durability not in DURABILITY_MODES:
+            raise ValueError(f"durability must be one of {', '.join(DURABILITY_MODES)}, got {durability!r}")
+        if batch_size < 1:
+            raise ValueError(f"batch_size must be >= 1, got {batch_size}")
+        self.path = path
+        self.durability = durability
+        self.batch_size = batch_size
+        self.interval = interval
+        self.metrics = metrics
+
+        conn = connect(path, durability)
+        try:
+            conn.executescript(_SCHEMA)
+            stored = dict(conn.execute("SELECT key, value FROM state"))
+            self.epoch = int(stored.get("epoch", 0))
+            # Rows of older epochs are only kept while a segment may read them
+            conn.execute("DELETE FROM invoices WHERE epoch != ?", (self.epoch,))
+            conn.commit()
+            (self._count,) = conn.execute(
+                "SELECT COUNT(*) FROM invoices WHERE epoch = ?", (self.epoch,)
+            ).fetchone()
+        finally:
+            conn.close()
+        self._state = json.loads(stored["device"]) if "device" in stored else None
+        self._first_epoch = self.epoch
+
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._writer = threading.Thread(target=self._run, name="ofs-sqlite-writer", daemon=True)
+        self._writer.start()
+        atexit.register(self.close)
+
+    def state(self) -> dict | None:
+        """Device state saved by the previous run, None for a new database."""
+        return self._state
+
+    def segment(self) -> SQLiteSegment:
+        """The journal saved by the previous run."""
+        return SQLiteSegment(self.path, self.epoch, self._count)
+
+    def append(self, pos: int, number: str, doc: bytes, state: dict) -> Future | None:
+        """Queue an issued invoice (encoded JSON) and the device state after it.
+
+        With ``invoice`` durability, returns a future resolved once committed.
+        """
+        done: Future | None = Future() if self.durability == "invoice" else None
+        self._queue.put((self.epoch, pos, number, doc, state, done))
+        return done
+
+    def save_state(self, state: dict) -> None:
+        self._queue.put(("state", state))
+
+    def truncate(self, count: int, state: dict) -> None:
+        """Drop the records from position ``count`` on (the journal was reset)."""
+        self._queue.put(("truncate", self.epoch, count, state))
+
+    def replace(self, records: Iterable[tuple[str, bytes]], state: dict) -> None:
+        """Start a new epoch holding ``records`` (see InvoiceStore.records).
+
+        ``records`` is consumed on the writer thread.
+        """
+        self.epoch += 1
+        self._queue.put(("replace", self.epoch, records, state))
+
+    def flush(self, timeout: float | None = None) -> None:
+        """Block until everything queued so far is committed."""
+        done: Future = Future()
+        self._queue.put(("flush", done))
+        done.result(timeout)
+
+    def close(self, timeout: float | None = 5.0) -> None:
+        if not self._writer.is_alive():
+            return
+        self._queue.put(_STOP)
+        self._writer.join(timeout)
+        atexit.unregister(self.close)
+
+    def _run(self) -> None:
+        conn = connect(self.path, self.durability)
+        rows: list[tuple] = []
+        waiters: list[Future] = []
+        state: dict | None = None
+        while True:
+            item = self._queue.get()
+            deadline = time.monotonic() + self.interval
+            while True:
+                if len(item) == 6:
+                    rows.append(item[:4])
+                    state = item[4]
+                    if item[5] is not None:
+                        waiters.append(item[5])
+                elif item[0] == "state":
+                    state = item[1]
+                else:
+                    self._commit(conn, rows, state, waiters)
+                    rows, waiters, state = [], [], None
+                    if item is _STOP:
+                        conn.close()
+                        return
+                    self._control(conn, item)
+                if len(rows) >= self.batch_size:
+                    break
+                try:
+                    item = self._queue.get_nowait()
+                    continue
+                except queue.Empty:
+                    pass
+                # Per-invoice durability commits whatever has queued up meanwhile
+                timeout = deadline - time.monotonic()
+                if self.durability == "invoice" or not rows or timeout <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+            self._commit(conn, rows, state, waiters)
+            rows, waiters, state = [], [], None
+
+    def _commit(
+        self, conn: sqlite3.Connection, rows: list[tuple], state: dict | None, waiters: list[Future]
+    ) -> None:
+        if not rows and state is None and not waiters:
+            return
+        started = time.perf_counter()
+        try:
+            with conn:
+                conn.executemany("INSERT OR REPLACE INTO invoices VALUES (?, ?, ?, ?)", rows)
+                if state is not None:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO state VALUES ('device', ?)", (json.dumps(state),)
+                    )
+        except sqlite3.Error as e:
+            print(f"SQLite journal: commit of {len(rows)} invoices failed: {e}", flush=True)
+            for done in waiters:
+                done.set_exception(e)
+            return
+        if self.metrics is not None:
+            self.metrics.observe("persist.commit", time.perf_counter() - started)
+            self.metrics.incr("persist.invoices", len(rows))
+        for done in waiters:
+            done.set_result(None)
+
+    def _control(self, conn: sqlite3.Connection, item: tuple[Any, ...]) -> None:
+        op = item[0]
+        try:
+            if op == "flush":
+                item[1].set_result(None)
+            elif op == "truncate":
+                _, epoch, count, state = item
+                with conn:
+                    conn.execute("DELETE FROM invoices WHERE epoch = ? AND pos >= ?", (epoch, count))
+                    conn.execute("INSERT OR REPLACE INTO state VALUES ('device', ?)", (json.dumps(state),))
+            elif op == "replace":
+                _, epoch, records, state = item
+                with conn:
+                    conn.execute(
+                        "DELETE FROM invoices WHERE epoch NOT IN (?, ?)", (self._first_epoch, epoch)
+                    )
+                    conn.executemany(
+                        "INSERT OR REPLACE INTO invoices VALUES (?, ?, ?, ?)",
+                        ((epoch, pos, number, doc) for pos, (number, doc) in enumerate(records)),
+                    )
+                    conn.execute("INSERT OR REPLACE INTO state VALUES ('epoch', ?)", (str(epoch),))
+                    conn.execute("INSERT OR REPLACE INTO state VALUES ('device', ?)", (json.dumps(state),))
+        except sqlite3.Error as e:
+            print(f"SQLite journal: {op} failed: {e}", flush=True)
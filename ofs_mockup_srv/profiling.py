@@ -0,0 +1,192 @@
+"""
+Per-request profiling.
+
+``ProfilingMiddleware`` runs selected requests under ``cProfile`` and keeps
+the stats by request ID for /mock/profile/{id}. A request is profiled when
+profiling is armed for its path (the next N requests under a path prefix) or,
+in header mode, when it carries ``X-Profile``. While nothing is armed the
+middleware costs one attribute check per request, so it stays installed in
+production builds.
+
+cProfile sees the event loop thread only: work handed to threads (signing,
+cached payload builds) shows up as the time spent awaiting it, and other
+requests served while a profiled one awaits are counted in its profile.
+Profiled requests run one at a time, because only one profiler can be active.
+"""
+
+import asyncio
+import cProfile
+import io
+import marshal
+import pstats
+import time
+import uuid
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from ofs_mockup_srv.metrics import Metrics
+
+DEFAULT_KEEP = 100
+DEFAULT_LIMIT = 40
+PROFILE_HEADER = b"x-profile"
+REQUEST_ID_HEADER = b"x-request-id"
+# Mock controls are never profiled (/mock/events would never finish)
+EXCLUDED_PREFIX = "/mock/"
+
+
+class RequestProfile:
+    """cProfile of one request."""
+
+    __slots__ = ("request_id", "method", "path", "status", "elapsed", "profile")
+
+    def __init__(self, request_id: str, method: str, path: str):
+        self.request_id = request_id
+        self.method = method
+        self.path = path
+        self.status: int | None = None
+        self.elapsed = 0.0
+        self.profile = cProfile.Profile()
+
+    def describe(self) -> dict:
+        return {
+            "id": self.request_id,
+            "method": self.method,
+            "path": self.path,
+            "status": self.status,
+            "ms": round(self.elapsed * 1000, 3),
+        }
+
+    def report(self, sort: str = "cumulative", limit: int = DEFAULT_LIMIT) -> str:
+        """pstats text report, ``limit`` functions by ``sort``."""
+        out = io.StringIO()
+        pstats.Stats(self.profile, stream=out).sort_stats(sort).print_stats(limit)
+        return out.getvalue()
+
+    def dump(self) -> bytes:
+        """Stats in the ``pstats``/``snakeviz`` file format (``Profile.dump_stats``)."""
+        self.profile.create_stats()
+        return marshal.dumps(self.profile.stats)
+
+
+class Profiles:
+    """Profiling switches and the last ``keep`` request profiles."""
+
+    def __init__(self, keep: int = DEFAULT_KEEP, header: bool = False, metrics: Metrics | None = None):
+        self.header = header
+        self.path: str | None = None
+        self.remaining = 0
+        self.metrics = metrics
+        self.keep = keep
+        self._profiles: OrderedDict[str, RequestProfile] = OrderedDict()
+        self._lock = asyncio.Lock()
+        self.active = header
+
+    def arm(self, path: str = "/api/", count: int = 1) -> None:
+        """Profile the next ``count`` requests whose path starts with ``path``."""
+        if not isinstance(path, str):
+            raise TypeError(f"path must be a string, got {path!r}")
+        if count < 0:
+            raise ValueError(f"count must be >= 0, got {count}")
+        self.path = path
+        self.remaining = count
+        self._update()
+
+    def set_header(self, enabled: bool) -> None:
+        self.header = enabled
+        self._update()
+
+    def clear(self) -> None:
+        """Disarm, leave header mode and drop the stored profiles."""
+        self.header = False
+        self.path = None
+        self.remaining = 0
+        self._profiles.clear()
+        self._update()
+
+    def get(self, request_id: str) -> RequestProfile | None:
+        return self._profiles.get(request_id)
+
+    def describe(self) -> dict:
+        return {
+            "header": self.header,
+            "path": self.path,
+            "remaining": self.remaining,
+            "profiles": [p.describe() for p in self._profiles.values()],
+        }
+
+    def select(self, scope: Scope) -> str | None:
+        """Request ID to profile ``scope`` under, None to serve it unprofiled."""
+        path = scope["path"]
+        if path.startswith(EXCLUDED_PREFIX):
+            return None
+        flagged = False
+        request_id = None
+        for key, value in scope["headers"]:
+            if key == PROFILE_HEADER:
+                flagged = True
+            elif key == REQUEST_ID_HEADER:
+                request_id = value.decode("latin-1")
+        if not (self.header and flagged):
+            if not self.remaining or self.path is None or not path.startswith(self.path):
+                return None
+            self.remaining -= 1
+            self._update()
+        return request_id or uuid.uuid4().hex
+
+    async def run(
+        self, request_id: str, scope: Scope, call: Callable[[Callable[[int], None]], Awaitable[None]]
+    ) -> None:
+        """Await ``call(send_status)`` under the profiler and keep the result."""
+        entry = RequestProfile(request_id, scope["method"], scope["path"])
+
+        def send_status(status: int) -> None:
+            entry.status = status
+
+        async with self._lock:
+            started = time.perf_counter()
+            entry.profile.enable()
+            try:
+                await call(send_status)
+            finally:
+                entry.profile.disable()
+                entry.elapsed = time.perf_counter() - started
+                self._profiles[request_id] = entry
+                self._profiles.move_to_end(request_id)
+                while len(self._profiles) > self.keep:
+                    self._profiles.popitem(last=False)
+                if self.metrics is not None:
+                    self.metrics.incr("profile.requests")
+
+    def _update(self) -> None:
+        self.active = self.header or self.remaining > 0
+
+
+class ProfilingMiddleware:
+    """ASGI middleware profiling the requests ``profiles`` selects."""
+
+    def __init__(self, app: ASGIApp, profiles: Profiles):
+        self.app = app
+        self.profiles = profiles
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if not self.profiles.active or scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        request_id = self.profiles.select(scope)
+        if request_id is None:
+            return await self.app(scope, receive, send)
+
+        async def call(send_status: Callable[[int], None]) -> None:
+            async def send_with_id(message: Message) -> None:
+                if message["type"] == "http.response.start":
+                    send_status(message["status"])
+                    message["headers"] = [
+                        *message.get("headers", ()),
+                        (REQUEST_ID_HEADER, request_id.encode("latin-1")),
+                    ]
+                await send(message)
+
+            await self.app(scope, receive, send_with_id)
+
+        await self.profiles.run(request_id, scope, call)
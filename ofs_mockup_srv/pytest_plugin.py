@@ -0,0 +1,137 @@
+"""
+pytest plugin for running integration suites against the OFS mockup server.
+
+Installed packages register it automatically (``pytest11`` entry point). The
+server runs in-process instead of as a ``start-ofs-server`` subprocess:
+
+- ``ofs_server``: session-wide uvicorn server on an ephemeral localhost port,
+  started in a background thread; state is reset before each test
+- ``ofs_client``: in-process ASGI client (no sockets) with the API key set,
+  state is reset before each test
+
+Resets go back to the "clean" baseline in constant time (see /mock/reset).
+
+Example::
+
+    def test_attention(ofs_server):
+        r = httpx.get(ofs_server.url + "/api/attention", headers=ofs_server.headers)
+        assert r.status_code == 200
+
+    def test_invoice(ofs_client):
+        assert ofs_client.post("/mock/lock").json()["current_api_attention"] == 404
+
+Settings (``pytest.ini``/``pyproject.toml``):
+
+- ``ofs_mockup_available``: start each test with the service available (default: true)
+"""
+
+import threading
+import time
+from collections.abc import Iterator
+from typing import TYPE_CHECKING
+
+import pytest
+
+if TYPE_CHECKING:
+    from fastapi.testclient import TestClient
+
+STARTUP_TIMEOUT = 10.0
+
+
+class OFSServer:
+    """Handle for a mock server running in a background thread."""
+
+    def __init__(self, available: bool = True):
+        import uvicorn
+
+        from ofs_mockup_srv.main import app
+
+        self.app = app
+        self.available = available
+        config = uvicorn.Config(
+            app,
+            host="127.0.0.1",
+            port=0,
+            log_level="warning",
+            access_log=False,
+            lifespan="off",
+        )
+        self._server = uvicorn.Server(config)
+        self._thread = threading.Thread(
+            target=self._server.run, name="ofs-mockup-server", daemon=True
+        )
+        self.url: str | None = None
+
+    @property
+    def api_key(self) -> str:
+        key: str = self.app.state.api_key
+        return key
+
+    @property
+    def pin(self) -> str:
+        pin: str = self.app.state.pin
+        return pin
+
+    @property
+    def headers(self) -> dict:
+        return {"Authorization": f"Bearer {self.api_key}"}
+
+    def start(self) -> "OFSServer":
+        self._thread.start()
+        deadline = time.monotonic() + STARTUP_TIMEOUT
+        while not self._server.started:
+            if not self._thread.is_alive() or time.monotonic() > deadline:
+                raise RuntimeError("OFS mockup server failed to start")
+            time.sleep(0.001)
+        host, port = self._server.servers[0].sockets[0].getsockname()[:2]
+        self.url = f"http://{host}:{port}"
+        return self
+
+    def stop(self) -> None:
+        self._server.should_exit = True
+        self._thread.join(STARTUP_TIMEOUT)
+
+    def reset(self) -> None:
+        """Restore the startup device state between tests."""
+        from ofs_mockup_srv.main import reset_state
+
+        reset_state()
+        self.app.state.current_api_attention = 200 if self.available else 404
+
+
+def pytest_addoption(parser: pytest.Parser) -> None:
+    parser.addini(
+        "ofs_mockup_available",
+        type="bool",
+        default=True,
+        help="Start each test with the OFS mockup service available",
+    )
+
+
+@pytest.fixture(scope="session")
+def _ofs_server_session(pytestconfig: pytest.Config) -> Iterator[OFSServer]:
+    server = OFSServer(available=pytestconfig.getini("ofs_mockup_available")).start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def ofs_server(_ofs_server_session: OFSServer) -> OFSServer:
+    """Session-wide OFS mockup server reachable over HTTP, reset for this test."""
+    _ofs_server_session.reset()
+    return _ofs_server_session
+
+
+@pytest.fixture
+def ofs_client(pytestconfig: pytest.Config) -> Iterator["TestClient"]:
+    """In-process ASGI client for the OFS mockup app, reset for this test."""
+    from fastapi.testclient import TestClient
+
+    from ofs_mockup_srv.main import app, reset_state
+
+    reset_state()
+    app.state.current_api_attention = (
+        200 if pytestconfig.getini("ofs_mockup_available") else 404
+    )
+    with TestClient(app, headers={"Authorization": f"Bearer {app.state.api_key}"}) as client:
+        yield client
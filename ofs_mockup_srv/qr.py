@@ -0,0 +1,372 @@
+"""
+QR Code (ISO/IEC 18004) encoder and GIF writer for the verification code.
+
+Pure Python, byte mode only (the verification URL is ASCII). The smallest
+version that fits is chosen, Reed-Solomon codewords are added and the mask
+with the lowest penalty is applied. Everything that depends only on the
+version (function patterns, module order, mask patterns) is built once per
+version, and the whole symbol is kept in one int, so masking and scoring are
+a few hundred bit operations rather than a loop over modules. ``gif_base64`` renders it like the device does: a GIF,
+black on white, 4 pixels per module, no quiet zone.
+"""
+
+import base64
+import functools
+from collections.abc import Callable
+
+ECC_LEVELS = ("L", "M", "Q", "H")
+_ECC_FORMAT = {"L": 1, "M": 0, "Q": 3, "H": 2}
+
+# Indexed by version (1..40)
+ECC_CODEWORDS_PER_BLOCK = {
+    "L": (0, 7, 10, 15, 20, 26, 18, 20, 24, 30, 18, 20, 24, 26, 30, 22, 24, 28, 30, 28, 28,
+          28, 28, 30, 30, 26, 28, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30),
+    "M": (0, 10, 16, 26, 18, 24, 16, 18, 22, 22, 26, 30, 22, 22, 24, 24, 28, 28, 26, 26, 26,
+          26, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28),
+    "Q": (0, 13, 22, 18, 26, 18, 24, 18, 22, 20, 24, 28, 26, 24, 20, 30, 24, 28, 28, 26, 30,
+          28, 30, 30, 30, 30, 28, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30),
+    "H": (0, 17, 28, 22, 16, 22, 28, 26, 26, 24, 28, 24, 28, 22, 24, 24, 30, 28, 28, 26, 28,
+          30, 24, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30),
+}
+ERROR_CORRECTION_BLOCKS = {
+    "L": (0, 1, 1, 1, 1, 1, 2, 2, 2, 2, 4, 4, 4, 4, 4, 6, 6, 6, 6, 7, 8,
+          8, 9, 9, 10, 12, 12, 12, 13, 14, 15, 16, 17, 18, 19, 19, 20, 21, 22, 24, 25),
+    "M": (0, 1, 1, 1, 2, 2, 4, 4, 4, 5, 5, 5, 8, 9, 9, 10, 10, 11, 13, 14, 16,
+          17, 17, 18, 20, 21, 23, 25, 26, 28, 29, 31, 33, 35, 37, 38, 40, 43, 45, 47, 49),
+    "Q": (0, 1, 1, 2, 2, 4, 4, 6, 6, 8, 8, 8, 10, 12, 16, 12, 17, 16, 18, 21, 20,
+          23, 23, 25, 27, 29, 34, 34, 35, 38, 40, 43, 45, 48, 51, 53, 56, 59, 62, 65, 68),
+    "H": (0, 1, 1, 2, 4, 4, 4, 5, 6, 8, 8, 11, 11, 16, 16, 18, 16, 19, 21, 25, 25,
+          25, 34, 30, 32, 35, 37, 40, 42, 45, 48, 51, 54, 57, 60, 63, 66, 70, 74, 77, 81),
+}
+
+# Mask conditions on (column, row)
+_MASKS = (
+    lambda x, y: (x + y) % 2 == 0,
+    lambda x, y: y % 2 == 0,
+    lambda x, y: x % 3 == 0,
+    lambda x, y: (x + y) % 3 == 0,
+    lambda x, y: (x // 3 + y // 2) % 2 == 0,
+    lambda x, y: x * y % 2 + x * y % 3 == 0,
+    lambda x, y: (x * y % 2 + x * y % 3) % 2 == 0,
+    lambda x, y: ((x + y) % 2 + x * y % 3) % 2 == 0,
+)
+
+# GF(256) with the QR polynomial x^8 + x^4 + x^3 + x^2 + 1
+_EXP = [0] * 512
+_LOG = [0] * 256
+_value = 1
+for _i in range(255):
+    _EXP[_i] = _EXP[_i + 255] = _value
+    _LOG[_value] = _i
+    _value <<= 1
+    if _value & 0x100:
+        _value ^= 0x11D
+del _i, _value
+
+
+def raw_codewords(version: int) -> int:
+    """Codewords (data and error correction) a symbol of ``version`` holds."""
+    modules = (16 * version + 128) * version + 64
+    if version >= 2:
+        alignment = version // 7 + 2
+        modules -= (25 * alignment - 10) * alignment - 55
+        if version >= 7:
+            modules -= 36
+    return modules // 8
+
+
+def data_codewords(version: int, ecc: str) -> int:
+    return raw_codewords(version) - ECC_CODEWORDS_PER_BLOCK[ecc][version] * ERROR_CORRECTION_BLOCKS[ecc][version]
+
+
+def capacity(version: int, ecc: str) -> int:
+    """Bytes of byte-mode data a symbol holds."""
+    return (data_codewords(version, ecc) * 8 - 4 - (8 if version < 10 else 16)) // 8
+
+
+def fit_version(length: int, ecc: str) -> int:
+    for version in range(1, 41):
+        if length <= capacity(version, ecc):
+            return version
+    raise ValueError(f"{length} bytes do not fit in a QR code at level {ecc}")
+
+
+@functools.lru_cache(maxsize=None)
+def _divisor(degree: int) -> tuple:
+    """Reed-Solomon generator polynomial times each byte value, as ``degree``-byte ints."""
+    poly = [1]
+    for i in range(degree):
+        poly = [a ^ (_EXP[_LOG[b] + i] if b else 0) for a, b in zip(poly + [0], [0] + poly)]
+    logs = [_LOG[c] for c in poly[1:]]
+    return (0,) + tuple(
+        int.from_bytes(bytes(_EXP[_LOG[factor] + g] for g in logs), "big") for factor in range(1, 256)
+    )
+
+
+def _remainder(data: bytes, degree: int) -> bytes:
+    divisor = _divisor(degree)
+    top = 8 * (degree - 1)
+    low = (1 << top) - 1
+    remainder = 0
+    for byte in data:
+        remainder = (remainder & low) << 8 ^ divisor[byte ^ remainder >> top]
+    return remainder.to_bytes(degree, "big")
+
+
+def _codewords(data: bytes, version: int, ecc: str) -> bytes:
+    """Byte-mode data codewords plus error correction, interleaved."""
+    count = data_codewords(version, ecc)
+    count_bits = 8 if version < 10 else 16
+    value = (0b0100 << count_bits | len(data)) << 8 * len(data) | int.from_bytes(data, "big")
+    bits = 4 + count_bits + 8 * len(data)
+    pad = min(4, count * 8 - bits)  # terminator
+    pad += -(bits + pad) % 8
+    head = (value << pad).to_bytes((bits + pad) // 8, "big")
+    padding = b"\xec\x11" * ((count - len(head)) // 2 + 1)
+    codewords = head + padding[: count - len(head)]
+
+    blocks = ERROR_CORRECTION_BLOCKS[ecc][version]
+    degree = ECC_CODEWORDS_PER_BLOCK[ecc][version]
+    raw = raw_codewords(version)
+    short_blocks = blocks - raw % blocks
+    short_length = raw // blocks - degree  # data codewords in a short block
+    data_blocks, ecc_blocks = [], []
+    start = 0
+    for i in range(blocks):
+        end = start + short_length + (i >= short_blocks)
+        block = codewords[start:end]
+        data_blocks.append(block)
+        ecc_blocks.append(_remainder(block, degree))
+        start = end
+    out = bytearray()
+    for i in range(short_length + 1):
+        out.extend(block[i] for block in data_blocks if i < len(block))
+    for i in range(degree):
+        out.extend(block[i] for block in ecc_blocks)
+    return bytes(out)
+
+
+def _alignment_positions(version: int) -> list:
+    if version == 1:
+        return []
+    count = version // 7 + 2
+    step = (version * 8 + count * 3 + 5) // (count * 4 - 4) * 2
+    size = version * 4 + 17
+    return [6] + [size - 7 - i * step for i in range(count - 2, -1, -1)]
+
+
+def _format_cells(size: int) -> list[tuple[tuple[int, int], tuple[int, int]]]:
+    """(x, y) of format bit ``i`` in both copies."""
+    first = [(8, i) for i in range(6)] + [(8, 7), (8, 8), (7, 8)] + [(14 - i, 8) for i in range(9, 15)]
+    second = [(size - 1 - i, 8) for i in range(8)] + [(8, size - 15 + i) for i in range(8, 15)]
+    return list(zip(first, second))
+
+
+def _format_bits(ecc: str, mask: int) -> int:
+    data = _ECC_FORMAT[ecc] << 3 | mask
+    rem = data
+    for _ in range(10):
+        rem = (rem << 1) ^ ((rem >> 9) * 0x537)
+    return (data << 10 | rem) ^ 0x5412
+
+
+@functools.lru_cache(maxsize=None)
+def _layout(version: int) -> tuple:
+    """Per-version template, as big ints holding the whole symbol.
+
+    Module (x, y) is bit ``(y + 4) * width + 4 + size - 1 - x``: rows are
+    ``width = size + 8`` bits apart, with 4 light modules around the symbol,
+    so runs and finder-like patterns of all rows (or, shifting by ``width``,
+    all columns) are found with a few whole-symbol bit operations.
+    """
+    size = version * 4 + 17
+    width = size + 8
+    dark = [bytearray(size) for _ in range(size)]
+    reserved = [bytearray(size) for _ in range(size)]
+
+    def put(x: int, y: int, on: int) -> None:
+        dark[y][x] = on
+        reserved[y][x] = 1
+
+    for i in range(size):  # timing
+        put(6, i, i % 2 == 0)
+        put(i, 6, i % 2 == 0)
+    for cx, cy in ((3, 3), (size - 4, 3), (3, size - 4)):  # finders with separators
+        for dy in range(-4, 5):
+            for dx in range(-4, 5):
+                x, y = cx + dx, cy + dy
+                if 0 <= x < size and 0 <= y < size:
+                    put(x, y, max(abs(dx), abs(dy)) not in (2, 4))
+    positions = _alignment_positions(version)
+    last = len(positions) - 1
+    for i, cx in enumerate(positions):
+        for j, cy in enumerate(positions):
+            if (i, j) in ((0, 0), (0, last), (last, 0)):
+                continue
+            for dy in range(-2, 3):
+                for dx in range(-2, 3):
+                    put(cx + dx, cy + dy, max(abs(dx), abs(dy)) != 1)
+    cells = _format_cells(size)
+    for first, second in cells:
+        put(*first, 0)
+        put(*second, 0)
+    put(8, size - 8, 1)
+    if version >= 7:
+        rem = version
+        for _ in range(12):
+            rem = (rem << 1) ^ ((rem >> 11) * 0x1F25)
+        bits = version << 12 | rem
+        for i in range(18):
+            a, b = size - 11 + i % 3, i // 3
+            put(a, b, bits >> i & 1)
+            put(b, a, bits >> i & 1)
+
+    def bit(x: int, y: int) -> int:
+        return (y + 4) * width + 4 + size - 1 - x
+
+    def pack(test: Callable[..., object]) -> int:
+        grid = bytearray(b"0") * (width * width)
+        for y in range(size):
+            for x in range(size):
+                if test(x, y):
+                    grid[bit(x, y)] = 49  # "1"
+        return int(grid[::-1], 2)
+
+    # Data modules in placement order: two-column strips from the right, zigzagging
+    order = []
+    right = size - 1
+    while right >= 1:
+        if right == 6:
+            right = 5
+        upward = (right + 1) & 2 == 0
+        for vert in range(size):
+            y = size - 1 - vert if upward else vert
+            for x in (right, right - 1):
+                if not reserved[y][x]:
+                    order.append(bit(x, y))
+        right -= 2
+
+    template = pack(lambda x, y: dark[y][x])
+    masks = tuple(
+        pack(lambda x, y, condition=condition: not reserved[y][x] and condition(x, y))
+        for condition in _MASKS
+    )
+    format_bits = tuple(tuple(bit(x, y) for x, y in pair) for pair in cells)
+    symbol = pack(lambda x, y: True)
+    return size, width, template, order, masks, format_bits, symbol
+
+
+_FINDER_LIKE = ((1, 0, 1, 1, 1, 0, 1, 0, 0, 0, 0), (0, 0, 0, 0, 1, 0, 1, 1, 1, 0, 1))
+
+
+def _penalty(dark: int, size: int, width: int, symbol: int) -> int:
+    """ISO/IEC 18004 mask penalty; ``symbol`` has the bits of all modules set."""
+    light = ~dark & symbol
+    outside = ~dark & ((1 << width * width) - 1)  # light, quiet zone included
+    score = 0
+    for step in (1, width):  # rows, then columns
+        for cells in (dark, light):
+            # Runs of 5 + n modules: 3 + n points
+            five = cells & cells >> step & cells >> 2 * step & cells >> 3 * step & cells >> 4 * step
+            score += five.bit_count() + 2 * (five & ~(five << step)).bit_count()
+        for pattern in _FINDER_LIKE:
+            found = -1
+            for k, on in enumerate(pattern):
+                found &= (dark if on else outside) >> k * step
+            score += 40 * found.bit_count()
+    for cells in (dark, light):
+        score += 3 * (cells & cells >> 1 & cells >> width & cells >> width + 1).bit_count()
+    score += 10 * (abs(dark.bit_count() * 100 // (size * size) - 50) // 5)
+    return score
+
+
+def encode(data: bytes, ecc: str = "L", mask: int | None = None) -> list:
+    """QR symbol of ``data`` as rows of ints (bit ``size - 1 - x`` is column ``x``, 1 is dark)."""
+    version = fit_version(len(data), ecc)
+    codewords = _codewords(data, version, ecc)
+    size, width, template, order, masks, format_bits, symbol = _layout(version)
+    grid = bytearray(b"0") * (width * width)
+    stream = format(int.from_bytes(codewords, "big"), f"0{len(codewords) * 8}b").encode("ascii")
+    for position, value in zip(order, stream):
+        grid[position] = value
+    unmasked = template | int(grid[::-1], 2)
+
+    best_score, best = -1, 0
+    for candidate in range(8) if mask is None else (mask,):
+        masked = unmasked ^ masks[candidate]
+        bits = _format_bits(ecc, candidate)
+        for i, positions in enumerate(format_bits):
+            if bits >> i & 1:
+                for position in positions:
+                    masked |= 1 << position
+        score = 0 if mask is not None else _penalty(masked, size, width, symbol)
+        if best_score < 0 or score < best_score:
+            best_score, best = score, masked
+    row = (1 << size) - 1
+    return [best >> (y + 4) * width + 4 & row for y in range(size)]
+
+
+def _lzw(pixels: bytes) -> bytes:
+    """GIF LZW of 1-bit pixels (minimum code size 2), packed into sub-blocks."""
+    clear, end = 4, 5
+    width, next_code = 3, 6
+    children = [0] * 8192
+    out = bytearray()
+    acc, nacc = clear, width
+    it = iter(pixels)
+    w = next(it)
+    for p in it:
+        key = w << 1 | p
+        code = children[key]
+        if code:
+            w = code
+            continue
+        acc |= w << nacc
+        nacc += width
+        if nacc >= 32:
+            out += (acc & 0xFFFFFFFF).to_bytes(4, "little")
+            acc >>= 32
+            nacc -= 32
+        children[key] = next_code
+        next_code += 1
+        if next_code > 1 << width and width < 12:
+            width += 1
+        if next_code == 4096:
+            acc |= clear << nacc
+            nacc += width
+            children = [0] * 8192
+            width, next_code = 3, 6
+        w = p
+    for code in (w, end):
+        acc |= code << nacc
+        nacc += width
+    out += acc.to_bytes((nacc + 7) // 8, "little")
+    blocks = bytearray()
+    for i in range(0, len(out), 255):
+        chunk = out[i : i + 255]
+        blocks.append(len(chunk))
+        blocks += chunk
+    return bytes(blocks) + b"\x00"
+
+
+def gif(rows: list, scale: int = 4, border: int = 0) -> bytes:
+    """Black on white GIF of a QR symbol."""
+    size = len(rows)
+    pixels = {ord("0"): "\x00" * scale, ord("1"): "\x01" * scale}
+    quiet = "0" * border
+    lines = [quiet + format(row, f"0{size}b") + quiet for row in rows]
+    blank = "0" * (size + 2 * border)
+    lines = [blank] * border + lines + [blank] * border
+    data = b"".join(line.translate(pixels).encode("latin-1") * scale for line in lines)
+    side = ((size + 2 * border) * scale).to_bytes(2, "little")
+    return (
+        b"GIF89a" + side + side + b"\x80\x00\x00"
+        + b"\xff\xff\xff\x00\x00\x00"  # white, black
+        + b"\x2c\x00\x00\x00\x00" + side + side + b"\x00"
+        + b"\x02" + _lzw(data) + b"\x3b"
+    )
+
+
+def gif_base64(text: str, ecc: str = "L", scale: int = 4) -> str:
+    """``verificationQRCode`` value for ``text`` (runs in the encoder pool)."""
+    return base64.b64encode(gif(encode(text.encode("utf-8"), ecc), scale)).decode("ascii")
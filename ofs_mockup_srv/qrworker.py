@@ -0,0 +1,17 @@
+"""
+Start-up module of the QR encoding processes (see verification.QRCodes).
+
+The fork server preloads this module instead of the server's ``__main__``, and
+every worker is forked from it. multiprocessing still imports the server's
+entry script in each worker before it runs a task, and that script imports
+ofs_mockup_srv.main. ``QR_WORKER_ENV``, set here and inherited by the workers,
+tells main.py to skip building the device state on that import. Otherwise a
+worker would open the ``--db`` journal or redo ``--restore``/``--generate``.
+The server never imports this module.
+"""
+
+import os
+
+from ofs_mockup_srv.verification import QR_WORKER_ENV
+
+os.environ[QR_WORKER_ENV] = "1"
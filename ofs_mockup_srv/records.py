@@ -0,0 +1,180 @@
+"""
+Lightweight internal invoice records.
+
+The pydantic models in main.py describe the HTTP API. Internally an invoice is
+converted once into these slotted records (money in units, see money.py), and
+validation, receipt text, category totals and the journal columns work on
+them. ``request_dict`` converts back at the JSON boundary.
+"""
+
+from typing import Any
+
+from ofs_mockup_srv.money import to_amount, to_units
+
+
+class Payment:
+    __slots__ = ("payment_type", "amount")
+
+    def __init__(self, payment_type: str, amount: int):
+        self.payment_type = payment_type
+        self.amount = amount  # units
+
+
+class Item:
+    __slots__ = (
+        "name",
+        "gtin",
+        "labels",
+        "quantity",
+        "unit_price",
+        "total",
+        "discount",
+        "discount_amount",
+    )
+
+    def __init__(
+        self,
+        name: str,
+        gtin: str | None,
+        labels: list[str],
+        quantity: float,
+        unit_price: int,
+        total: int,
+        discount: float | None = None,
+        discount_amount: int | None = None,
+    ):
+        self.name = name
+        self.gtin = gtin
+        self.labels = labels
+        self.quantity = quantity
+        self.unit_price = unit_price  # units
+        self.total = total  # units
+        self.discount = discount  # percent
+        self.discount_amount = discount_amount  # units or None
+
+
+class Invoice:
+    """An invoice request, plus its number, time and total once issued."""
+
+    __slots__ = (
+        "invoice_type",
+        "transaction_type",
+        "cashier",
+        "buyer_id",
+        "referent_number",
+        "referent_dt",
+        "items",
+        "payments",
+        "number",
+        "sdc_date_time",
+        "total",
+    )
+
+    def __init__(
+        self,
+        invoice_type: str,
+        transaction_type: str,
+        cashier: str,
+        buyer_id: str | None,
+        referent_number: str | None,
+        referent_dt: str | None,
+        items: list[Item],
+        payments: list[Payment],
+        number: str | None = None,
+        sdc_date_time: str | None = None,
+        total: int | None = None,
+    ):
+        self.invoice_type = invoice_type
+        self.transaction_type = transaction_type
+        self.cashier = cashier
+        self.buyer_id = buyer_id
+        self.referent_number = referent_number
+        self.referent_dt = referent_dt
+        self.items = items
+        self.payments = payments
+        self.number = number
+        self.sdc_date_time = sdc_date_time
+        self.total = total  # units
+
+    @classmethod
+    def from_request(cls, request: Any) -> "Invoice":
+        """Record of a validated ``InvoiceRequest`` model."""
+        return cls(
+            request.invoiceType,
+            request.transactionType,
+            request.cashier,
+            request.buyerId,
+            request.referentDocumentNumber,
+            request.referentDocumentDT,
+            [
+                Item(
+                    item.name,
+                    item.gtin,
+                    item.labels,
+                    item.quantity,
+                    to_units(item.unitPrice),
+                    to_units(item.totalAmount),
+                    item.discount,
+                    None if item.discountAmount is None else to_units(item.discountAmount),
+                )
+                for item in request.items
+            ],
+            [Payment(p.paymentType, to_units(p.amount)) for p in request.payment],
+        )
+
+    @classmethod
+    def from_doc(cls, doc: dict) -> "Invoice":
+        """Record of a journal document ({"invoiceRequest", "invoiceResponse"})."""
+        request, response = doc["invoiceRequest"], doc["invoiceResponse"]
+        return cls(
+            request["invoiceType"],
+            request["transactionType"],
+            request.get("cashier"),
+            request.get("buyerId"),
+            request.get("referentDocumentNumber"),
+            request.get("referentDocumentDT"),
+            [
+                Item(
+                    item["name"],
+                    item.get("gtin"),
+                    item.get("labels") or [],
+                    item["quantity"],
+                    to_units(item["unitPrice"]),
+                    to_units(item["totalAmount"]),
+                    item.get("discount"),
+                    None if item.get("discountAmount") is None else to_units(item["discountAmount"]),
+                )
+                for item in request.get("items") or ()
+            ],
+            [Payment(p["paymentType"], to_units(p["amount"])) for p in request["payment"]],
+            response["invoiceNumber"],
+            response["sdcDateTime"],
+            to_units(response["totalAmount"]),
+        )
+
+    def request_dict(self) -> dict:
+        """The ``invoiceRequest`` JSON object (same fields as the API model)."""
+        return {
+            "referentDocumentNumber": self.referent_number,
+            "referentDocumentDT": self.referent_dt,
+            "invoiceType": self.invoice_type,
+            "transactionType": self.transaction_type,
+            "payment": [
+                {"amount": to_amount(p.amount), "paymentType": p.payment_type} for p in self.payments
+            ],
+            "items": [
+                {
+                    "name": item.name,
+                    "gtin": item.gtin,
+                    "labels": item.labels,
+                    "totalAmount": to_amount(item.total),
+                    "unitPrice": to_amount(item.unit_price),
+                    "quantity": item.quantity,
+                    "discount": item.discount,
+                    "discountAmount": None if item.discount_amount is None else to_amount(item.discount_amount),
+                }
+                for item in self.items
+            ],
+            "cashier": self.cashier,
+            "buyerId": self.buyer_id,
+        }
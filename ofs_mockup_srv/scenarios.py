@@ -0,0 +1,186 @@
+"""
+Scriptable fault and state-transition scenarios.
+
+A scenario is a list of rules, each bound to an event ("invoice", "pin" or
+"attention") and fired by a trigger:
+
+- ``at``: on exactly the N-th event (e.g. lock after the 500th invoice)
+- ``after``: on every event past the N-th
+- ``every``: on every N-th event (e.g. out of paper on every 1000th invoice)
+- ``for_seconds``: on every event during the first S seconds after loading
+  (device clock seconds, so a clock moved forward ends the window)
+- no trigger: on every event
+
+Example::
+
+    {"rules": [
+        {"on": "invoice", "at": 500, "action": "lock"},
+        {"on": "invoice", "every": 1000, "action": "error",
+         "message": "Out of paper", "statusCode": -10},
+        {"on": "pin", "for_seconds": 30, "action": "fail"}
+    ]}
+
+Rules are compiled once when the scenario is loaded. Evaluating an event only
+increments a counter and checks the compiled rules for that event, so the cost
+per request does not grow with the number of requests served.
+"""
+
+import json
+import time
+from collections.abc import Callable
+
+EVENTS = ("invoice", "pin", "attention")
+
+ACTIONS = {
+    "invoice": ("error", "lock", "delay"),
+    "pin": ("fail", "lock"),
+    "attention": ("unavailable",),
+}
+
+
+class ScenarioError(ValueError):
+    """Raised when a scenario specification is invalid."""
+
+
+class Rule:
+    __slots__ = (
+        "event",
+        "action",
+        "at",
+        "after",
+        "every",
+        "for_seconds",
+        "error",
+        "delay",
+    )
+
+    def __init__(self, spec: dict):
+        if not isinstance(spec, dict):
+            raise ScenarioError(f"rule must be an object, got {spec!r}")
+
+        self.event = spec.get("on", "invoice")
+        if self.event not in EVENTS:
+            raise ScenarioError(f"unknown event {self.event!r}, expected one of {EVENTS}")
+
+        self.action = spec.get("action")
+        if self.action not in ACTIONS[self.event]:
+            raise ScenarioError(
+                f"unknown action {self.action!r} for event {self.event!r}, "
+                f"expected one of {ACTIONS[self.event]}"
+            )
+
+        self.at = _positive_int(spec, "at")
+        self.after = _positive_int(spec, "after", minimum=0)
+        self.every = _positive_int(spec, "every")
+        self.for_seconds = spec.get("for_seconds")
+        if self.for_seconds is not None:
+            try:
+                self.for_seconds = float(self.for_seconds)
+            except (TypeError, ValueError):
+                raise ScenarioError(f"for_seconds must be a number, got {spec['for_seconds']!r}")
+
+        # Pre-build the error payload so firing the rule does no formatting
+        self.error = None
+        if self.action == "error":
+            try:
+                status_code = int(spec.get("statusCode", -1))
+            except (TypeError, ValueError):
+                raise ScenarioError(f"statusCode must be an integer, got {spec['statusCode']!r}")
+            self.error = {
+                "details": spec.get("details"),
+                "message": str(spec.get("message", "Simulated error")),
+                "statusCode": status_code,
+            }
+
+        self.delay = 0.0
+        if self.action == "delay":
+            try:
+                self.delay = float(spec.get("ms", 0)) / 1000.0
+            except (TypeError, ValueError):
+                raise ScenarioError(f"ms must be a number, got {spec['ms']!r}")
+
+    def matches(self, count: int, elapsed: float) -> bool:
+        if self.at is not None and count != self.at:
+            return False
+        if self.after is not None and count <= self.after:
+            return False
+        if self.every is not None and count % self.every:
+            return False
+        if self.for_seconds is not None and elapsed >= self.for_seconds:
+            return False
+        return True
+
+
+def _positive_int(spec: dict, key: str, minimum: int = 1) -> int | None:
+    value = spec.get(key)
+    if value is None:
+        return None
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        raise ScenarioError(f"{key} must be an integer, got {spec[key]!r}")
+    if value < minimum:
+        raise ScenarioError(f"{key} must be >= {minimum}, got {value}")
+    return value
+
+
+class Scenario:
+    """Compiled set of rules plus the per-event counters they are evaluated on."""
+
+    def __init__(self, spec: dict | None = None, clock: Callable[[], float] = time.monotonic):
+        spec = spec or {"rules": []}
+        if not isinstance(spec, dict) or not isinstance(spec.get("rules", []), list):
+            raise ScenarioError("scenario must be an object with a 'rules' list")
+        self.spec = spec
+        rules = [Rule(r) for r in spec.get("rules", [])]
+        self.rules = {event: tuple(r for r in rules if r.event == event) for event in EVENTS}
+        self.counts = dict.fromkeys(EVENTS, 0)
+        self._clock = clock
+        self.started = clock()
+
+    def fire(self, event: str) -> tuple[Rule, ...]:
+        """Count one occurrence of ``event`` and return the rules it triggers."""
+        count = self.counts[event] + 1
+        self.counts[event] = count
+        rules = self.rules[event]
+        if not rules:
+            return ()
+        elapsed = self._clock() - self.started
+        return tuple(r for r in rules if r.matches(count, elapsed))
+
+    def describe(self) -> dict:
+        return {
+            "rules": self.spec.get("rules", []),
+            "counts": dict(self.counts),
+            "elapsed": round(self._clock() - self.started, 3),
+        }
+
+
+def parse_invoice_error(value: str | None) -> dict | None:
+    """Turn the legacy ``message:errorCode`` string into an always-on error rule."""
+    if not value:
+        return None
+    parts = value.split(":", 1)
+    if len(parts) != 2:
+        return None
+    try:
+        status_code = int(parts[1])
+    except ValueError:
+        return None
+    return {"on": "invoice", "action": "error", "message": parts[0], "statusCode": status_code}
+
+
+def load_scenario(
+    path: str | None = None, invoice_error: str | None = None, clock: Callable[[], float] = time.monotonic
+) -> Scenario:
+    """Build a scenario from a JSON file and/or the legacy invoice error string."""
+    spec: dict = {"rules": []}
+    if path:
+        with open(path, "r", encoding="utf-8") as f:
+            spec = json.load(f)
+        if isinstance(spec, list):
+            spec = {"rules": spec}
+    legacy = parse_invoice_error(invoice_error)
+    if legacy:
+        spec = {**spec, "rules": list(spec.get("rules", [])) + [legacy]}
+    return Scenario(spec, clock)
@@ -0,0 +1,93 @@
+"""
+Uvicorn settings for the development and production serving profiles.
+
+``dev`` keeps the historical behaviour (auto-reload, one worker). ``prod``
+disables the reloader and file watcher, picks the fastest event loop and HTTP
+parser that are installed, and bounds connections so the mock behaves well
+under load and stops quickly on SIGTERM.
+"""
+
+import argparse
+import importlib.util
+import signal
+import sys
+
+PROFILES = ("dev", "prod")
+
+DEFAULT_BACKLOG = 2048
+DEFAULT_KEEP_ALIVE = 5
+DEFAULT_GRACEFUL_TIMEOUT = 3
+
+
+def fastest_loop() -> str:
+    return "uvloop" if importlib.util.find_spec("uvloop") else "asyncio"
+
+
+def fastest_http() -> str:
+    return "httptools" if importlib.util.find_spec("httptools") else "h11"
+
+
+def add_profile_arguments(parser: argparse.ArgumentParser) -> None:
+    """Add the serving profile options shared by the server entry points."""
+    parser.add_argument(
+        "--profile",
+        choices=PROFILES,
+        default="dev",
+        help="Serving profile: dev (auto-reload) or prod (no reloader, uvloop/httptools)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Worker processes for the prod profile; each worker keeps its own mock state (default: 1)",
+    )
+    parser.add_argument(
+        "--backlog",
+        type=int,
+        default=DEFAULT_BACKLOG,
+        help=f"Listen backlog for the prod profile (default: {DEFAULT_BACKLOG})",
+    )
+    parser.add_argument(
+        "--keep-alive",
+        type=int,
+        default=DEFAULT_KEEP_ALIVE,
+        help=f"Keep-alive timeout in seconds for the prod profile (default: {DEFAULT_KEEP_ALIVE})",
+    )
+    parser.add_argument(
+        "--limit-concurrency",
+        type=int,
+        help="Maximum concurrent connections before answering 503 (prod profile)",
+    )
+    parser.add_argument(
+        "--graceful-timeout",
+        type=int,
+        default=DEFAULT_GRACEFUL_TIMEOUT,
+        help=f"Seconds to wait for open requests after SIGTERM (default: {DEFAULT_GRACEFUL_TIMEOUT})",
+    )
+
+
+def uvicorn_options(args: argparse.Namespace, reload: bool = True) -> dict:
+    """Keyword arguments for ``uvicorn.run`` from parsed profile options."""
+    if args.profile == "dev":
+        return {"reload": reload, "workers": 1}
+
+    return {
+        "reload": False,
+        "workers": max(1, args.workers),
+        "loop": fastest_loop(),
+        "http": fastest_http(),
+        "backlog": args.backlog,
+        "timeout_keep_alive": args.keep_alive,
+        "limit_concurrency": args.limit_concurrency,
+        "timeout_graceful_shutdown": args.graceful_timeout,
+        "server_header": False,
+    }
+
+
+def exit_on_sigterm() -> None:
+    """Exit promptly on SIGTERM until uvicorn installs its own handlers.
+
+    As PID 1 in a container the default SIGTERM action is ignored, so startup
+    work (restores, synthetic history) would otherwise run to completion.
+    """
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(128 + signum))
@@ -0,0 +1,126 @@
+"""
+Emulated secure element: invoice ``signature`` and ``encryptedInternalData``.
+
+Both are derived from a device key and a canonical SHA-256 digest of the
+issued invoice. The signature is PBKDF2-HMAC-SHA256 of the digest, 256 bytes
+like the device's RSA-2048 signatures; the iteration count is the cost knob
+(about 2 µs each) for emulating slower signing hardware. The internal data
+(counters and total) is encrypted with an HMAC-SHA256 keystream.
+
+Signing runs off the event loop. Invoices arriving while a batch is being
+signed queue up and are signed together as the next batch, in arrival order,
+so a burst costs one thread hand-off per batch rather than per invoice.
+"""
+
+import asyncio
+import base64
+import hashlib
+import json
+import struct
+import time
+
+from ofs_mockup_srv.metrics import Metrics
+from ofs_mockup_srv.records import Invoice
+
+DEFAULT_KEY = b"ofs-mockup-srv device key"
+DEFAULT_COST = 1
+DEFAULT_MAX_BATCH = 256
+SIGNATURE_SIZE = 256
+
+# totalCounter, transactionTypeCounter, totalAmount (units)
+_INTERNAL = struct.Struct("<IIq")
+
+
+def invoice_digest(invoice: Invoice, signed_by: str, total_counter: int, transaction_type_counter: int) -> bytes:
+    """SHA-256 of the canonical form of an issued invoice."""
+    canonical = [
+        signed_by,
+        invoice.number,
+        invoice.sdc_date_time,
+        total_counter,
+        transaction_type_counter,
+        invoice.invoice_type,
+        invoice.transaction_type,
+        invoice.cashier,
+        invoice.buyer_id,
+        invoice.referent_number,
+        invoice.referent_dt,
+        invoice.total,
+        [
+            [item.name, item.gtin, item.labels, item.quantity, item.unit_price, item.total, item.discount, item.discount_amount]
+            for item in invoice.items
+        ],
+        [[payment.payment_type, payment.amount] for payment in invoice.payments],
+    ]
+    return hashlib.sha256(json.dumps(canonical, ensure_ascii=False, separators=(",", ":")).encode("utf-8")).digest()
+
+
+def sign_digest(key: bytes, digest: bytes, cost: int = DEFAULT_COST) -> bytes:
+    return hashlib.pbkdf2_hmac("sha256", key, digest, cost, SIGNATURE_SIZE)
+
+
+def crypt_internal_data(key: bytes, digest: bytes, data: bytes) -> bytes:
+    """XOR ``data`` (padded to 256 bytes) with the invoice's keystream; applying it again decrypts."""
+    data = data.ljust(SIGNATURE_SIZE, b"\x00")
+    stream = hashlib.pbkdf2_hmac("sha256", key, b"internal data" + digest, 1, len(data))
+    return (int.from_bytes(data, "big") ^ int.from_bytes(stream, "big")).to_bytes(len(data), "big")
+
+
+def sign_batch(key: bytes, cost: int, jobs: list) -> list:
+    """(signature, encryptedInternalData) in base64 for each (invoice, signed_by, total_counter, transaction_type_counter)."""
+    signed = []
+    for invoice, signed_by, total_counter, transaction_type_counter in jobs:
+        digest = invoice_digest(invoice, signed_by, total_counter, transaction_type_counter)
+        internal = _INTERNAL.pack(total_counter, transaction_type_counter, invoice.total)
+        signed.append(
+            (
+                base64.b64encode(sign_digest(key, digest, cost)).decode("ascii"),
+                base64.b64encode(crypt_internal_data(key, digest, internal)).decode("ascii"),
+            )
+        )
+    return signed
+
+
+class Signer:
+    def __init__(self, key: bytes = DEFAULT_KEY, cost: int = DEFAULT_COST, max_batch: int = DEFAULT_MAX_BATCH, metrics: Metrics | None = None):
+        if cost < 1:
+            raise ValueError(f"cost must be >= 1, got {cost}")
+        if max_batch < 1:
+            raise ValueError(f"max_batch must be >= 1, got {max_batch}")
+        self.key = key
+        self.cost = cost
+        self.max_batch = max_batch
+        self.metrics = metrics
+        self._queue: list = []
+        self._drain_task: asyncio.Task | None = None
+
+    async def sign(self, invoice: Invoice, signed_by: str, total_counter: int, transaction_type_counter: int) -> tuple[str, str]:
+        """(signature, encryptedInternalData) of an issued invoice, in base64."""
+        future: asyncio.Future[tuple[str, str]] = asyncio.get_running_loop().create_future()
+        self._queue.append(((invoice, signed_by, total_counter, transaction_type_counter), future))
+        if self._drain_task is None:
+            self._drain_task = asyncio.ensure_future(self._drain())
+        return await future
+
+    async def _drain(self) -> None:
+        try:
+            while self._queue:
+                batch = self._queue[: self.max_batch]
+                del self._queue[: self.max_batch]
+                started = time.perf_counter()
+                try:
+                    results = await asyncio.to_thread(sign_batch, self.key, self.cost, [job for job, _ in batch])
+                except Exception as e:
+                    for _, future in batch:
+                        if not future.done():
+                            future.set_exception(e)
+                    continue
+                if self.metrics is not None:
+                    self.metrics.observe("signing.batch", time.perf_counter() - started)
+                    self.metrics.incr("signing.batches")
+                    self.metrics.incr("signing.invoices", len(batch))
+                for (_, future), result in zip(batch, results):
+                    if not future.done():
+                        future.set_result(result)
+        finally:
+            self._drain_task = None
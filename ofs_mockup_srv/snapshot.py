@@ -0,0 +1,200 @@
+"""
+Compact snapshot files of the full device state.
+
+Layout (all integers little-endian u64, sections 8-byte aligned)::
+
+    b"OFSSNAP1" | header length | header JSON | padding
+    offsets[count + 1]      byte offsets of each record inside the blob
+    key_hashes[count]       sorted 64-bit hashes of the invoice numbers
+    key_positions[count]    record position for each hash
+    blob                    compact JSON records, one per issued invoice
+
+Restoring only parses the header and memory-maps the file. Records are decoded
+on access and invoice numbers are found by binary search over the mapped hash
+table, so restore time does not depend on the size of the history.
+"""
+
+import bisect
+import hashlib
+import json
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+from array import array
+from collections.abc import Iterable
+
+MAGIC = b"OFSSNAP1"
+VERSION = 1
+_U64 = struct.Struct("<Q")
+
+
+class SnapshotError(ValueError):
+    """Raised when a file is not a readable snapshot."""
+
+
+def key_hash(invoice_number: str) -> int:
+    digest = hashlib.blake2b(invoice_number.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
+
+def _pad(n: int) -> int:
+    return (8 - n % 8) % 8
+
+
+class SnapshotSegment:
+    """Read-only journal segment backed by a memory-mapped snapshot file."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "rb")
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise SnapshotError(f"{path} is empty")
+        self._views: list[memoryview] = []
+        try:
+            self._parse(memoryview(self._map))
+        except SnapshotError:
+            self._close()
+            raise
+        except (struct.error, ValueError, KeyError, TypeError, AttributeError) as e:
+            # Truncated or corrupt header/sections (JSONDecodeError is a ValueError)
+            self._close()
+            raise SnapshotError(f"{path} is not a readable snapshot: {e}") from e
+
+    def _parse(self, buf: memoryview) -> None:
+        self._views.append(buf)
+        if buf[:8] != MAGIC:
+            raise SnapshotError(f"{self.path} is not an OFS snapshot")
+        (header_len,) = _U64.unpack_from(buf, 8)
+        if 16 + header_len > len(buf):
+            raise SnapshotError(f"{self.path} is truncated")
+        self.header = json.loads(bytes(buf[16 : 16 + header_len]))
+        if self.header.get("version") != VERSION:
+            raise SnapshotError(f"unsupported snapshot version {self.header.get('version')}")
+
+        count = self.header["count"]
+        sections = self.header["sections"]
+        self._count: int = count
+        self._offsets = self._section(buf, sections["offsets"], count + 1)
+        self._hashes = self._section(buf, sections["hashes"], count)
+        self._positions = self._section(buf, sections["positions"], count)
+        self._blob = sections["blob"]
+        if self._blob + self._offsets[count] > len(buf):
+            raise SnapshotError(f"{self.path} is truncated")
+        self._buf = buf
+
+    def _section(self, buf: memoryview, start: int, count: int) -> memoryview:
+        """``count`` u64 values at ``start``."""
+        view = buf[start : start + 8 * count]
+        self._views.append(view)
+        if len(view) != 8 * count:
+            raise SnapshotError(f"{self.path} is truncated")
+        view = view.cast("Q")
+        self._views.append(view)
+        return view
+
+    def _close(self) -> None:
+        """Release the views, the map and the file (after a failed open)."""
+        for view in reversed(self._views):
+            view.release()
+        self._views.clear()
+        self._map.close()
+        self._file.close()
+
+    @property
+    def state(self) -> dict:
+        state: dict = self.header["state"]
+        return state
+
+    def __len__(self) -> int:
+        return self._count
+
+    def raw(self, pos: int) -> bytes:
+        start = self._blob + self._offsets[pos]
+        end = self._blob + self._offsets[pos + 1]
+        return bytes(self._buf[start:end])
+
+    def __getitem__(self, pos: int) -> dict:
+        if pos < 0:
+            pos += self._count
+        if not 0 <= pos < self._count:
+            raise IndexError(pos)
+        doc: dict = json.loads(self.raw(pos))
+        return doc
+
+    def find(self, invoice_number: str) -> int | None:
+        h = key_hash(invoice_number)
+        i = bisect.bisect_left(self._hashes, h)
+        while i < self._count and self._hashes[i] == h:
+            pos = self._positions[i]
+            if self[pos]["invoiceResponse"]["invoiceNumber"] == invoice_number:
+                return pos
+            i += 1
+        return None
+
+
+def write_snapshot(path: str, state: dict, records: Iterable[tuple[str, bytes]]) -> int:
+    """Write ``state`` and the journal ``records`` to ``path``.
+
+    ``records`` yields ``(invoice_number, encoded_json)`` pairs in journal
+    order and is consumed before ``state`` is serialized. The file is written
+    next to the target and moved into place atomically. Returns the number of
+    records written.
+    """
+    offsets = array("Q", [0])
+    keys = []
+
+    directory = os.path.dirname(os.path.abspath(path))
+    with tempfile.TemporaryFile(dir=directory) as blob:
+        size = 0
+        for pos, (number, raw) in enumerate(records):
+            blob.write(raw)
+            size += len(raw)
+            offsets.append(size)
+            keys.append((key_hash(number), pos))
+        count = len(keys)
+        keys.sort()
+        hashes = array("Q", (h for h, _ in keys))
+        positions = array("Q", (p for _, p in keys))
+
+        # Section offsets depend on the header length, which depends on them;
+        # reserve a fixed-width field for each so one pass is enough.
+        header = {"version": VERSION, "count": count, "state": state}
+        header["sections"] = dict.fromkeys(("offsets", "hashes", "positions", "blob"), 10**15)
+        header_len = len(json.dumps(header).encode("utf-8"))
+        start = 16 + header_len + _pad(16 + header_len)
+        header["sections"] = {
+            "offsets": start,
+            "hashes": start + 8 * (count + 1),
+            "positions": start + 8 * (count + 1) + 8 * count,
+            "blob": start + 8 * (count + 1) + 16 * count,
+        }
+        header_bytes = json.dumps(header).encode("utf-8").ljust(header_len)
+
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as out:
+                out.write(MAGIC)
+                out.write(_U64.pack(header_len))
+                out.write(header_bytes)
+                out.write(b"\0" * _pad(16 + header_len))
+                out.write(offsets.tobytes())
+                out.write(hashes.tobytes())
+                out.write(positions.tobytes())
+                blob.seek(0)
+                shutil.copyfileobj(blob, out, 1 << 20)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+    return count
+
+
+def read_snapshot(path: str) -> SnapshotSegment:
+    """Map a snapshot file; its ``state`` and records are read on demand."""
+    return SnapshotSegment(path)
@@ -14,7 +14,9 @@ import subprocess
 import sys
 import time
 import uvicorn
-from ofs_mockup_srv.main import app
+from ofs_mockup_srv.main import app, rebuild_startup_state, serves_in_process
+from ofs_mockup_srv.scenarios import load_scenario
+from ofs_mockup_srv.serving import add_profile_arguments, exit_on_sigterm, uvicorn_options
 
 
 def check_port(port):
@@ -137,6 +139,8 @@ Examples:
   start-ofs-server --debug                       # Start with debug logging enabled
   start-ofs-server --debug --available --pin 0000 # Debug + available + custom PIN
   start-ofs-server --return-invoice-error "Out of paper:-10" # Simulate invoice errors
+  start-ofs-server --scenario soak.json                 # Load fault scenario rules
+  start-ofs-server --profile prod --workers 1          # Production profile: no reloader, uvloop/httptools
         """
     )
     
@@ -182,7 +186,15 @@ Examples:
         help="Simulate invoice error in format 'message:errorCode' (e.g. 'Out of paper:-10')"
     )
 
+    parser.add_argument(
+        "--scenario",
+        help="Load fault scenario rules from a JSON file (see ofs_mockup_srv/scenarios.py)"
+    )
+
+    add_profile_arguments(parser)
+
     args = parser.parse_args()
+    exit_on_sigterm()
 
     # Check if port is busy and kill if necessary
     if check_port(args.port):
@@ -197,14 +209,19 @@ Examples:
     os.environ['OFS_MOCKUP_AVAILABLE'] = 'true' if args.available else 'false'
     if args.return_invoice_error:
         os.environ['OFS_MOCKUP_INVOICE_ERROR'] = args.return_invoice_error
+    if args.scenario:
+        os.environ['OFS_MOCKUP_SCENARIO'] = args.scenario
     
     # Initialize app state from CLI args
     app.state.pin_fail_count = 0
     app.state.current_api_attention = 200 if args.available else 404
     app.state.debug_enabled = args.debug
     app.state.pin = args.pin
-    if args.return_invoice_error:
-        app.state.invoice_error = args.return_invoice_error
+    try:
+        app.state.scenario = load_scenario(args.scenario, args.return_invoice_error, app.state.clock.time)
+    except (OSError, ValueError) as e:
+        print(f"❌ Cannot load scenario {args.scenario}: {e}")
+        sys.exit(1)
 
     print(f"🚀 Starting OFS Mockup Server...", flush=True)
     print(f"   Host: {args.host}", flush=True)
@@ -215,18 +232,23 @@ Examples:
     print(f"   Platform: {platform.system()}", flush=True)
     if args.debug:
         print(f"   PIN: {args.pin}", flush=True)
+    print(f"   Profile: {args.profile}", flush=True)
     print(f"   Debug: {'Enabled - request/response logging' if args.debug else 'Disabled'}", flush=True)
     print(flush=True)
 
+    options = uvicorn_options(args, reload=not args.no_reload)
+    if serves_in_process(options):
+        # uvicorn serves the app imported above: rebuild its startup state
+        # (and the /mock/reset baseline) from the options exported here
+        rebuild_startup_state()
     try:
         uvicorn.run(
             "ofs_mockup_srv.main:app",
             host=args.host,
             port=args.port,
-            reload=not args.no_reload,
             access_log=args.debug,  # Enable access log when debug is on
             log_level="debug" if args.debug else "info",
-            workers=1,
+            **options,
         )
     except KeyboardInterrupt:
         print("\n👋 Server stopped")
@@ -0,0 +1,76 @@
+"""
+Named device-state baselines for constant-time resets.
+
+A baseline holds the scalar device state plus a frozen journal. Resetting to it
+builds a fresh, empty journal layer on top of the frozen one and swaps the
+state pointers, so the cost does not depend on how much data either the
+baseline or the discarded state holds. Discarded state is released on a
+background thread instead of inside the request.
+"""
+
+import queue
+import threading
+
+from ofs_mockup_srv.store import InvoiceStore
+from ofs_mockup_srv.tax import TaxRates
+
+DEFAULT_BASELINE = "clean"
+
+
+class Baseline:
+    __slots__ = (
+        "name",
+        "current_api_attention",
+        "pin_fail_count",
+        "scenario_spec",
+        "tax_rates",
+        "journal",
+    )
+
+    def __init__(
+        self,
+        name: str,
+        current_api_attention: int,
+        pin_fail_count: int,
+        scenario_spec: dict,
+        tax_rates: TaxRates,
+        journal: InvoiceStore,
+    ):
+        self.name = name
+        self.current_api_attention = current_api_attention
+        self.pin_fail_count = pin_fail_count
+        self.scenario_spec = scenario_spec
+        self.tax_rates = tax_rates
+        self.journal = journal  # frozen InvoiceStore
+
+    def describe(self) -> dict:
+        return {
+            "name": self.name,
+            "current_api_attention": self.current_api_attention,
+            "pin_fail_count": self.pin_fail_count,
+            "invoices": len(self.journal),
+            "total_counter": self.journal.total_counter,
+        }
+
+
+_graveyard: queue.SimpleQueue = queue.SimpleQueue()
+_reaper = None
+_reaper_lock = threading.Lock()
+
+
+def _reap() -> None:
+    while True:
+        # Dropping the last reference frees a discarded journal, which can take
+        # seconds for millions of invoices; it happens here, not in the request
+        _graveyard.get()
+
+
+def retire(*objects: object) -> None:
+    """Drop references to discarded state on a background thread."""
+    global _reaper
+    if _reaper is None:
+        with _reaper_lock:
+            if _reaper is None:
+                _reaper = threading.Thread(target=_reap, name="ofs-state-reaper", daemon=True)
+                _reaper.start()
+    _graveyard.put(objects)
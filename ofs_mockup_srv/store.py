@@ -0,0 +1,357 @@
+"""
+Journal of issued invoices and the device counters.
+
+Only a columnar index of the search fields stays in memory (see columns.py).
+Invoices issued at runtime are appended, encoded, to an unnamed temporary file
+and decoded when looked up. A restored snapshot contributes a read-only base
+segment whose records stay in the snapshot file, so restoring a large history
+is cheap. A frozen store can itself be the base of a new one: that is how
+baselines are shared between resets without copying the journal.
+"""
+
+import base64
+import binascii
+import datetime
+import json
+import tempfile
+import threading
+from array import array
+from collections.abc import Iterable, Iterator
+from typing import IO, Protocol
+
+from ofs_mockup_srv.aggregate import merge
+from ofs_mockup_srv.columns import (
+    INVOICE_TYPES,
+    TRANSACTION_TYPES,
+    InvoiceColumns,
+    decode_number,
+    payment_bit,
+    wall_time,
+)
+from ofs_mockup_srv.money import to_units
+from ofs_mockup_srv.records import Invoice
+
+INVOICE_PREFIX = "AX4F7Y5L-BX4F7Y5L-"
+
+
+class Segment(Protocol):
+    """Read-only journal segment a store can be layered on (snapshot, SQLite)."""
+
+    def __len__(self) -> int: ...
+
+    def __getitem__(self, pos: int) -> dict: ...
+
+    def raw(self, pos: int) -> bytes: ...
+
+    def find(self, invoice_number: str) -> int | None: ...
+
+
+class DocLog:
+    """Append-only file of encoded records; only their offsets are kept in memory."""
+
+    def __init__(self) -> None:
+        self._file: IO[bytes] | None = None  # created on first append
+        self._offsets = array("q", [0])
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def append(self, data: bytes) -> None:
+        with self._lock:
+            if self._file is None:
+                self._file = tempfile.TemporaryFile()
+            self._file.seek(self._offsets[-1])
+            self._file.write(data)
+            self._offsets.append(self._offsets[-1] + len(data))
+
+    def raw(self, pos: int) -> bytes:
+        start, end = self._offsets[pos], self._offsets[pos + 1]
+        if self._file is None:
+            raise IndexError(pos)
+        with self._lock:
+            self._file.seek(start)
+            return self._file.read(end - start)
+
+
+class InvoiceStore:
+    def __init__(
+        self,
+        total_counter: int = 0,
+        type_counters: dict | None = None,
+        base: "InvoiceStore | Segment | None" = None,
+        ordered: bool | None = None,
+    ):
+        self.total_counter = total_counter
+        # Counter per "invoiceType/transactionType", e.g. "Normal/Sale"
+        self.type_counters = dict(type_counters or {})
+        self.base = base
+        self._base_len = len(base) if base is not None else 0
+        self._log = DocLog()
+        self._columns = InvoiceColumns()
+        # Columns of a base without its own (snapshot segment), built on first use
+        self._base_columns_cache: InvoiceColumns | None = None
+        # Last invoice number and timestamp of such a base, read from its last record
+        self._base_last: str | None = None
+        self._base_last_timestamp: int | None = None
+        self.frozen = False
+        # True while journal order is sdcDateTime order, which lets searches
+        # binary-search their start and stop at the end of the date range
+        self.ordered = getattr(base, "ordered", True) if ordered is None else ordered
+
+    def __len__(self) -> int:
+        return self._base_len + len(self._columns)
+
+    def freeze(self) -> "InvoiceStore":
+        """Make the journal read-only so it can be shared as a base."""
+        self.frozen = True
+        return self
+
+    def layer(self) -> "InvoiceStore":
+        """New writable store on top of this (frozen) one, continuing its counters."""
+        return InvoiceStore(self.total_counter, self.type_counters, base=self.freeze())
+
+    def extends(self, other: "InvoiceStore") -> bool:
+        """True if ``other`` is this store or one of its bases (a prefix of it)."""
+        store: InvoiceStore | Segment | None = self
+        while isinstance(store, InvoiceStore):
+            if store is other:
+                return True
+            store = store.base
+        return False
+
+    def next_counters(self, invoice_type: str, transaction_type: str) -> tuple[int, int]:
+        """Advance and return (totalCounter, transactionTypeCounter)."""
+        key = f"{invoice_type}/{transaction_type}"
+        self.total_counter += 1
+        self.type_counters[key] = self.type_counters.get(key, 0) + 1
+        return self.total_counter, self.type_counters[key]
+
+    def append(self, doc: dict, invoice: Invoice | None = None) -> int:
+        """Add an issued invoice ({"invoiceRequest", "invoiceResponse"}) to the journal.
+
+        ``invoice`` is the record of ``doc`` when the caller already has one.
+        """
+        if self.frozen:
+            raise RuntimeError("journal is frozen")
+        previous = self.timestamp(-1) if len(self) else None
+        self._columns.append(Invoice.from_doc(doc) if invoice is None else invoice)
+        self._log.append(encode_doc(doc))
+        if previous is not None and self._columns.timestamps[-1] < previous:
+            self.ordered = False
+        return len(self) - 1
+
+    def _segment(self) -> "InvoiceStore | Segment":
+        """The base, which holds every position below ``_base_len``."""
+        if self.base is None:
+            raise IndexError("journal has no base")
+        return self.base
+
+    def _base_columns(self) -> InvoiceColumns:
+        if self._base_columns_cache is None:
+            self._base_columns_cache = InvoiceColumns.build(self._segment())
+        return self._base_columns_cache
+
+    def _segments(self) -> list[tuple[int, InvoiceColumns]]:
+        """``(first position, columns)`` of each journal segment, oldest first."""
+        if self.base is None:
+            segments = []
+        elif isinstance(self.base, InvoiceStore):
+            segments = self.base._segments()
+        else:
+            segments = [(0, self._base_columns())]
+        segments.append((self._base_len, self._columns))
+        return segments
+
+    def find(self, invoice_number: str) -> int | None:
+        pos = self._columns.find(invoice_number)
+        if pos is not None:
+            return self._base_len + pos
+        if self.base is not None:
+            return self.base.find(invoice_number)
+        return None
+
+    def get(self, invoice_number: str) -> dict | None:
+        pos = self.find(invoice_number)
+        return None if pos is None else self[pos]
+
+    def __getitem__(self, pos: int) -> dict:
+        if pos < 0:
+            pos += len(self)
+        if pos < self._base_len:
+            return self._segment()[pos]
+        doc: dict = json.loads(self._log.raw(pos - self._base_len))
+        return doc
+
+    def timestamp(self, pos: int) -> int:
+        """Wall-clock microseconds of the record's sdcDateTime (see columns.wall_time)."""
+        if pos < 0:
+            pos += len(self)
+        if pos >= self._base_len:
+            return self._columns.timestamps[pos - self._base_len]
+        if isinstance(self.base, InvoiceStore):
+            return self.base.timestamp(pos)
+        if self._base_columns_cache is None and pos == self._base_len - 1:
+            # What append compares against: no need to build the base's columns
+            if self._base_last_timestamp is None:
+                self._base_last_timestamp = wall_time(self._segment()[pos]["invoiceResponse"]["sdcDateTime"])
+            return self._base_last_timestamp
+        return self._base_columns().timestamps[pos]
+
+    def seek(self, sdc_date_time: str, strict: bool = False) -> int:
+        """First position issued at (or, if ``strict``, after) ``sdc_date_time``.
+
+        Only meaningful while the journal is ordered; O(log n).
+        """
+        ts = wall_time(sdc_date_time)
+        lo, hi = 0, len(self)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            value = self.timestamp(mid)
+            if value < ts or (strict and value == ts):
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def resume(self, after: tuple[str, str]) -> int | None:
+        """Position following the record ``(sdcDateTime, invoiceNumber)``, None if unknown."""
+        sdc_date_time, number = after
+        pos = self.find(number)
+        if pos is not None and self.timestamp(pos) == wall_time(sdc_date_time):
+            return pos + 1
+        if self.ordered:
+            return self.seek(sdc_date_time, strict=True)
+        return None
+
+    def raw(self, pos: int) -> bytes:
+        """Encoded JSON of the record at ``pos`` (no re-encoding)."""
+        if pos < self._base_len:
+            return self._segment().raw(pos)
+        return self._log.raw(pos - self._base_len)
+
+    def number(self, pos: int) -> str:
+        if pos >= self._base_len:
+            return decode_number(self._columns.numbers[pos - self._base_len])
+        if isinstance(self.base, InvoiceStore):
+            return self.base.number(pos)
+        number: str = self._segment()[pos]["invoiceResponse"]["invoiceNumber"]
+        return number
+
+    def records(self, count: int | None = None) -> Iterator[tuple[str, bytes]]:
+        """Yield ``(invoice_number, encoded_json)`` for the first ``count`` records."""
+        count = len(self) if count is None else count
+        for pos in range(count):
+            yield self.number(pos), self.raw(pos)
+
+    def search(
+        self,
+        from_date: datetime.date,
+        to_date: datetime.date,
+        amount_from: float | None = None,
+        amount_to: float | None = None,
+        invoice_types: Iterable[str] = (),
+        transaction_types: Iterable[str] = (),
+        payment_types: Iterable[str] = (),
+        start: int = 0,
+        keys: dict[str, str] | None = None,
+    ) -> Iterator[dict]:
+        """Yield journal records issued between the two dates (inclusive) matching the filters.
+
+        The filters run over the columns; only matching records are decoded.
+        ``start`` is the first journal position to consider (see ``resume``).
+        ``keys`` restricts to indexed values, e.g. ``{"gtin": "12345678"}``.
+        """
+        first_ts = wall_time(from_date.isoformat())
+        end_ts = wall_time((to_date + datetime.timedelta(days=1)).isoformat())
+        payment_mask = 0
+        for name in payment_types:
+            payment_mask |= payment_bit(name)
+        units_from = None if amount_from is None else to_units(amount_from)
+        units_to = None if amount_to is None else to_units(amount_to)
+        invoice_codes = {INVOICE_TYPES.code(t) for t in invoice_types} or None
+        transaction_codes = {TRANSACTION_TYPES.code(t) for t in transaction_types} or None
+        for offset, columns in self._segments():
+            if start >= offset + len(columns):
+                continue
+            for pos in columns.matches(
+                max(0, start - offset),
+                first_ts,
+                end_ts,
+                units_from,
+                units_to,
+                invoice_codes,
+                transaction_codes,
+                payment_mask,
+                keys,
+            ):
+                yield self[offset + pos]
+
+    def prefix(self, pos: int) -> dict[str, tuple[int, int]]:
+        """Category -> (count, amount units) over the first ``pos`` records."""
+        if pos > self._base_len:
+            own = self._columns.prefix(pos - self._base_len, self._own_doc)
+            return merge(self._base_prefix(self._base_len), own)
+        return self._base_prefix(pos)
+
+    def _own_doc(self, pos: int) -> dict:
+        doc: dict = json.loads(self._log.raw(pos))
+        return doc
+
+    def _base_prefix(self, pos: int) -> dict:
+        if self.base is None:
+            return {}
+        if isinstance(self.base, InvoiceStore):
+            return self.base.prefix(pos)
+        return self._base_columns().prefix(pos, self.base.__getitem__)
+
+    def aggregate(self, from_date: datetime.date, to_date: datetime.date) -> dict[str, tuple[int, int]]:
+        """Category totals for records issued between the two dates (inclusive).
+
+        O(log n) on an ordered journal; otherwise a scan of the columns.
+        """
+        first = from_date.isoformat()
+        end = (to_date + datetime.timedelta(days=1)).isoformat()
+        if self.ordered:
+            return merge(self.prefix(self.seek(end)), self.prefix(self.seek(first)), sign=-1)
+        first_ts, end_ts = wall_time(first), wall_time(end)
+        totals: dict[str, tuple[int, int]] = {}
+        for offset, columns in self._segments():
+            positions = columns.matches(0, first_ts, end_ts)
+            totals = merge(totals, columns.totals(positions, lambda i: self[offset + i]))
+        return totals
+
+    def last_invoice_number(self) -> str | None:
+        if len(self._columns):
+            return decode_number(self._columns.numbers[-1])
+        if not self._base_len:
+            return None
+        if isinstance(self.base, InvoiceStore):
+            return self.base.last_invoice_number()
+        if self._base_last is None:
+            self._base_last = self._segment()[-1]["invoiceResponse"]["invoiceNumber"]
+        return self._base_last
+
+
+def encode_doc(doc: dict) -> bytes:
+    return json.dumps(doc, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def encode_cursor(doc: dict) -> str:
+    """Opaque keyset cursor pointing just after ``doc``."""
+    response = doc["invoiceResponse"]
+    key = json.dumps([response["sdcDateTime"], response["invoiceNumber"]], separators=(",", ":"))
+    return base64.urlsafe_b64encode(key.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple[str, str]:
+    """``(sdcDateTime, invoiceNumber)`` from a cursor; ValueError if malformed."""
+    try:
+        sdc_date_time, number = json.loads(
+            base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        )
+    except (binascii.Error, UnicodeDecodeError, TypeError, ValueError) as e:
+        raise ValueError(f"invalid cursor {cursor!r}") from e
+    if not isinstance(sdc_date_time, str) or not isinstance(number, str):
+        raise ValueError(f"invalid cursor {cursor!r}")
+    return sdc_date_time, number
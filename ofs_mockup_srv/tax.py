@@ -0,0 +1,88 @@
+"""
+Tax configuration of the emulated device, shared by the server and the
+offline tools (ofs-mockup-gen) without importing the app.
+"""
+
+from pydantic import BaseModel
+
+SEND_CIRILICA = True
+CIRILICA_E = "Е"
+CIRILICA_K = "К"
+
+
+class TaxRate(BaseModel):
+    label: str
+    rate: int
+
+
+class TaxCategory(BaseModel):
+    categoryType: int
+    name: str
+    orderId: int
+    taxRates: list[TaxRate] = []
+
+
+class TaxRates(BaseModel):
+    groupId: str
+    taxCategories: list[TaxCategory] = []
+    validFrom: str
+
+
+def default_tax_rates() -> dict:
+    """Factory tax configuration reported by /api/status."""
+    taxRate0 = TaxRate(rate=0, label="G")
+    taxRateA = TaxRate(rate=0, label="A")
+    taxRateE = TaxRate(rate=10, label="E")
+    taxRateD = TaxRate(rate=20, label="D")
+
+    if SEND_CIRILICA:
+        taxCategory1 = TaxCategory(
+            categoryType=0, name="Без ПДВ", orderId=4, taxRates=[taxRate0]
+        )
+    else:
+        taxCategory1 = TaxCategory(
+            categoryType=0, name="Bez PDV Ž-kat", orderId=4, taxRates=[taxRate0]
+        )
+
+    taxCategory2 = TaxCategory(
+        categoryType=0, name="Nije u PDV", orderId=1, taxRates=[taxRateA]
+    )
+
+    if SEND_CIRILICA:
+        taxCategory3 = TaxCategory(
+            categoryType=6, name="Г-A-Ђ-Љ П-ПДВ", orderId=3, taxRates=[taxRateE]
+        )
+    else:
+        taxCategory3 = TaxCategory(
+            categoryType=6, name="P-PDV", orderId=3, taxRates=[taxRateE]
+        )
+
+    taxCategory4 = TaxCategory(
+        categoryType=6, name="D-PDV", orderId=3, taxRates=[taxRateD]
+    )
+
+    allTaxRates = [
+        TaxRates(
+            groupId="1",
+            taxCategories=[taxCategory1],
+            validFrom="2021-11-01T02:00:00.000+01:00",
+        ),
+        TaxRates(
+            groupId="6",
+            taxCategories=[taxCategory2, taxCategory3, taxCategory4],
+            validFrom="",
+        ),
+    ]
+
+    currentTaxRates = [
+        TaxRates(
+            groupId="6",
+            taxCategories=[taxCategory1, taxCategory3],
+            validFrom="2024-05-01T02:00:00.000+01:00",
+        )
+    ]
+
+    return {
+        "allTaxRates": [t.model_dump() for t in allTaxRates],
+        "currentTaxRates": [t.model_dump() for t in currentTaxRates],
+    }
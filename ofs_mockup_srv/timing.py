@@ -0,0 +1,97 @@
+"""
+Server-Timing phase breakdown.
+
+Handlers that opt in (``request_phases(req, "invoice")``) split their time into
+phases by marking the end of each: ``parse`` (body parsing and validation),
+``logic``, ``render`` (receipt journal, images, response bodies), ``serialize``
+and ``delay`` (injected by scenarios). A mark adds the time since the previous
+mark to its phase, so a phase may be marked several times. Time counts from
+the moment ``ServerTimingMiddleware`` receives the request, and what is left
+when the response starts (FastAPI serialization, compression) is
+``serialize``.
+
+The middleware emits the phases as a ``Server-Timing`` header, so client traces
+can separate mock time from network time. It also records them as
+``timing.<endpoint>.<phase>`` timers in the metrics.
+"""
+
+import time
+
+from starlette.requests import Request
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from ofs_mockup_srv.metrics import Metrics
+
+SERVER_TIMING_HEADER = b"server-timing"
+
+
+class Phases:
+    """Phase durations (seconds) of one request."""
+
+    __slots__ = ("name", "durations", "_started", "_last")
+
+    def __init__(self, name: str, started: float):
+        self.name = name
+        self.durations: dict[str, float] = {}
+        self._started = started
+        self._last = started
+
+    def mark(self, phase: str) -> None:
+        """End a stretch of ``phase`` now."""
+        now = time.perf_counter()
+        self.durations[phase] = self.durations.get(phase, 0.0) + now - self._last
+        self._last = now
+
+    def total(self) -> float:
+        return self._last - self._started
+
+    def header(self) -> str:
+        """``Server-Timing`` value in milliseconds, phases in the order first marked."""
+        entries = [f"{phase};dur={seconds * 1000:.3f}" for phase, seconds in self.durations.items()]
+        entries.append(f"total;dur={self.total() * 1000:.3f}")
+        return ", ".join(entries)
+
+    def record(self, metrics: Metrics) -> None:
+        for phase, seconds in self.durations.items():
+            metrics.observe(f"timing.{self.name}.{phase}", seconds)
+        metrics.observe(f"timing.{self.name}.total", self.total())
+
+
+def request_phases(req: Request, name: str) -> Phases:
+    """Phases of the request, reported under ``name``."""
+    state = req.scope.setdefault("state", {})
+    phases: Phases | None = state.get("phases")
+    if phases is None:
+        phases = Phases(name, state.get("received", time.perf_counter()))
+        state["phases"] = phases
+    phases.name = name
+    return phases
+
+
+class ServerTimingMiddleware:
+    """ASGI middleware adding the Server-Timing header of handlers that record phases."""
+
+    def __init__(self, app: ASGIApp, metrics: Metrics | None = None):
+        self.app = app
+        self.metrics = metrics
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        state = scope.setdefault("state", {})
+        state["received"] = time.perf_counter()
+
+        async def send_with_timing(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                phases = state.get("phases")
+                if phases is not None:
+                    phases.mark("serialize")
+                    message["headers"] = [
+                        *message.get("headers", ()),
+                        (SERVER_TIMING_HEADER, phases.header().encode("latin-1")),
+                    ]
+                    if self.metrics is not None:
+                        phases.record(self.metrics)
+            await send(message)
+
+        await self.app(scope, receive, send_with_timing)
@@ -0,0 +1,85 @@
+"""
+Invoice request validation, run before the invoice handler logs, renders or
+numbers anything.
+
+One pass over the items checks GTINs, tax labels and line totals while summing
+the invoice total; the referent document and payment checks follow. Every
+violation is collected, so the client sees all problems of a rejected request
+in a single error response. Amounts are compared in integer units (money.py).
+"""
+
+from ofs_mockup_srv.money import format_amount, line_units, to_units
+from ofs_mockup_srv.records import Invoice
+
+# Amounts are rounded to cents by clients
+TOLERANCE = to_units(0.01)
+
+
+class InvoiceCheck:
+    """Result of ``check_invoice``."""
+
+    __slots__ = ("violations", "total", "payment_total", "bad_request")
+
+    def __init__(self) -> None:
+        self.violations: list[str] = []
+        # Units (see money.py)
+        self.total = 0
+        self.payment_total = 0
+        # Copy without a referent document is answered with HTTP 400 (documented)
+        self.bad_request = False
+
+    def __bool__(self) -> bool:
+        return not self.violations
+
+    @property
+    def message(self) -> str:
+        return "; ".join(self.violations)
+
+
+def valid_label(label: str) -> bool:
+    """Tax labels are single letters (Latin or Cyrillic)."""
+    return len(label) == 1 and label.isalpha()
+
+
+def differs(a: int, b: int) -> bool:
+    return abs(a - b) > TOLERANCE
+
+
+def check_invoice(invoice: Invoice) -> InvoiceCheck:
+    """Validate an invoice request record and total it."""
+    check = InvoiceCheck()
+    violations = check.violations
+    total = 0
+    for item in invoice.items:
+        amount = item.total
+        total += amount
+        if not item.gtin or not item.gtin.strip():
+            violations.append(f"gtin za artikal {item.name} nije popunjen")
+        if not item.labels:
+            violations.append(f"artikal {item.name} nema poresku oznaku")
+        else:
+            for label in item.labels:
+                if not valid_label(label):
+                    violations.append(f"artikal {item.name} ima neispravnu poresku oznaku {label!r}")
+        expected = line_units(item.quantity, item.unit_price, item.discount, item.discount_amount)
+        if differs(expected, amount):
+            violations.append(
+                f"totalAmount za artikal {item.name} je {format_amount(amount)}, "
+                f"a quantity x unitPrice - popust je {format_amount(expected)}"
+            )
+    check.total = total
+
+    has_reference = invoice.referent_number and invoice.referent_dt
+    if invoice.invoice_type == "Copy" and not has_reference:
+        violations.append("Copy ne sadrzi referentDocumentNumber and DT")
+        check.bad_request = True
+    if invoice.transaction_type == "Refund" and not has_reference:
+        violations.append("Refund ne sadrzi referentDocumentNumber and referentDocumentDT")
+
+    check.payment_total = sum(payment.amount for payment in invoice.payments)
+    if differs(total, check.payment_total):
+        violations.append(
+            f"Total amount mismatch: calculated {format_amount(total)} "
+            f"but payment is {format_amount(check.payment_total)}"
+        )
+    return check
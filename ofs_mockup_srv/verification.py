@@ -0,0 +1,165 @@
+"""
+Invoice verification URL and QR code.
+
+The URL carries the SUF verification payload of the invoice, laid out like the
+device's: counters, total, time, invoice and transaction type, buyer, the
+internal data and signature, and an MD5 of all of it, base64 encoded after
+``?vl=``. The QR code of the URL is CPU-bound pure Python (qr.py), so it is
+encoded in a process pool while the event loop keeps serving, and kept by
+invoice number so reprints and GET /api/invoices do not encode it again.
+"""
+
+import asyncio
+import atexit
+import base64
+import datetime
+import hashlib
+import multiprocessing
+import os
+import struct
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from ofs_mockup_srv.cache import SingleFlight, TTLCache
+from ofs_mockup_srv.columns import INVOICE_TYPES, TRANSACTION_TYPES
+from ofs_mockup_srv.metrics import Metrics
+from ofs_mockup_srv.qr import gif_base64
+
+VERIFICATION_URL = "https://suf.poreskaupravars.org/v/?vl="
+PAYLOAD_VERSION = 3
+DEFAULT_QR_WORKERS = 2
+DEFAULT_QR_CACHE_SIZE = 10_000
+# Set in QR worker processes only (see qrworker.py)
+QR_WORKER_ENV = "OFS_MOCKUP_QR_WORKER"
+
+# version, requestedBy, signedBy, totalCounter, transactionTypeCounter, totalAmount
+_HEADER = struct.Struct("<B8s8sIIq")
+# sdcDateTime (ms, big endian), invoiceType, transactionType
+_ISSUED = struct.Struct(">QBB")
+
+
+def verification_url(
+    *,
+    requested_by: str,
+    signed_by: str,
+    total_counter: int,
+    transaction_type_counter: int,
+    total: int,
+    sdc_date_time: str,
+    invoice_type: str,
+    transaction_type: str,
+    buyer_id: str | None,
+    encrypted_internal_data: str,
+    signature: str,
+) -> str:
+    """``verificationUrl`` of an invoice (``total`` in units, base64 internal data and signature)."""
+    issued = datetime.datetime.fromisoformat(sdc_date_time)
+    buyer = (buyer_id or "").encode("utf-8")[:255]
+    payload = b"".join(
+        (
+            _HEADER.pack(
+                PAYLOAD_VERSION,
+                requested_by.encode("ascii"),
+                signed_by.encode("ascii"),
+                total_counter,
+                transaction_type_counter,
+                total,
+            ),
+            _ISSUED.pack(
+                round(issued.timestamp() * 1000),
+                INVOICE_TYPES.code(invoice_type),
+                TRANSACTION_TYPES.code(transaction_type),
+            ),
+            bytes((len(buyer),)),
+            buyer,
+            base64.b64decode(encrypted_internal_data),
+            base64.b64decode(signature),
+        )
+    )
+    payload += hashlib.md5(payload).digest()
+    return VERIFICATION_URL + base64.b64encode(payload).decode("ascii")
+
+
+def _exit_with_server(pid: int) -> None:
+    """Pool worker initializer: exit once the server process is gone.
+
+    A server stopped by a signal skips interpreter cleanup (uvicorn re-raises
+    SIGTERM after shutting down), and its workers would wait for work forever.
+    """
+
+    def watch() -> None:
+        while True:
+            time.sleep(1.0)
+            try:
+                os.kill(pid, 0)
+            except ProcessLookupError:
+                os._exit(0)
+
+    threading.Thread(target=watch, daemon=True).start()
+
+
+class QRCodes:
+    """Verification QR codes (base64 GIF) by invoice number.
+
+    ``workers=0`` encodes in the default thread pool instead of processes.
+    Entries remember their URL: an invoice number issued again after a reset
+    gets a new code.
+    """
+
+    def __init__(self, workers: int = DEFAULT_QR_WORKERS, maxsize: int = DEFAULT_QR_CACHE_SIZE, metrics: Metrics | None = None):
+        self.workers = workers
+        self.metrics = metrics
+        self._codes = TTLCache(maxsize=maxsize, ttl=None)
+        self._inflight = SingleFlight()
+        self._pool: ProcessPoolExecutor | None = None
+
+    def cached(self, number: str, url: str) -> str | None:
+        entry: tuple[str, str] | None = self._codes.get(number)
+        if entry is not None and entry[0] == url:
+            return entry[1]
+        return None
+
+    async def get(self, number: str, url: str) -> str:
+        image = self.cached(number, url)
+        if image is not None:
+            self._incr("qr.hit")
+            return image
+        self._incr("qr.coalesced" if (number, url) in self._inflight else "qr.encoded")
+
+        async def encode() -> str:
+            started = time.perf_counter()
+            image = await asyncio.get_running_loop().run_in_executor(self._executor(), gif_base64, url)
+            if self.metrics is not None:
+                self.metrics.observe("qr.encode", time.perf_counter() - started)
+            self._codes.set(number, (url, image))
+            return image
+
+        return await self._inflight.do((number, url), encode)
+
+    def close(self) -> None:
+        if self._pool is not None:
+            atexit.unregister(self.close)
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def _executor(self) -> ProcessPoolExecutor | None:
+        if not self.workers:
+            return None
+        if self._pool is None:
+            # Workers forked from the server would inherit its listening socket
+            # (and outlive it); a fork server starts them from a clean process
+            # that has imported qrworker rather than the server's __main__
+            context = None
+            if "forkserver" in multiprocessing.get_all_start_methods():
+                context = multiprocessing.get_context("forkserver")
+                context.set_forkserver_preload(["ofs_mockup_srv.qrworker"])
+            self._pool = ProcessPoolExecutor(
+                self.workers, mp_context=context, initializer=_exit_with_server, initargs=(os.getpid(),)
+            )
+            atexit.register(self.close)
+        return self._pool
+
+    def _incr(self, name: str) -> None:
+        if self.metrics is not None:
+            self.metrics.incr(name)
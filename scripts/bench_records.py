@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+Memory and allocations per invoice: pydantic API models vs internal records.
+
+Builds N generated invoices both as ``InvoiceRequest`` models and as
+``records.Invoice`` and reports, per invoice, the memory kept alive, the
+allocations made while converting, and the time of each conversion.
+
+    python scripts/bench_records.py --count 20000
+"""
+
+import argparse
+import gc
+import sys
+import time
+import tracemalloc
+
+from ofs_mockup_srv.generator import generate_invoices
+from ofs_mockup_srv.main import InvoiceRequest
+from ofs_mockup_srv.records import Invoice
+from ofs_mockup_srv.store import InvoiceStore
+
+
+def measure(label: str, build, count: int) -> list:
+    """Build ``count`` objects, printing retained bytes, allocations and time per object."""
+    gc.collect()
+    blocks = sys.getallocatedblocks()
+    tracemalloc.start()
+    kept = build()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    gc.collect()
+    allocated = sys.getallocatedblocks() - blocks
+
+    started = time.perf_counter()
+    build()
+    elapsed = time.perf_counter() - started
+    print(
+        f"{label:<34} {current / count:8.0f} B  {allocated / count:7.1f} blocks  "
+        f"{elapsed / count * 1e6:7.2f} us"
+    )
+    return kept
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--count", type=int, default=20000, help="Invoices (default: 20000)")
+    args = parser.parse_args()
+    count = args.count
+
+    docs = list(generate_invoices(InvoiceStore(), count, seed=1))
+    requests = [doc["invoiceRequest"] for doc in docs]
+    print(f"{count} invoices, {sum(len(r['items']) for r in requests) / count:.1f} items each")
+    print(f"{'per invoice':<34} {'memory':>10}  {'blocks':>14}  {'time':>10}")
+
+    models = measure("InvoiceRequest (pydantic)", lambda: [InvoiceRequest(**r) for r in requests], count)
+    records = measure("Invoice record from model", lambda: [Invoice.from_request(m) for m in models], count)
+    measure("Invoice record from journal doc", lambda: [Invoice.from_doc(d) for d in docs], count)
+    measure("invoiceRequest dict: model_dump", lambda: [m.model_dump() for m in models], count)
+    measure("invoiceRequest dict: request_dict", lambda: [r.request_dict() for r in records], count)
+
+
+if __name__ == "__main__":
+    main()
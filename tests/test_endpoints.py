@@ -217,3 +217,797 @@ def test_wrong_password_4_times_lock():
         )
         assert r4.status_code == 200 and r4.text == "1300"
         assert client.get("/api/attention", headers=auth_headers()).status_code == 404
+
+
+def valid_invoice_payload(amount: float = 10.0) -> dict:
+    return {
+        "invoiceRequest": {
+            "invoiceType": "Normal",
+            "transactionType": "Sale",
+            "payment": [{"amount": amount, "paymentType": "Cash"}],
+            "items": [
+                {
+                    "name": "Scenario Item",
+                    "gtin": "12345678",
+                    "labels": ["F"],
+                    "totalAmount": amount,
+                    "unitPrice": amount,
+                    "quantity": 1.0,
+                }
+            ],
+            "cashier": "Tester",
+        }
+    }
+
+
+def test_scenario_every_nth_invoice_error_and_lock():
+    rules = {
+        "rules": [
+            {"on": "invoice", "every": 2, "action": "error", "message": "Out of paper", "statusCode": -10},
+            {"on": "invoice", "at": 3, "action": "lock"},
+        ]
+    }
+    with TestClient(app) as client:
+        assert client.post("/mock/unlock").status_code == 200
+        r = client.post("/mock/scenario", json=rules)
+        assert r.status_code == 200 and r.json()["counts"]["invoice"] == 0
+
+        results = [
+            client.post("/api/invoices", headers=auth_headers(), json=valid_invoice_payload()).json()
+            for _ in range(4)
+        ]
+        assert "invoiceNumber" in results[0]
+        assert results[1] == {"details": None, "message": "Out of paper", "statusCode": -10}
+        assert "invoiceNumber" in results[2]
+        assert results[3]["statusCode"] == -10
+        # The 3rd invoice locked the device
+        assert client.get("/api/attention", headers=auth_headers()).status_code == 404
+
+        assert client.get("/mock/scenario").json()["counts"]["invoice"] == 4
+        assert client.post("/mock/scenario", json={"rules": [{"on": "pin", "action": "boom"}]}).status_code == 400
+
+        client.delete("/mock/scenario")
+        client.post("/mock/unlock")
+
+
+def test_scenario_pin_failure_window():
+    with TestClient(app) as client:
+        client.post("/mock/lock")
+        client.post("/mock/scenario", json=[{"on": "pin", "for_seconds": 30, "action": "fail"}])
+        r = client.post(
+            "/api/pin",
+            headers={**auth_headers(), "Content-Type": "text/plain"},
+            content=PIN,
+        )
+        assert r.text == "2400"
+        client.delete("/mock/scenario")
+        r = client.post(
+            "/api/pin",
+            headers={**auth_headers(), "Content-Type": "text/plain"},
+            content=PIN,
+        )
+        assert r.text == "0100"
+
+
+def test_idempotency_key_replays_original_invoice():
+    headers = {**auth_headers(), "Idempotency-Key": "pos-retry-1"}
+    with TestClient(app) as client:
+        first = client.post("/api/invoices", headers=headers, json=valid_invoice_payload(12.5))
+        retry = client.post("/api/invoices", headers=headers, json=valid_invoice_payload(12.5))
+        other = client.post(
+            "/api/invoices",
+            headers={**auth_headers(), "Idempotency-Key": "pos-retry-2"},
+            json=valid_invoice_payload(12.5),
+        )
+    assert first.status_code == 200 and retry.status_code == 200
+    assert retry.content == first.content
+    assert retry.headers.get("idempotent-replayed") == "true"
+    assert "idempotent-replayed" not in other.headers
+
+
+def test_concurrent_idempotent_retries_issue_once():
+    import asyncio
+
+    import httpx
+
+    headers = {**auth_headers(), "Idempotency-Key": "pos-retry-concurrent"}
+
+    async def retries():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://mock") as client:
+            return await asyncio.gather(
+                *(client.post("/api/invoices", headers=headers, json=valid_invoice_payload(12.5)) for _ in range(3))
+            )
+
+    with TestClient(app) as client:
+        client.post("/mock/reset")
+        issued = len(app.state.store)
+        responses = asyncio.run(retries())
+        assert len(app.state.store) == issued + 1
+        assert len({r.json()["invoiceNumber"] for r in responses}) == 1
+        assert sum(r.headers.get("idempotent-replayed") == "true" for r in responses) == 2
+
+        # The same key with another invoice is refused, not replayed
+        reused = client.post("/api/invoices", headers=headers, json=valid_invoice_payload(20.0))
+        assert reused.status_code == 422
+        assert len(app.state.store) == issued + 1
+        client.post("/mock/reset")
+
+
+def test_ttl_cache_bounds_and_expiry():
+    from ofs_mockup_srv.cache import TTLCache
+
+    now = [0.0]
+    cache = TTLCache(maxsize=2, ttl=10, clock=lambda: now[0])
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1  # "a" becomes most recently used
+    cache.set("c", 3)
+    assert "b" not in cache and len(cache) == 2
+    now[0] = 10.0
+    assert cache.get("a") is None and cache.get("c") is None
+
+
+def test_snapshot_and_restore_device_state(tmp_path):
+    path = str(tmp_path / "device.snap")
+    with TestClient(app) as client:
+        issued = client.post("/api/invoices", headers=auth_headers(), json=valid_invoice_payload(7.0)).json()
+        number = issued["invoiceNumber"]
+        client.post("/mock/lock")
+        saved = client.post("/mock/snapshot", json={"path": path})
+        assert saved.status_code == 200 and saved.json()["invoices"] >= 1
+
+        # Diverge from the snapshot, then restore it
+        client.post("/mock/unlock")
+        after = client.post("/api/invoices", headers=auth_headers(), json=valid_invoice_payload(8.0)).json()
+        restored = client.post("/mock/restore", json={"path": path}).json()
+        assert restored["current_api_attention"] == 404
+        assert restored["total_counter"] == int(number.rsplit("-", 1)[1])
+
+        doc = client.get(f"/api/invoices/{number}").json()
+        assert doc["invoiceResponse"]["totalAmount"] == 7.0
+        assert doc["invoiceRequest"]["items"][0]["gtin"] == "12345678"
+        # Invoices issued after the snapshot are gone, numbering continues from the snapshot
+        assert client.get(f"/api/invoices/{after['invoiceNumber']}").json()["invoiceResponse"]["totalAmount"] == 100
+        again = client.post("/api/invoices", headers=auth_headers(), json=valid_invoice_payload(9.0)).json()
+        assert again["invoiceNumber"] == after["invoiceNumber"]
+
+        assert client.post("/mock/restore", json={"path": str(tmp_path / "missing")}).status_code == 400
+        snapshot = open(path, "rb").read()
+        for size in (8, 10, 40, len(snapshot) - 1):
+            (tmp_path / "truncated.snap").write_bytes(snapshot[:size])
+            r = client.post("/mock/restore", json={"path": str(tmp_path / "truncated.snap")})
+            assert r.status_code == 400, size
+        client.post("/mock/unlock")
+
+
+def test_generator_is_deterministic_and_searchable():
+    from ofs_mockup_srv.generator import populate
+    from ofs_mockup_srv.store import InvoiceStore
+
+    a, b = InvoiceStore(), InvoiceStore()
+    populate(a, 500, seed=7)
+    populate(b, 500, seed=7)
+    assert len(a) == 500
+    assert [a[i] for i in range(500)] == [b[i] for i in range(500)]
+    assert {a[i]["invoiceRequest"]["invoiceType"] for i in range(500)} == {"Normal", "Advance", "Copy"}
+
+    c = InvoiceStore()
+    populate(c, 500, seed=8)
+    assert c[0] != a[0]
+
+    hits = list(
+        a.search(dt.date(2024, 1, 1), dt.date(2024, 12, 31), invoice_types=["Copy"], payment_types=["Card"])
+    )
+    assert hits and all(h["invoiceRequest"]["invoiceType"] == "Copy" for h in hits)
+
+
+def test_invoice_search_reads_issued_invoices():
+    with TestClient(app) as client:
+        number = client.post("/api/invoices", headers=auth_headers(), json=valid_invoice_payload(42.0)).json()[
+            "invoiceNumber"
+        ]
+        r = client.post(
+            "/api/invoices/search",
+            headers=auth_headers(),
+            json={
+                "fromDate": dt.date.today().isoformat(),
+                "toDate": dt.date.today().isoformat(),
+                "invoiceTypes": ["Normal"],
+                "transactionTypes": ["Sale"],
+                "paymentTypes": ["Cash"],
+                "amountFrom": 42,
+                "amountTo": 42,
+            },
+        )
+    assert r.status_code == 200
+    assert f"{number},Normal,Sale," in r.text
+
+
+def test_prod_profile_disables_reload():
+    import argparse
+
+    from ofs_mockup_srv.serving import add_profile_arguments, uvicorn_options
+
+    parser = argparse.ArgumentParser()
+    add_profile_arguments(parser)
+    assert uvicorn_options(parser.parse_args([])) == {"reload": True, "workers": 1}
+
+    opts = uvicorn_options(parser.parse_args(["--profile", "prod", "--workers", "4", "--limit-concurrency", "500"]))
+    assert opts["reload"] is False and opts["workers"] == 4
+    assert opts["limit_concurrency"] == 500
+    assert opts["loop"] in ("uvloop", "asyncio") and opts["http"] in ("httptools", "h11")
+
+
+def test_reset_to_clean_and_named_baselines():
+    with TestClient(app) as client:
+        client.post("/mock/reset")
+        client.post("/mock/unlock")
+        first = client.post("/api/invoices", headers=auth_headers(), json=valid_invoice_payload(5.0)).json()
+        saved = client.post("/mock/baseline", json={"name": "one-invoice"}).json()
+        assert saved["invoices"] >= 1 and saved["current_api_attention"] == 200
+
+        second = client.post("/api/invoices", headers=auth_headers(), json=valid_invoice_payload(6.0)).json()
+        client.post("/mock/lock")
+
+        r = client.post("/mock/reset", json={"baseline": "one-invoice"})
+        assert r.status_code == 200 and r.json()["current_api_attention"] == 200
+        assert client.get(f"/api/invoices/{first['invoiceNumber']}").json()["invoiceResponse"]["totalAmount"] == 5.0
+        assert client.get(f"/api/invoices/{second['invoiceNumber']}").json()["invoiceResponse"]["totalAmount"] == 100
+        # Numbering continues from the baseline's counters
+        again = client.post("/api/invoices", headers=auth_headers(), json=valid_invoice_payload(6.0)).json()
+        assert again["invoiceNumber"] == second["invoiceNumber"]
+
+        generation = r.json()["generation"]
+        clean = client.post("/mock/reset").json()
+        assert clean["baseline"] == "clean" and clean["generation"] == generation + 1
+        assert client.get(f"/api/invoices/{first['invoiceNumber']}").json()["invoiceResponse"]["totalAmount"] == 100
+
+        assert client.post("/mock/reset", json={"baseline": "missing"}).status_code == 404
+        assert client.post("/mock/reset", json={"device": "other-device"}).status_code == 404
+        assert "one-invoice" in [b["name"] for b in client.get("/mock/baseline").json()]
+        client.post("/mock/unlock")
+
+
+def test_missing_authorization_header_is_401():
+    with TestClient(app) as client:
+        r = client.get("/api/attention")
+        r_invoice = client.post("/api/invoices", json=valid_invoice_payload())
+    assert r.status_code == 401
+    assert r_invoice.status_code == 401
+
+
+def test_api_key_registry_throttles_and_revokes():
+    with TestClient(app) as client:
+        client.post("/mock/unlock")
+        added = client.post("/mock/api-keys", json={"key": "erp-key-1", "rate": 0.001, "burst": 2, "name": "erp"})
+        assert added.status_code == 200 and added.json()["name"] == "erp"
+        assert "erp-key-1" not in added.text
+
+        codes = [client.get("/api/attention", headers=auth_headers("erp-key-1")).status_code for _ in range(3)]
+        assert codes == [200, 200, 429]
+        throttled = client.get("/api/attention", headers=auth_headers("erp-key-1"))
+        assert int(throttled.headers["retry-after"]) > 0
+
+        assert client.request("DELETE", "/mock/api-keys", json={"key": "erp-key-1"}).status_code == 200
+        # Cached per-connection result must not outlive the revocation
+        assert client.get("/api/attention", headers=auth_headers("erp-key-1")).status_code == 401
+        assert client.get("/api/attention", headers=auth_headers()).status_code == 200
+
+
+def test_compression_negotiation_and_precompressed_payloads():
+    with TestClient(app) as client:
+        client.post("/mock/reset")
+        client.delete("/mock/metrics")
+
+        plain = client.get("/api/status", headers={**auth_headers(), "Accept-Encoding": "identity"})
+        assert "content-encoding" not in plain.headers
+
+        gz = client.get("/api/status", headers={**auth_headers(), "Accept-Encoding": "gzip"})
+        assert gz.headers["content-encoding"] == "gzip"
+        assert int(gz.headers["content-length"]) < len(plain.content)
+        assert gz.json() == plain.json()
+        deflated = client.get("/api/status", headers={**auth_headers(), "Accept-Encoding": "gzip;q=0.5, deflate"})
+        assert deflated.headers["content-encoding"] == "deflate"
+        for refused in ("gzip;q=0", "*;q=0", "identity, gzip;q=0", "gzip;q=0, deflate;q=0, *"):
+            r = client.get("/api/status", headers={**auth_headers(), "Accept-Encoding": refused})
+            assert "content-encoding" not in r.headers, refused
+
+        # Small bodies stay uncompressed
+        assert "content-encoding" not in client.get("/", headers={"Accept-Encoding": "gzip"}).headers
+
+        client.get("/api/status", headers={**auth_headers(), "Accept-Encoding": "gzip"})
+        metrics = client.get("/mock/metrics").json()
+        # The status body was compressed once per encoding, then reused
+        assert metrics["timers"]["compression.gzip"]["count"] == 1
+        assert metrics["counters"]["compression.precompressed_hits"] == 1
+        assert metrics["counters"]["payloads.hit"] >= 2
+
+
+def test_raw_receipt_image_with_range_requests():
+    with TestClient(app) as client:
+        pdf = client.get("/api/invoices/AX4F7Y5L-BX4F7Y5L-001/pdf", headers=auth_headers())
+        assert pdf.status_code == 200
+        assert pdf.headers["content-type"] == "application/pdf"
+        assert int(pdf.headers["content-length"]) == len(pdf.content)
+        assert pdf.content.startswith(b"%PDF") and "content-encoding" not in pdf.headers
+
+        part = client.get("/api/invoices/AX4F7Y5L-BX4F7Y5L-001/pdf", headers={**auth_headers(), "Range": "bytes=0-99"})
+        assert part.status_code == 206
+        assert part.content == pdf.content[:100]
+        assert part.headers["content-range"] == f"bytes 0-99/{len(pdf.content)}"
+
+        png = client.get("/api/invoices/AX4F7Y5L-BX4F7Y5L-001/png", headers=auth_headers())
+        assert png.headers["content-type"] == "image/png" and png.content.startswith(b"\x89PNG")
+
+        assert client.get("/api/invoices/AX4F7Y5L-BX4F7Y5L-001/pdf").status_code == 401
+        assert client.get("/api/invoices/AX4F7Y5L-BX4F7Y5L-001/gif", headers=auth_headers()).status_code == 404
+
+
+def test_get_invoice_etag_and_coalesced_builds():
+    import asyncio
+
+    import httpx
+
+    with TestClient(app) as client:
+        client.post("/mock/reset")
+        client.post("/mock/unlock")
+        number = client.post("/api/invoices", headers=auth_headers(), json=valid_invoice_payload(7.0)).json()["invoiceNumber"]
+        first = client.get(f"/api/invoices/{number}?receiptLayout=Slip")
+        etag = first.headers["etag"]
+        assert first.json()["invoiceResponse"]["totalAmount"] == 7.0
+
+        cached = client.get(f"/api/invoices/{number}", params={"receiptLayout": "Slip"}, headers={"If-None-Match": etag})
+        assert cached.status_code == 304 and cached.content == b""
+        # Each encoding is a different representation with its own ETag
+        identity = client.get(f"/api/invoices/{number}?receiptLayout=Slip", headers={"Accept-Encoding": "identity"})
+        assert identity.status_code == 200 and identity.headers["etag"] != etag
+        assert client.get(
+            f"/api/invoices/{number}?receiptLayout=Slip", headers={"Accept-Encoding": "identity", "If-None-Match": etag}
+        ).status_code == 200
+        # Other query parameters are a different response
+        assert client.get(f"/api/invoices/{number}?receiptLayout=Invoice").headers["etag"] != etag
+
+    async def burst():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as ac:
+            return await asyncio.gather(*(ac.get(f"/api/invoices/{number}?imageFormat=Png") for _ in range(20)))
+
+    app.state.metrics.clear()
+    responses = asyncio.run(burst())
+    assert {r.headers["etag"] for r in responses} == {responses[0].headers["etag"]}
+    counters = app.state.metrics.snapshot()["counters"]
+    assert counters["payloads.miss"] == 1
+    assert counters.get("payloads.coalesced", 0) + counters.get("payloads.hit", 0) == 19
+
+
+def test_invoice_search_cursor_pagination():
+    from ofs_mockup_srv.generator import populate
+
+    query = {
+        "fromDate": "2024-01-01",
+        "toDate": "2024-12-31",
+        "invoiceTypes": ["Normal", "Advance", "Copy"],
+        "transactionTypes": ["Sale", "Refund"],
+        "paymentTypes": ["Cash", "Card", "WireTransfer", "Other"],
+    }
+    with TestClient(app) as client:
+        client.post("/mock/reset")
+        populate(app.state.store, 250, seed=3)
+        everything = client.post("/api/invoices/search", headers=auth_headers(), json=query)
+        assert "next-cursor" not in everything.headers
+
+        rows, cursor, pages = [], None, 0
+        while True:
+            page = client.post("/api/invoices/search", headers=auth_headers(), json={**query, "pageSize": 40, "cursor": cursor})
+            lines = page.json().splitlines()
+            assert len(lines) <= 40
+            rows += lines
+            pages += 1
+            cursor = page.headers.get("next-cursor")
+            if cursor is None:
+                break
+        assert rows == everything.json().splitlines() and pages == -(-len(rows) // 40)
+
+        bad = client.post("/api/invoices/search", headers=auth_headers(), json={**query, "cursor": "not-a-cursor"})
+        assert bad.status_code == 400
+        client.post("/mock/reset")
+
+
+def test_invoice_aggregate_matches_search_totals():
+    from ofs_mockup_srv.generator import populate
+    from ofs_mockup_srv.store import InvoiceStore
+
+    store = InvoiceStore()
+    populate(store, 400, seed=11)
+    layered = store.layer()
+    # A second history restarting at the same date: the layer is out of order (scan path)
+    populate(layered, 100, seed=12)
+    assert store.ordered and not layered.ordered
+    ranges = [(dt.date(2024, 1, 1), dt.date(2024, 12, 31)), (dt.date(2024, 3, 5), dt.date(2024, 3, 20))]
+    for journal, (first, last) in [(j, r) for j in (store, layered) for r in ranges]:
+        hits = list(journal.search(first, last))
+        totals = journal.aggregate(first, last)
+        assert totals.get("all", (0, 0))[0] == len(hits)
+        assert totals.get("all", (0, 0))[1] == sum(round(h["invoiceResponse"]["totalAmount"] * 10_000) for h in hits)
+        refunds = [h for h in hits if h["invoiceRequest"]["transactionType"] == "Refund"]
+        assert totals.get("transactionType:Refund", (0, 0))[0] == len(refunds)
+
+    with TestClient(app) as client:
+        client.post("/mock/reset")
+        client.post("/mock/unlock")
+        for amount in (10.0, 2.5):
+            client.post("/api/invoices", headers=auth_headers(), json=valid_invoice_payload(amount))
+        today = dt.date.today().isoformat()
+        r = client.post("/api/invoices/aggregate", headers=auth_headers(), json={"fromDate": today, "toDate": today})
+        assert r.status_code == 200
+        body = r.json()
+        assert body["count"] == 2 and body["totalAmount"] == 12.5
+        assert body["paymentTypes"]["Cash"] == {"count": 2, "totalAmount": 12.5}
+        assert body["transactionTypes"]["Sale"]["count"] == 2
+        assert client.post("/api/invoices/aggregate", json={"fromDate": today, "toDate": today}).status_code == 401
+
+
+def test_columnar_index_is_compact_and_consistent(tmp_path):
+    from ofs_mockup_srv.aggregate import categories, merge
+    from ofs_mockup_srv.records import Invoice
+    from ofs_mockup_srv.generator import populate
+    from ofs_mockup_srv.snapshot import read_snapshot, write_snapshot
+    from ofs_mockup_srv.store import InvoiceStore
+
+    store = InvoiceStore()
+    populate(store, 300, seed=5)
+    write_snapshot(str(tmp_path / "h.snap"), {}, store.records())
+    restored = InvoiceStore(store.total_counter, base=read_snapshot(str(tmp_path / "h.snap"))).layer()
+    populate(restored, 150, seed=6, start=dt.datetime(2025, 1, 1))
+    assert restored.ordered and len(restored) == 450
+    # Appending only reads the snapshot's last record, not all of it
+    assert restored.base._base_columns_cache is None
+
+    columns = restored._columns
+    arrays = [columns.timestamps, columns.amounts, columns.paid, columns.numbers,
+              columns.invoice_types, columns.transaction_types, columns.payments]
+    assert sum(a.itemsize for a in arrays) + 8 < 64  # + journal file offset
+
+    number = restored.number(310)
+    assert restored.find(number) == 310 and restored[310]["invoiceResponse"]["invoiceNumber"] == number
+    for first, last in [(dt.date(2024, 1, 1), dt.date(2025, 12, 31)), (dt.date(2024, 6, 3), dt.date(2025, 1, 1))]:
+        expected = {}
+        for doc in restored.search(first, last):
+            expected = merge(expected, {k: (1, v) for k, v in categories(Invoice.from_doc(doc)).items()})
+        totals = restored.aggregate(first, last)
+        assert {k: v for k, v in totals.items() if v[0]} == expected
+
+
+def test_invoice_search_by_gtin_cashier_and_buyer():
+    from ofs_mockup_srv.generator import populate
+
+    query = {
+        "fromDate": "2024-01-01",
+        "toDate": "2024-12-31",
+        "invoiceTypes": [],
+        "transactionTypes": [],
+        "paymentTypes": [],
+    }
+    with TestClient(app) as client:
+        client.post("/mock/reset")
+        populate(app.state.store, 400, seed=9)
+        store = app.state.store
+        docs = [store[i] for i in range(len(store))]
+        gtin = docs[0]["invoiceRequest"]["items"][0]["gtin"]
+        cashier = docs[0]["invoiceRequest"]["cashier"]
+        buyer = next(d["invoiceRequest"]["buyerId"] for d in docs if d["invoiceRequest"]["buyerId"])
+
+        def numbers(**keys):
+            r = client.post("/api/invoices/search", headers=auth_headers(), json={**query, **keys})
+            return [line.split(",")[0] for line in r.json().splitlines()]
+
+        def expected(match):
+            return [d["invoiceResponse"]["invoiceNumber"] for d in docs if match(d["invoiceRequest"])]
+
+        assert numbers(gtin=gtin) == expected(lambda r: any(i["gtin"] == gtin for i in r["items"]))
+        assert numbers(buyerId=buyer) == expected(lambda r: r["buyerId"] == buyer)
+        assert numbers(gtin=gtin, cashier=cashier) == expected(
+            lambda r: r["cashier"] == cashier and any(i["gtin"] == gtin for i in r["items"])
+        )
+        assert numbers(gtin="no-such-gtin") == []
+        client.post("/mock/reset")
+
+
+def test_sqlite_journal_survives_restart(tmp_path):
+    from ofs_mockup_srv.main import attach_journal, reset_state
+    from ofs_mockup_srv.persist import SQLiteJournal
+
+    path = str(tmp_path / "ofs.db")
+    with TestClient(app) as client:
+        client.post("/mock/reset")
+        clean = len(app.state.store)
+        journal = SQLiteJournal(path, durability="invoice")
+        attach_journal(journal)
+        try:
+            numbers = []
+            for amount in (10.0, 20.0, 30.0):
+                r = client.post("/api/invoices", headers=auth_headers(), json=valid_invoice_payload(amount))
+                numbers.append(r.json()["invoiceNumber"])
+            client.post("/mock/lock")
+            journal.flush()
+
+            reloaded = SQLiteJournal(path)
+            segment = reloaded.segment()
+            assert len(segment) == clean + 3
+            assert segment[segment.find(numbers[1])]["invoiceResponse"]["totalAmount"] == 20.0
+            assert reloaded.state()["current_api_attention"] == 404
+            assert reloaded.state()["total_counter"] == app.state.store.total_counter
+            reloaded.close()
+
+            client.post("/mock/reset")
+            journal.flush()
+            reloaded = SQLiteJournal(path)
+            assert len(reloaded.segment()) == clean
+            assert reloaded.segment().find(numbers[0]) is None
+            reloaded.close()
+        finally:
+            attach_journal(None)
+            journal.close()
+            reset_state()
+
+
+def test_event_bus_serializes_once_and_drops_oldest():
+    import asyncio
+    from ofs_mockup_srv.events import EventBus
+
+    async def run():
+        bus = EventBus(queue_size=2)
+        everything, invoices = bus.subscribe(), bus.subscribe(["invoice.issued"])
+        for n in range(3):
+            bus.publish("invoice.issued", {"n": n})
+        bus.publish("pin.attempt", {"response": "0100"})
+        assert [f.split(b"\n")[1] for f in everything.frames] == [b"event: invoice.issued", b"event: pin.attempt"]
+        assert invoices.frames[1] is everything.frames[0]  # one serialization for all subscribers
+        assert (everything.dropped, invoices.dropped) == (2, 1)
+
+        stream = bus.stream(heartbeat=0.01)
+        assert await stream.__anext__() == b"retry: 1000\n\n"
+        assert await stream.__anext__() == b": keep-alive\n\n"
+        bus.publish("device.locked", {"current_api_attention": 404})
+        assert b"event: device.locked" in await stream.__anext__()
+        await stream.aclose()
+        assert len(bus) == 2
+
+    asyncio.run(run())
+
+
+def test_events_published_for_invoices_and_lock():
+    with TestClient(app) as client:
+        assert client.get("/mock/events?types=bogus").status_code == 400
+        subscriber = app.state.events.subscribe()
+        try:
+            r = client.post("/api/invoices", headers=auth_headers(), json=valid_invoice_payload(10.0))
+            client.post("/mock/lock")
+            issued, locked = list(subscriber.frames)
+            assert b"event: invoice.issued" in issued and r.json()["invoiceNumber"].encode() in issued
+            assert b"event: device.locked" in locked
+        finally:
+            app.state.events.unsubscribe(subscriber)
+        client.post("/mock/reset")
+
+
+def test_invoice_validation_reports_every_violation():
+    payload = valid_invoice_payload(10.0)
+    request = payload["invoiceRequest"]
+    request["transactionType"] = "Refund"
+    request["payment"][0]["amount"] = 12.0
+    request["items"].append(
+        {"name": "Bad", "labels": ["FF"], "totalAmount": 5.0, "unitPrice": 2.0, "quantity": 2.0, "discountAmount": 0.5}
+    )
+    with TestClient(app) as client:
+        client.post("/mock/reset")
+        before = app.state.store.total_counter
+        r = client.post("/api/invoices", headers=auth_headers(), json=payload)
+        assert r.status_code == 200
+        assert r.json()["message"].split("; ") == [
+            "gtin za artikal Bad nije popunjen",
+            "artikal Bad ima neispravnu poresku oznaku 'FF'",
+            "totalAmount za artikal Bad je 5.00, a quantity x unitPrice - popust je 3.50",
+            "Refund ne sadrzi referentDocumentNumber and referentDocumentDT",
+            "Total amount mismatch: calculated 15.00 but payment is 12.00",
+        ]
+        assert app.state.store.total_counter == before
+
+        request.update(invoiceType="Copy", transactionType="Sale")
+        request["items"].pop()
+        request["payment"][0]["amount"] = 10.0
+        r = client.post("/api/invoices", headers=auth_headers(), json=payload)
+        assert r.status_code == 400 and r.json()["detail"] == "Copy ne sadrzi referentDocumentNumber and DT"
+
+
+def test_money_is_exact_for_many_items():
+    from ofs_mockup_srv.money import format_amount, line_units
+
+    assert format_amount(123450) == "12.35" and format_amount(-5000) == "-0.50"
+    assert line_units(3.0, 1000, None, None) == 3000
+    assert line_units(1.0, 7400, 2.0, None) == 7252  # percentage discount
+    assert line_units(2.0, 1_100_000, 9.09, 200_000) == 2_000_000  # money discount wins
+
+    payload = valid_invoice_payload(0.1)
+    item = payload["invoiceRequest"]["items"][0]
+    payload["invoiceRequest"]["items"] = [dict(item, gtin=str(10_000_000 + i)) for i in range(30_000)]
+    payload["invoiceRequest"]["payment"][0]["amount"] = 3000.0
+    with TestClient(app) as client:
+        r = client.post("/api/invoices", headers=auth_headers(), json=payload)
+        assert r.json()["totalAmount"] == 3000.0
+        payload["invoiceRequest"]["payment"][0]["amount"] = 3000.02
+        r = client.post("/api/invoices", headers=auth_headers(), json=payload)
+        assert r.json()["message"] == "Total amount mismatch: calculated 3000.00 but payment is 3000.02"
+        client.post("/mock/reset")
+
+
+def test_verification_url_and_qr_code_per_invoice():
+    import base64
+    import hashlib
+    import struct
+
+    from ofs_mockup_srv import qr
+    from ofs_mockup_srv.verification import VERIFICATION_URL
+
+    assert [qr.capacity(20, level) for level in "LMQH"] == [858, 666, 482, 382]
+    assert qr.gif(qr.encode(b"x" * 800))[6:10] == struct.pack("<HH", 388, 388)  # version 20, like the device
+
+    with TestClient(app) as client:
+        client.post("/mock/reset")
+        first, second = (
+            client.post("/api/invoices", headers=auth_headers(), json=valid_invoice_payload(amount)).json()
+            for amount in (10.0, 12.5)
+        )
+        url = first["verificationUrl"]
+        assert url.startswith(VERIFICATION_URL)
+        payload = base64.b64decode(url[len(VERIFICATION_URL):])
+        assert hashlib.md5(payload[:-16]).digest() == payload[-16:]
+        assert struct.unpack_from("<IIQ", payload, 17) == (first["totalCounter"], first["transactionTypeCounter"], 100_000)
+        assert first["verificationQRCode"].startswith("R0lGODlh")  # GIF89a
+        assert first["verificationQRCode"] != second["verificationQRCode"]
+
+        hits = app.state.metrics.counters["qr.hit"]
+        reprint = client.get(f"/api/invoices/{first['invoiceNumber']}", headers=auth_headers()).json()
+        assert reprint["invoiceResponse"]["verificationQRCode"] == first["verificationQRCode"]
+        assert app.state.metrics.counters["qr.hit"] == hits + 1
+
+        # Negative totals (all items and payments negative) are issued as before
+        negative = client.post("/api/invoices", headers=auth_headers(), json=valid_invoice_payload(-10.0))
+        assert negative.status_code == 200
+        payload = base64.b64decode(negative.json()["verificationUrl"][len(VERIFICATION_URL):])
+        assert struct.unpack_from("<q", payload, 25) == (-100_000,)
+        assert app.state.store.find(negative.json()["invoiceNumber"]) is not None
+        client.post("/mock/reset")
+
+
+def test_invoices_are_signed_per_invoice_and_in_batches():
+    import asyncio
+    import base64
+
+    from ofs_mockup_srv.metrics import Metrics
+    from ofs_mockup_srv.records import Invoice
+    from ofs_mockup_srv.signing import DEFAULT_KEY, Signer, crypt_internal_data, invoice_digest, sign_digest
+
+    with TestClient(app) as client:
+        client.post("/mock/reset")
+        first, second = (
+            client.post("/api/invoices", headers=auth_headers(), json=valid_invoice_payload(10.0)).json()
+            for _ in range(2)
+        )
+        assert first["signature"] != second["signature"]
+        assert first["encryptedInternalData"] != second["encryptedInternalData"]
+
+        # Anyone holding the device key can verify a signature from the journal
+        invoice = Invoice.from_doc(app.state.store.get(first["invoiceNumber"]))
+        digest = invoice_digest(invoice, first["signedBy"], first["totalCounter"], first["transactionTypeCounter"])
+        assert base64.b64decode(first["signature"]) == sign_digest(DEFAULT_KEY, digest)
+        internal = crypt_internal_data(DEFAULT_KEY, digest, base64.b64decode(first["encryptedInternalData"]))
+        assert internal[:4] == first["totalCounter"].to_bytes(4, "little")
+        client.post("/mock/reset")
+
+    async def burst():
+        signer = Signer(cost=50, metrics=Metrics())
+        signed = await asyncio.gather(*(signer.sign(invoice, "RX4F7Y5L", n, n) for n in range(10)))
+        return signer.metrics.counters, signed
+
+    counters, signed = asyncio.run(burst())
+    assert counters["signing.invoices"] == 10 and counters["signing.batches"] == 1
+    assert len({signature for signature, _ in signed}) == 10
+
+
+def test_clock_can_be_set_and_fast_forwarded():
+    with TestClient(app) as client:
+        r = client.post("/mock/clock", json={"time": "2025-01-31T23:59:30", "rate": 0})
+        assert r.status_code == 200 and r.json()["virtual"] is True
+        status = client.get("/api/status", headers=auth_headers()).json()
+        assert status["sdcDateTime"].startswith("2025-01-31T23:59:30.000")
+
+        first = client.post("/api/invoices", headers=auth_headers(), json=valid_invoice_payload(10.0)).json()
+        client.post("/mock/clock", json={"advance": 86400})
+        second = client.post("/api/invoices", headers=auth_headers(), json=valid_invoice_payload(10.0)).json()
+        assert first["sdcDateTime"] == "2025-01-31T23:59:30"
+        assert second["sdcDateTime"] == "2025-02-01T23:59:30"
+        assert "PFR brijeme:      01.02.2025. 23:59:30\r\n" in second["journal"]
+        status = client.get("/api/status", headers=auth_headers()).json()
+        assert status["sdcDateTime"].startswith("2025-02-01T23:59:30.000")
+
+        assert client.post("/mock/clock", json={"time": "yesterday"}).status_code == 400
+        assert client.post("/mock/clock", json={"rate": -1}).status_code == 400
+        assert client.delete("/mock/clock").json()["virtual"] is False
+        client.post("/mock/reset")
+
+
+def test_profile_requests_by_request_id(tmp_path):
+    import pstats
+
+    with TestClient(app) as client:
+        client.delete("/mock/profile")
+        assert "x-request-id" not in client.get("/api/status", headers=auth_headers()).headers
+
+        assert client.post("/mock/profile", json={"path": 5}).status_code == 400
+        assert client.get("/api/status", headers=auth_headers()).status_code == 200
+        assert client.post("/mock/profile", json={"path": "/api/invoices", "count": 1}).json()["remaining"] == 1
+        client.get("/api/status", headers=auth_headers())  # other path: not profiled
+        r = client.post("/api/invoices", headers=auth_headers(), json=valid_invoice_payload(10.0))
+        request_id = r.headers["x-request-id"]
+        report = client.get(f"/mock/profile/{request_id}", params={"limit": 200}).text
+        assert "(invoice)" in report
+        r = client.post("/api/invoices", headers=auth_headers(), json=valid_invoice_payload(10.0))
+        assert "x-request-id" not in r.headers  # count used up
+
+        client.post("/mock/profile", json={"header": True})
+        headers = {**auth_headers(), "X-Profile": "1", "X-Request-ID": "slow-search"}
+        query = {
+            "fromDate": "2020-01-01",
+            "toDate": "2100-01-01",
+            "invoiceTypes": ["Normal"],
+            "transactionTypes": ["Sale"],
+            "paymentTypes": ["Cash"],
+        }
+        client.post("/api/invoices/search", headers=headers, json=query)
+        profiles = client.get("/mock/profile").json()["profiles"]
+        assert [p["id"] for p in profiles] == [request_id, "slow-search"]
+        assert profiles[1]["path"] == "/api/invoices/search" and profiles[1]["status"] == 200
+
+        (tmp_path / "search.prof").write_bytes(client.get("/mock/profile/slow-search?format=pstats").content)
+        assert pstats.Stats(str(tmp_path / "search.prof")).total_calls > 0
+        assert client.get("/mock/profile/slow-search?sort=nonsense").status_code == 400
+        assert client.get("/mock/profile/unknown").status_code == 404
+        assert client.delete("/mock/profile").json()["profiles"] == []
+        client.post("/mock/reset")
+
+
+def test_server_timing_phases():
+    def phases(response) -> dict[str, float]:
+        entries = (entry.split(";dur=") for entry in response.headers["server-timing"].split(", "))
+        return {name: float(ms) for name, ms in entries}
+
+    with TestClient(app) as client:
+        client.post("/mock/reset")
+        client.post("/mock/scenario", json={"rules": [{"on": "invoice", "action": "delay", "ms": 30}]})
+        r = client.post("/api/invoices", headers=auth_headers(), json=valid_invoice_payload(10.0))
+        timing = phases(r)
+        assert list(timing) == ["parse", "delay", "logic", "render", "serialize", "total"]
+        total = timing.pop("total")
+        assert timing["delay"] >= 30 and abs(sum(timing.values()) - total) < 0.01
+        client.delete("/mock/scenario")
+
+        assert {"parse", "logic", "render", "serialize"} <= set(phases(client.get("/api/status", headers=auth_headers())))
+        number = r.json()["invoiceNumber"]
+        assert "render" in phases(client.get(f"/api/invoices/{number}", headers=auth_headers()))
+        assert "render" not in phases(client.get(f"/api/invoices/{number}", headers=auth_headers()))  # cached
+        query = {
+            "fromDate": "2020-01-01",
+            "toDate": "2100-01-01",
+            "invoiceTypes": ["Normal"],
+            "transactionTypes": ["Sale"],
+            "paymentTypes": ["Cash"],
+        }
+        assert "logic" in phases(client.post("/api/invoices/search", headers=auth_headers(), json=query))
+        assert "server-timing" not in client.get("/").headers
+
+        timers = client.get("/mock/metrics").json()["timers"]
+        assert timers["timing.invoice.delay"]["count"] >= 1
+        assert {"timing.status.total", "timing.get_invoice.render", "timing.search.logic"} <= set(timers)
+        client.post("/mock/reset")
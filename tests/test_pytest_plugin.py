@@ -0,0 +1,26 @@
+import time
+
+import httpx
+
+
+def test_ofs_server_fixture_serves_http(ofs_server):
+    r = httpx.get(ofs_server.url + "/api/attention", headers=ofs_server.headers)
+    assert r.status_code == 200
+    assert httpx.post(ofs_server.url + "/mock/lock").json()["current_api_attention"] == 404
+    assert httpx.get(ofs_server.url + "/api/attention", headers=ofs_server.headers).status_code == 404
+
+
+def test_ofs_server_fixture_resets_between_tests(ofs_server):
+    # The previous test locked the device; the fixture restored it
+    started = time.perf_counter()
+    r = httpx.get(ofs_server.url + "/api/attention", headers=ofs_server.headers)
+    assert r.status_code == 200
+    assert time.perf_counter() - started < 1.0
+
+
+def test_ofs_client_fixture_in_process(ofs_client):
+    r = ofs_client.post(
+        "/api/pin", headers={"Content-Type": "text/plain"}, content=ofs_client.app.state.pin
+    )
+    assert r.text == "0100"
+    assert ofs_client.get("/api/attention").status_code == 200